@@ -0,0 +1,317 @@
+"""
+Micro-benchmarks do motor de substituição e do scoring de busca.
+
+Carrega taco.json e tbca_alimentos.json em um SQLite em memória (nenhum banco
+real é usado) e mede, sobre conjuntos de consultas realistas:
+
+- identificar_grupo_nutricional: todos os nomes das duas tabelas
+- sugerir_substitucoes: amostra fixa de alimentos contra a lista completa de
+  candidatos (como a API antiga chamava)
+- SubstitutionPool.suggest: o caminho usado pelas views, com o pool e o cache
+  de razões aquecidos, em quantidades variadas
+- calcular_score_radical: buscas comuns contra todos os nomes
+
+Para cada função: p50/p95/p99 e média por chamada (µs), o menor valor de
+cada métrica entre `--repeat` passadas (reduz o ruído de outros processos),
+e, numa passada extra com tracemalloc (que distorce o tempo), pico de
+memória e memória retida. O resultado é comparado com o baseline salvo em
+benchmarks/baselines/, métrica a métrica.
+
+Uso (a partir de backend/):
+    python benchmarks/bench_substituicoes.py                 # roda e compara
+    python benchmarks/bench_substituicoes.py --save          # grava o baseline
+    python benchmarks/bench_substituicoes.py --only calcular_score_radical
+    python benchmarks/bench_substituicoes.py --threshold 15 --fail-on-regression
+
+Os tempos dependem da máquina: compare baselines gerados no mesmo ambiente.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BASELINE_PADRAO = Path(__file__).resolve().parent / "baselines" / "substituicoes.json"
+
+# Setup Django com SQLite em memória e cache local (nunca o banco/Redis do .env)
+sys.path.append(str(BACKEND_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "setup.settings")
+os.environ["DATABASE_URL"] = "sqlite://:memory:"
+os.environ["REDIS_URL"] = ""
+
+import django  # noqa: E402
+
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+from diets.models import AlimentoTACO, AlimentoTBCA  # noqa: E402
+from diets.nutritional_substitution import (  # noqa: E402
+    GRUPOS_BLOQUEADOS,
+    identificar_grupo_nutricional,
+    sugerir_substitucoes,
+)
+from diets.search_utils import calcular_score_radical, normalizar_para_scoring  # noqa: E402
+from diets.substitution_pool import get_substitution_pool  # noqa: E402
+
+# Buscas típicas da tela de montagem de dieta
+BUSCAS = [
+    "arroz", "arroz integral", "feijao preto", "frango grelhado", "peito de frango",
+    "ovo cozido", "banana", "pao frances", "batata doce", "leite desnatado",
+    "queijo minas", "aveia", "carne moida", "tapioca", "iogurte natural", "azeite",
+]
+QUANTIDADES = (30.0, 50.0, 100.0, 150.0, 200.0)
+AMOSTRA_SUBSTITUICOES = 200
+SEMENTE = 42
+
+# Diferenças acima do limite nestas métricas contam como regressão
+# (p99 e memória entram no relatório, mas variam demais entre execuções)
+METRICAS_REGRESSAO = ("p50_us", "p95_us")
+
+
+def _num(valor):
+    """Números dos JSONs: "NA", "Tr", "*" e vazio valem 0 (como nos importadores)."""
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if isinstance(valor, str):
+        valor = valor.strip()
+        if valor in ("NA", "Tr", "*", ""):
+            return 0.0
+        return float(valor.replace(",", "."))
+    return 0.0
+
+
+def carregar_tabelas():
+    """Cria o schema no SQLite em memória e carrega TACO e TBCA."""
+    call_command("migrate", verbosity=0)
+
+    with open(BACKEND_DIR / "taco.json", encoding="utf-8") as f:
+        taco = json.load(f)
+    AlimentoTACO.objects.bulk_create(
+        [
+            AlimentoTACO(
+                codigo=str(item.get("id", "")),
+                nome=item.get("description", ""),
+                grupo=item.get("category", "Outros"),
+                energia_kcal=_num(item.get("energy_kcal")),
+                proteina_g=_num(item.get("protein_g")),
+                lipidios_g=_num(item.get("lipid_g")),
+                carboidrato_g=_num(item.get("carbohydrate_g")),
+                fibra_g=_num(item.get("fiber_g")),
+                # bulk_create não passa pelo save(): grupo calculado aqui
+                grupo_nutricional=identificar_grupo_nutricional(item.get("description", "")) or "",
+            )
+            for item in taco
+        ],
+        batch_size=500,
+    )
+
+    with open(BACKEND_DIR / "tbca_alimentos.json", encoding="utf-8") as f:
+        tbca = json.load(f)
+    AlimentoTBCA.objects.bulk_create(
+        [
+            AlimentoTBCA(
+                codigo=item["codigo"],
+                nome=item["nome"],
+                grupo=item["grupo"],
+                energia_kcal=item["energia_kcal"] or 0,
+                proteina_g=item["proteina_g"] or 0,
+                lipidios_g=item["lipidios_g"] or 0,
+                carboidrato_g=item["carboidrato_g"] or 0,
+                fibra_g=item["fibra_g"],
+                grupo_nutricional=identificar_grupo_nutricional(item["nome"]) or "",
+            )
+            for item in tbca
+        ],
+        batch_size=500,
+    )
+
+
+def _alimentos():
+    """Todos os alimentos carregados, como NutricaoAlimento (com fonte e id)."""
+    from diets.nutritional_substitution import (
+        alimento_taco_para_nutricao,
+        alimento_tbca_para_nutricao,
+    )
+
+    return [alimento_taco_para_nutricao(a) for a in AlimentoTACO.objects.all()] + [
+        alimento_tbca_para_nutricao(a) for a in AlimentoTBCA.objects.all()
+    ]
+
+
+def montar_cenarios():
+    """{nome: (função, lista de argumentos, chamadas de aquecimento)}."""
+    alimentos = _alimentos()
+    rng = random.Random(SEMENTE)
+    substituiveis = [
+        a for a in alimentos
+        if a.grupo_nutricional and a.grupo_nutricional not in GRUPOS_BLOQUEADOS
+    ]
+    amostra = rng.sample(substituiveis, min(AMOSTRA_SUBSTITUICOES, len(substituiveis)))
+    nomes = [a.nome for a in alimentos]
+    pool = get_substitution_pool()
+
+    def pool_suggest(alimento, quantidade):
+        return pool.suggest(alimento, quantidade, 10)
+
+    return {
+        "identificar_grupo_nutricional": (
+            identificar_grupo_nutricional, [(nome,) for nome in nomes], [],
+        ),
+        "sugerir_substitucoes": (
+            sugerir_substitucoes,
+            [(a, alimentos, rng.choice(QUANTIDADES), 10) for a in amostra],
+            [],
+        ),
+        "SubstitutionPool.suggest": (
+            pool_suggest,
+            [(a, rng.choice(QUANTIDADES)) for a in amostra],
+            # Aquecimento: uma chamada por alimento preenche o cache de razões
+            [(a, 100.0) for a in amostra],
+        ),
+        "calcular_score_radical": (
+            calcular_score_radical,
+            [(nome, normalizar_para_scoring(busca)) for busca in BUSCAS for nome in nomes],
+            [],
+        ),
+    }
+
+
+def medir(funcao, chamadas, aquecimento, repeticoes=3):
+    for args in aquecimento:
+        funcao(*args)
+
+    tempos = np.empty(len(chamadas), dtype=np.int64)
+    relogio = time.perf_counter_ns
+    passadas = []
+    for _ in range(repeticoes):
+        for i, args in enumerate(chamadas):
+            inicio = relogio()
+            funcao(*args)
+            tempos[i] = relogio() - inicio
+        passadas.append([*np.percentile(tempos, [50, 95, 99]), tempos.mean()])
+    p50, p95, p99, media = np.min(passadas, axis=0) / 1000
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for args in chamadas:
+        funcao(*args)
+    atual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(chamadas),
+        "p50_us": round(float(p50), 2),
+        "p95_us": round(float(p95), 2),
+        "p99_us": round(float(p99), 2),
+        "mean_us": round(float(media), 2),
+        "peak_kib": round((pico - base) / 1024, 1),
+        "retained_kib": round((atual - base) / 1024, 1),
+    }
+
+
+def _variacao(atual, anterior):
+    if not anterior:
+        return None
+    return (atual - anterior) / anterior * 100
+
+
+def relatorio(resultados, baseline, limite):
+    """Imprime a tabela e devolve a lista de regressões (nome, métrica, %)."""
+    anteriores = (baseline or {}).get("results", {})
+    regressoes = []
+    print(f"\n{'função':<32}{'chamadas':>9}{'p50 µs':>11}{'p95 µs':>11}{'p99 µs':>11}{'pico KiB':>11}")
+    for nome, atual in resultados.items():
+        print(
+            f"{nome:<32}{atual['calls']:>9}{atual['p50_us']:>11.2f}{atual['p95_us']:>11.2f}"
+            f"{atual['p99_us']:>11.2f}{atual['peak_kib']:>11.1f}"
+        )
+        anterior = anteriores.get(nome)
+        if not anterior:
+            continue
+        colunas = []
+        for metrica in ("p50_us", "p95_us", "p99_us", "peak_kib"):
+            variacao = _variacao(atual[metrica], anterior.get(metrica))
+            if variacao is None:
+                colunas.append(f"{'-':>11}")
+                continue
+            colunas.append(f"{variacao:>+10.1f}%")
+            if metrica in METRICAS_REGRESSAO and variacao > limite:
+                regressoes.append((nome, metrica, variacao))
+        print(f"{'  vs baseline':<41}{''.join(colunas)}")
+
+    if baseline:
+        print(f"\nBaseline: {baseline['meta'].get('date')} ({baseline['meta'].get('python')}, "
+              f"{baseline['meta'].get('machine')})")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save", action="store_true", help="grava os resultados como novo baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PADRAO, help="arquivo de baseline")
+    parser.add_argument("--only", action="append", help="roda só esta função (pode repetir)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="passadas cronometradas por função (padrão: 3)")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="piora percentual em p50/p95 que conta como regressão (padrão: 10)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="sai com código 1 se houver regressão")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    carregar_tabelas()
+    cenarios = montar_cenarios()
+    print(f"Tabelas carregadas em {time.perf_counter() - inicio:.1f}s "
+          f"({AlimentoTACO.objects.count()} TACO, {AlimentoTBCA.objects.count()} TBCA)")
+
+    resultados = {}
+    for nome, (funcao, chamadas, aquecimento) in cenarios.items():
+        if args.only and nome not in args.only:
+            continue
+        resultados[nome] = medir(funcao, chamadas, aquecimento, max(args.repeat, 1))
+
+    baseline = None
+    if args.baseline.exists():
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressoes = relatorio(resultados, baseline, args.threshold)
+
+    if args.save:
+        # Mantém no baseline as funções que não rodaram nesta execução
+        salvos = dict((baseline or {}).get("results", {}))
+        salvos.update(resultados)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "date": datetime.now().isoformat(timespec="seconds"),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                        "machine": f"{platform.system()} {platform.machine()}",
+                    },
+                    "results": salvos,
+                },
+                f, indent=2, sort_keys=True, ensure_ascii=False,
+            )
+            f.write("\n")
+        print(f"Baseline salvo em {args.baseline}")
+
+    if regressoes:
+        print(f"\nRegressões (> {args.threshold:.0f}%):")
+        for nome, metrica, variacao in regressoes:
+            print(f"  {nome} {metrica}: {variacao:+.1f}%")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -86,7 +86,7 @@ class FoodSubstitutionRuleAdmin(admin.ModelAdmin):
         "is_active",
         "created_at",
     )
-    list_filter = ("diet_type", "nutrient_predominant", "is_active", "created_at")
+    list_filter = ("diet_type", "nutrient_predominant", "is_active", "is_generated", "created_at")
     search_fields = (
         "original_food_name",
         "substitute_food_name",
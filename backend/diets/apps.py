@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DietsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "diets"
+
+    def ready(self):
+        import diets.signals  # noqa: F401
@@ -0,0 +1,72 @@
+"""
+Versionamento do catálogo de alimentos.
+
+As estruturas em memória montadas a partir das tabelas de alimentos (índice de
+busca, caches de medidas, etc.) guardam a versão com que foram construídas e se
+reconstroem quando ela muda. A versão fica no cache do Django (Redis em
+produção), então uma alteração feita em um worker invalida todos os outros.
+
+Há três escopos independentes:
+- REFERENCE: tabelas de referência (TACO, TBCA, USDA), raramente alteradas.
+- CUSTOM: alimentos personalizados dos nutricionistas (Sua Tabela), que mudam
+  com frequência e não devem invalidar o que depende só das tabelas oficiais.
+- MEASURES: medidas caseiras IBGE (AlimentoMedidaIBGE, MedidaCaseira).
+
+CUSTOM também tem uma versão por nutricionista (`owner`), para o que depende
+só dos alimentos personalizados de um deles (ex.: snapshots das dietas dos
+seus pacientes).
+"""
+
+import time
+
+from django.core.cache import cache
+
+REFERENCE = "reference"
+CUSTOM = "custom"
+MEASURES = "measures"
+
+CATALOG_VERSION_KEYS = {
+    REFERENCE: "diets:food_catalog:version",
+    CUSTOM: "diets:custom_foods:version",
+    MEASURES: "diets:ibge_measures:version",
+}
+
+
+def _new_version() -> int:
+    # Baseado no relógio para que uma chave perdida (restart do Redis, LRU do
+    # LocMemCache) nunca volte a um número já usado por algum worker.
+    return time.time_ns()
+
+
+def _version_key(scope: str, owner=None) -> str:
+    if owner is None:
+        return CATALOG_VERSION_KEYS[scope]
+    return f"{CATALOG_VERSION_KEYS[scope]}:{owner}"
+
+
+def get_catalog_version(scope: str = REFERENCE, owner=None) -> int:
+    """Retorna a versão atual do catálogo, criando-a se ainda não existir."""
+    return cache.get_or_set(_version_key(scope, owner), _new_version, timeout=None)
+
+
+def bump_catalog_version(scope: str = REFERENCE, owner=None) -> int:
+    """Marca o catálogo como alterado, invalidando as estruturas derivadas."""
+    version = _new_version()
+    cache.set(_version_key(scope, owner), version, timeout=None)
+    return version
+
+
+def warm_catalogs():
+    """
+    Carrega no processo atual as estruturas derivadas do catálogo (índice de
+    busca, catálogo IBGE e pool de substituições). Chamado no master do
+    gunicorn antes do fork, para que nenhum worker monte tudo na primeira
+    requisição.
+    """
+    from .food_index import get_food_index
+    from .ibge_catalog import get_ibge_catalog
+    from .substitution_pool import get_substitution_pool
+
+    get_ibge_catalog()
+    get_food_index()
+    get_substitution_pool()
@@ -0,0 +1,102 @@
+"""
+Execução concorrente das consultas por fonte da busca de alimentos.
+
+Cada tarefa roda em uma thread de um pool compartilhado pelo processo, com a
+própria conexão ao banco (as conexões do Django são por thread), reaproveitada
+entre tarefas dentro do limite de CONN_MAX_AGE. Tarefas que passam do tempo limite são descartadas pelo chamador,
+que segue com as fontes que responderam.
+
+Uma tarefa já em execução não pode ser cancelada: ela continua ocupando a sua
+thread até terminar. Por isso só entram no pool tantas tarefas quantas são as
+threads (`_vagas`); sem vaga livre, a fonte roda na thread da requisição, como
+na busca sequencial, em vez de formar fila atrás de consultas travadas.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_vagas: Optional[threading.BoundedSemaphore] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+    # Criado sob demanda: threads não sobrevivem ao fork dos workers do
+    # gunicorn (preload_app), então o pool nunca pode nascer no master.
+    global _executor, _vagas
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, "FOOD_SEARCH_WORKERS", 4)
+                _vagas = threading.BoundedSemaphore(workers)
+                _executor = ThreadPoolExecutor(
+                    max_workers=workers,
+                    thread_name_prefix="food-search",
+                )
+    return _executor, _vagas
+
+
+def _run_with_own_connection(task: Callable[[], Any]) -> Any:
+    # As threads do pool são longas e não passam pelo request_finished: o
+    # close_old_connections antes e depois faz o mesmo papel, descartando
+    # conexões quebradas ou mais velhas que CONN_MAX_AGE e mantendo as demais.
+    close_old_connections()
+    try:
+        return task()
+    finally:
+        close_old_connections()
+
+
+def run_per_source(
+    tasks: Dict[str, Callable[[], Any]], timeout: Optional[float] = None
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Executa as tarefas (fonte -> callable) em paralelo e retorna
+    ({fonte: resultado}, [fontes que estouraram o tempo]).
+
+    Roda em sequência, na thread atual, quando o paralelismo está desligado
+    (FOOD_SEARCH_PARALLEL) ou dentro de um bloco atômico: outras conexões não
+    enxergariam os dados ainda não commitados da transação. Fontes que não
+    conseguem vaga no pool também rodam na thread atual.
+    """
+    if (
+        len(tasks) <= 1
+        or not getattr(settings, "FOOD_SEARCH_PARALLEL", True)
+        or connection.in_atomic_block
+    ):
+        return {source: task() for source, task in tasks.items()}, []
+
+    executor, vagas = _get_executor()
+    futures, inline = {}, {}
+    for source, task in tasks.items():
+        if not vagas.acquire(blocking=False):
+            inline[source] = task
+            continue
+        future = executor.submit(_run_with_own_connection, task)
+        # A vaga só é devolvida quando a tarefa termina de fato, mesmo que o
+        # chamador já tenha desistido dela
+        future.add_done_callback(lambda _future: vagas.release())
+        futures[source] = future
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if inline:
+        logger.warning("Food search pool busy, running %s inline", list(inline))
+    results = {source: task() for source, task in inline.items()}
+    timed_out = []
+    for source, future in futures.items():
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            results[source] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            timed_out.append(source)
+            logger.warning("Food search source %s timed out after %ss", source, timeout)
+    return results, timed_out
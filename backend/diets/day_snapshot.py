@@ -0,0 +1,447 @@
+"""
+Plano do dia pré-calculado para o app do paciente.
+
+O app chama `/patients/me/meals/` o tempo todo, e cada chamada refazia do zero
+os totais das refeições, o casamento dos itens com as substituições manuais
+de `Diet.substitutions` e as substituições automáticas. Como nada disso muda
+entre duas edições da dieta, o resultado de cada dia da semana fica gravado em
+`DietDaySnapshot` (JSON com refeições, itens, macros e substituições), montado
+em background quando o `DietSerializer` salva a dieta (`tasks.py`). Na
+requisição resta sobrepor o status por horário e os check-ins do dia.
+
+Os sete dias sempre têm snapshot: um dia sem refeições usa as do dia 0 (ou do
+primeiro dia com refeições), como o endpoint já fazia.
+
+`version` junta a dieta (`updated_at`), a versão das tabelas de referência e a
+dos alimentos personalizados do nutricionista do paciente (`catalog.py`), de
+que dependem as substituições automáticas. Um snapshot ausente ou de outra
+versão é remontado na hora, só para o dia pedido (ou a semana inteira, em
+`refeicoes_da_semana`). Refeições e itens editados fora do serializer
+atualizam o `updated_at` da dieta (`signals.py`), o que também muda o ETag da
+semana no app do paciente.
+"""
+
+import threading
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+from .catalog import CUSTOM, REFERENCE, get_catalog_version
+from .search_cache import SearchResultCache
+
+# Mudou a estrutura de `data`: incrementar invalida os snapshots gravados
+SNAPSHOT_FORMAT = 1
+
+LIMITE_SUBSTITUICOES_AUTO = 5
+
+_estado = threading.local()
+
+
+def normalize_text(text):
+    if not text:
+        return ""
+    text = (
+        unicodedata.normalize("NFKD", text)
+        .encode("ascii", "ignore")
+        .decode("utf8")
+    )
+    return text.lower().strip()
+
+
+def invalidacao_suspensa() -> bool:
+    return getattr(_estado, "suspensa", False)
+
+
+@contextmanager
+def snapshots_em_lote():
+    """
+    Suspende a invalidação por refeição/item enquanto o serializer recria as
+    refeições da dieta: ele mesmo agenda a reconstrução no final.
+    """
+    anterior = invalidacao_suspensa()
+    _estado.suspensa = True
+    try:
+        yield
+    finally:
+        _estado.suspensa = anterior
+
+
+def snapshot_version(diet) -> str:
+    # Só os personalizados do próprio nutricionista entram nas sugestões
+    nutritionist_id = diet.patient.nutritionist_id if diet.patient_id else None
+    return (
+        f"{SNAPSHOT_FORMAT}:{diet.updated_at.timestamp():.6f}:"
+        f"{get_catalog_version(REFERENCE)}:{get_catalog_version(CUSTOM, owner=nutritionist_id)}"
+    )
+
+
+def dia_efetivo(dias_com_refeicoes, dia: int) -> Optional[int]:
+    """Dia cujas refeições são exibidas: o próprio, o dia 0 ou o primeiro disponível."""
+    if dia in dias_com_refeicoes:
+        return dia
+    if not dias_com_refeicoes:
+        return None
+    return 0 if 0 in dias_com_refeicoes else min(dias_com_refeicoes)
+
+
+_SEM_UNIDADE = object()
+
+
+def _trigramas(texto: str) -> set:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class SubstituicoesManuais:
+    """
+    Regras de `Diet.substitutions` compiladas: nomes originais normalizados
+    uma vez, um mapa dos nomes exatos e um índice de trigramas para a
+    continência. Um item casa com a regra quando os nomes normalizados são
+    iguais ou um contém o outro ("Arroz Branco" casa com "Arroz"); as opções
+    de todas as regras que casam entram na ordem da dieta.
+
+    A continência só é verificada nas regras que podem casar: se a regra está
+    contida no item, todos os trigramas dela estão no item, e vice-versa. O
+    resultado de cada nome normalizado fica memorizado.
+    """
+
+    def __init__(self, diet_subs):
+        # (nome normalizado, opções (nome, quantidade, unidade), regra válida)
+        self.regras = []
+        self.exatas: Dict[str, List[int]] = {}
+        self.por_trigrama: Dict[str, List[int]] = {}
+        self.num_trigramas: List[int] = []
+        self.curtas: List[int] = []
+        self._casamentos: Dict[str, List[int]] = {}
+
+        for sub_group in diet_subs:
+            original_norm = normalize_text(sub_group.get("original", ""))
+            if not original_norm:
+                continue
+            opcoes = []
+            valida = True
+            try:
+                for opt in sub_group.get("options", []):
+                    opcoes.append((
+                        opt.get("name", ""),
+                        float(opt.get("quantity", 0)),
+                        opt.get("unit", _SEM_UNIDADE),
+                    ))
+            except Exception as sub_err:
+                # Como antes: as opções lidas até o erro entram, mas a regra
+                # não conta como substituição manual do item
+                valida = False
+                print(f"Erro ao processar substituição manual: {sub_err}")
+
+            indice = len(self.regras)
+            self.regras.append((original_norm, opcoes, valida))
+            self.exatas.setdefault(original_norm, []).append(indice)
+            tris = _trigramas(original_norm)
+            self.num_trigramas.append(len(tris))
+            if not tris:
+                self.curtas.append(indice)
+            for tri in tris:
+                self.por_trigrama.setdefault(tri, []).append(indice)
+
+    def _regras_do_nome(self, item_name_norm: str) -> List[int]:
+        casadas = self._casamentos.get(item_name_norm)
+        if casadas is not None:
+            return casadas
+
+        tris = _trigramas(item_name_norm)
+        if not tris:
+            # Nome curto (ou vazio) pode estar contido em qualquer regra
+            candidatas = range(len(self.regras))
+        else:
+            comuns = Counter()
+            for tri in tris:
+                comuns.update(self.por_trigrama.get(tri, ()))
+            candidatas = set(self.curtas)
+            candidatas.update(
+                i for i, n in comuns.items()
+                if n == self.num_trigramas[i] or n == len(tris)
+            )
+            candidatas.update(self.exatas.get(item_name_norm, ()))
+
+        casadas = sorted(
+            i for i in candidatas
+            if (
+                self.regras[i][0] == item_name_norm
+                or self.regras[i][0] in item_name_norm
+                or item_name_norm in self.regras[i][0]
+            )
+        )
+        self._casamentos[item_name_norm] = casadas
+        return casadas
+
+    def opcoes(self, item) -> Tuple[list, bool]:
+        """(opções manuais do item, se alguma regra válida casou)."""
+        sub_options = []
+        found_manual_sub = False
+        for i in self._regras_do_nome(normalize_text(item.food_name)):
+            _, opcoes, valida = self.regras[i]
+            for name, quantity, unit in opcoes:
+                sub_options.append({
+                    "name": name,
+                    "quantity": quantity,
+                    "unit": item.unit if unit is _SEM_UNIDADE else unit,
+                    "kcal": 0,  # Frontend handles display or we could calc if DB link existed
+                    "group": "Indicado pelo Nutri",
+                    "source": "manual"
+                })
+            found_manual_sub = found_manual_sub or valida
+        return sub_options, found_manual_sub
+
+
+_compiladas = SearchResultCache(256)
+
+
+def substituicoes_manuais(diet) -> SubstituicoesManuais:
+    """Regras manuais compiladas da dieta, reaproveitadas enquanto ela não muda."""
+    chave = (diet.pk, diet.updated_at)
+    compiladas = _compiladas.get(chave, None)
+    if compiladas is None:
+        compiladas = SubstituicoesManuais(diet.substitutions or [])
+        if diet.pk is not None:
+            _compiladas.set(chave, None, compiladas)
+    return compiladas
+
+
+def montar_refeicoes(diet, meals, orcamento: Optional[int] = None) -> Tuple[List[dict], bool]:
+    """
+    Refeições no formato do endpoint do paciente (sem `status`), na ordem de
+    `meals` (com `items` pré-carregados). As substituições automáticas de todos
+    os itens saem de um único lote no pool; `orcamento` limita esse lote e o
+    segundo valor indica se nenhum item ficou sem resposta por causa dele.
+    """
+    from .nutritional_substitution import NutricaoAlimento
+    from .substitution_pool import get_substitution_pool
+
+    manuais = substituicoes_manuais(diet)
+    # Itens sem substituição manual: (alimento, quantidade, opções do item)
+    auto_requests = []
+
+    refeicoes = []
+    for meal in meals:
+        items = []
+        total_calories = 0
+        total_protein = 0
+        total_carbs = 0
+        total_fats = 0
+
+        for item in meal.items.all():
+            item_calories = float(item.calories) if item.calories else 0
+            item_protein = float(item.protein) if item.protein else 0
+            item_carbs = float(item.carbs) if item.carbs else 0
+            item_fats = float(item.fats) if item.fats else 0
+
+            total_calories += item_calories
+            total_protein += item_protein
+            total_carbs += item_carbs
+            total_fats += item_fats
+
+            # 1. Substituições definidas pelo nutricionista no plano têm prioridade
+            sub_options, found_manual_sub = manuais.opcoes(item)
+
+            # 2. Substituições automáticas (fallback), calculadas em lote no final
+            if not found_manual_sub:
+                quantity = float(item.quantity)
+
+                def per_100g(value):
+                    return value * 100.0 / quantity if quantity > 0 else 0
+
+                auto_requests.append((
+                    NutricaoAlimento(
+                        nome=item.food_name,
+                        energia_kcal=per_100g(item_calories),
+                        proteina_g=per_100g(item_protein),
+                        lipidios_g=per_100g(item_fats),
+                        carboidrato_g=per_100g(item_carbs),
+                        fibra_g=per_100g(float(item.fiber or 0)),
+                    ),
+                    quantity,
+                    sub_options,
+                ))
+
+            # ID e Fonte Técnica para Substituições Precisas
+            item_food_id = None
+            item_source = "TACO"
+            if item.taco_food_id:
+                item_food_id = item.taco_food_id
+                item_source = "TACO"
+            elif item.tbca_food_id:
+                item_food_id = item.tbca_food_id
+                item_source = "TBCA"
+            elif item.usda_food_id:
+                item_food_id = item.usda_food_id
+                item_source = "USDA"
+
+            items.append(
+                {
+                    "name": item.food_name,
+                    "quantity": float(item.quantity),
+                    "unit": item.unit,
+                    "kcal": item_calories,
+                    "protein": item_protein,
+                    "carbs": item_carbs,
+                    "fats": item_fats,
+                    "food_id": item_food_id,
+                    "food_source": item_source,
+                    "substitutions": sub_options,
+                }
+            )
+
+        refeicoes.append(
+            {
+                "id": meal.id,
+                "name": meal.name,
+                "time": meal.time.strftime("%H:%M"),
+                "calories": int(total_calories),
+                "protein": int(total_protein),
+                "carbs": int(total_carbs),
+                "fats": int(total_fats),
+                "items": items,
+            }
+        )
+
+    completo = True
+    if auto_requests:
+        try:
+            suggestions = get_substitution_pool().suggest_batch(
+                [(alimento, quantity) for alimento, quantity, _ in auto_requests],
+                LIMITE_SUBSTITUICOES_AUTO,
+                nutritionist_id=diet.patient.nutritionist_id,
+                orcamento=orcamento,
+            )
+            for (_, _, sub_options), item_suggestions in zip(auto_requests, suggestions):
+                if item_suggestions is None:
+                    completo = False
+                for res in item_suggestions or []:
+                    sub_options.append({
+                        "name": res.alimento_substituto,
+                        "quantity": res.quantidade_substituto_g,
+                        "unit": "g",
+                        "kcal": res.calorias_substituto,
+                        "group": res.grupo.replace("_", " ").title(),
+                        "source": "auto"
+                    })
+        except Exception as auto_err:
+            print(f"Erro no fallback de substituição: {auto_err}")
+            completo = False
+
+    return refeicoes, completo
+
+
+def _montar_semana(diet, meals, orcamento: Optional[int] = None):
+    """
+    [(dia de origem, refeições)] dos sete dias a partir de todas as refeições
+    da dieta, com um único lote de substituições automáticas.
+    """
+    refeicoes, completo = montar_refeicoes(diet, meals, orcamento)
+
+    por_dia: Dict[int, List[dict]] = {}
+    for meal, refeicao in zip(meals, refeicoes):
+        por_dia.setdefault(meal.day_of_week, []).append(refeicao)
+
+    dias = []
+    for dia in range(7):
+        origem = dia_efetivo(por_dia.keys(), dia)
+        dias.append((origem, por_dia.get(origem, [])))
+    return dias, completo
+
+
+def _gravar_semana(diet, version: str, dias) -> int:
+    from .models import DietDaySnapshot
+
+    snapshots = [
+        DietDaySnapshot(
+            diet=diet, day_of_week=dia, source_day=origem, version=version, data=refeicoes
+        )
+        for dia, (origem, refeicoes) in enumerate(dias)
+    ]
+    # Upsert portável (MySQL/MariaDB não aceitam update_conflicts com
+    # unique_fields): a semana é sempre gravada inteira, então troca as sete
+    # linhas na mesma transação
+    with transaction.atomic():
+        DietDaySnapshot.objects.filter(diet=diet).delete()
+        # Semana gravada por uma montagem concorrente: o conteúdo é o mesmo
+        DietDaySnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+    return len(snapshots)
+
+
+def _refeicoes_da_dieta(diet) -> list:
+    from .models import Meal
+
+    return list(Meal.objects.filter(diet=diet).prefetch_related("items").order_by("time"))
+
+
+def construir_snapshots(diet) -> int:
+    """Monta e grava os snapshots dos sete dias da dieta. Retorna quantos gravou."""
+    version = snapshot_version(diet)
+    # Um lote só para a semana inteira (sem orçamento: roda em background)
+    dias, _ = _montar_semana(diet, _refeicoes_da_dieta(diet))
+    return _gravar_semana(diet, version, dias)
+
+
+def refeicoes_da_semana(diet, orcamento: Optional[int] = None) -> Tuple[List[List[dict]], bool]:
+    """
+    Refeições dos sete dias (segunda a domingo). Lidas dos snapshots quando
+    todos estão em dia; senão montadas com uma consulta de refeições e itens
+    e gravadas. O segundo valor é False se o `orcamento` deixou itens sem
+    substituições automáticas (nesse caso nada é gravado).
+    """
+    from .models import DietDaySnapshot
+
+    version = snapshot_version(diet)
+    snapshots = dict(
+        DietDaySnapshot.objects.filter(diet=diet, version=version).values_list(
+            "day_of_week", "data"
+        )
+    )
+    if len(snapshots) == 7:
+        return [snapshots[dia] for dia in range(7)], True
+
+    dias, completo = _montar_semana(diet, _refeicoes_da_dieta(diet), orcamento)
+    if completo:
+        _gravar_semana(diet, version, dias)
+    return [refeicoes for _, refeicoes in dias], completo
+
+
+def refeicoes_do_dia(diet, dia: int, orcamento: Optional[int] = None) -> List[dict]:
+    """
+    Refeições do dia da semana `dia`, do snapshot quando ele está em dia.
+    Senão monta só esse dia na hora e grava o snapshot (a menos que o
+    `orcamento` tenha deixado itens sem substituições automáticas).
+    """
+    from .models import DietDaySnapshot, Meal
+
+    version = snapshot_version(diet)
+    snapshot = (
+        DietDaySnapshot.objects.filter(diet=diet, day_of_week=dia)
+        .values_list("version", "data")
+        .first()
+    )
+    if snapshot is not None and snapshot[0] == version:
+        return snapshot[1]
+
+    dias = set(
+        Meal.objects.filter(diet=diet).values_list("day_of_week", flat=True).distinct()
+    )
+    origem = dia_efetivo(dias, dia)
+    meals = []
+    if origem is not None:
+        meals = list(
+            Meal.objects.filter(diet=diet, day_of_week=origem)
+            .prefetch_related("items")
+            .order_by("time")
+        )
+    refeicoes, completo = montar_refeicoes(diet, meals, orcamento)
+    if completo:
+        DietDaySnapshot.objects.update_or_create(
+            diet=diet,
+            day_of_week=dia,
+            defaults={"source_day": origem, "version": version, "data": refeicoes},
+        )
+    return refeicoes
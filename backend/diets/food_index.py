@@ -0,0 +1,360 @@
+"""
+Índice invertido em memória para a busca de alimentos.
+
+Substitui a cadeia de `nome__icontains` (full scan com LIKE em cada tabela) por
+um índice por processo sobre os nomes normalizados (sem acento, minúsculos) de
+TACO, TBCA, USDA e dos alimentos personalizados. Cada termo da busca casa por
+prefixo com as palavras do nome e todos os termos precisam estar presentes
+(AND), como no `apply_search_filter`.
+
+O índice guarda a versão do catálogo com que foi montado (ver `catalog.py`) e se
+reconstrói sozinho quando as tabelas de alimentos mudam. Na mesma carga são
+pré-calculadas as features de scoring (`CatalogoScoring`), de modo que o ranking
+dos candidatos é feito em lote.
+"""
+
+import heapq
+import logging
+import re
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from unidecode import unidecode
+
+from .catalog import CUSTOM, REFERENCE, get_catalog_version
+from .search_utils import CatalogoScoring, IndiceTrigramas, normalizar_para_scoring
+
+logger = logging.getLogger(__name__)
+
+# Fontes indexadas, com os mesmos rótulos usados nas chaves de favoritos
+SOURCES = ("TACO", "TBCA", "USDA", "PERSONAL")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Busca aproximada: palavras parecidas consideradas por termo da busca
+FUZZY_WORDS_PER_TERM = 5
+FUZZY_MIN_SIMILARITY = 0.25
+
+
+def tokenizar_nome(nome: str) -> Set[str]:
+    """Palavras alfanuméricas do nome normalizado (sem acento, minúsculo)."""
+    if not nome:
+        return set()
+    return set(_WORD_RE.findall(unidecode(nome.lower())))
+
+
+class FoodSearchIndex:
+    """
+    Índice invertido palavra -> documentos, com vocabulário ordenado para
+    expandir prefixos via busca binária.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, int, str]]):
+        self.sources: List[str] = []
+        self.ids: List[int] = []
+        self.nomes: List[str] = []
+        postings: Dict[str, Set[int]] = {}
+
+        for doc, (source, food_id, nome) in enumerate(rows):
+            self.sources.append(source)
+            self.ids.append(food_id)
+            self.nomes.append(nome)
+            for palavra in tokenizar_nome(nome):
+                postings.setdefault(palavra, set()).add(doc)
+
+        self.postings = postings
+        self.vocab = sorted(postings)
+        self._prefix_cache: Dict[str, Set[int]] = {}
+        self._trigramas: Optional[IndiceTrigramas] = None
+
+        self.doc_by_key = {
+            (source, food_id): doc
+            for doc, (source, food_id) in enumerate(zip(self.sources, self.ids))
+        }
+        self.scoring = CatalogoScoring(self.nomes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _docs_for_prefix(self, prefix: str) -> Set[int]:
+        """União das listas de postagem de todas as palavras com o prefixo."""
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            return cached
+
+        docs: Set[int] = set()
+        start = bisect_left(self.vocab, prefix)
+        for palavra in self.vocab[start:]:
+            if not palavra.startswith(prefix):
+                break
+            docs |= self.postings[palavra]
+
+        # Prefixos curtos ("ar", "fr") são os mais caros e os mais repetidos
+        # durante a digitação.
+        if len(self._prefix_cache) < 4096:
+            self._prefix_cache[prefix] = docs
+        return docs
+
+    def match_docs(self, q_tokens: List[str]) -> Optional[Set[int]]:
+        """
+        Documentos que contêm todos os termos (AND de prefixos).
+        Retorna None se os termos não puderem ser atendidos pelo índice.
+        """
+        partes = []
+        for token in q_tokens:
+            palavras = _WORD_RE.findall(token)
+            if not palavras:
+                return None
+            partes.extend(palavras)
+
+        if not partes:
+            return None
+
+        # Começa pelo conjunto mais seletivo para reduzir as interseções
+        conjuntos = sorted((self._docs_for_prefix(p) for p in set(partes)), key=len)
+        result = set(conjuntos[0])
+        for docs in conjuntos[1:]:
+            if not result:
+                break
+            result &= docs
+        return result
+
+    @property
+    def trigramas(self) -> IndiceTrigramas:
+        # Montado no primeiro uso: a busca aproximada é só um fallback
+        if self._trigramas is None:
+            self._trigramas = IndiceTrigramas(self.vocab)
+        return self._trigramas
+
+    def fuzzy_match(
+        self,
+        q_tokens: List[str],
+        limit: int = 50,
+        permitido: Optional[Callable[[int], bool]] = None,
+    ) -> List[Tuple[int, float, List[str]]]:
+        """
+        Busca tolerante a erros de digitação: cada termo casa com as palavras do
+        vocabulário que começam com ele (similaridade 1) ou que são parecidas
+        por trigramas. Retorna até `limit` (doc, similaridade média, palavras
+        casadas), priorizando os documentos que casam com mais termos.
+
+        `permitido` filtra os documentos antes do corte em `limit`.
+        """
+        partes = []
+        for token in q_tokens:
+            partes.extend(_WORD_RE.findall(token))
+        partes = list(dict.fromkeys(partes))
+        if not partes:
+            return []
+
+        # doc -> {parte: (similaridade, palavra)}
+        melhores: Dict[int, Dict[str, Tuple[float, str]]] = {}
+        for parte in partes:
+            palavras = [(parte, 1.0)] + self.trigramas.similares(
+                parte, limite=FUZZY_WORDS_PER_TERM, minimo=FUZZY_MIN_SIMILARITY
+            )
+            for palavra, sim in palavras:
+                docs = self._docs_for_prefix(parte) if palavra == parte else self.postings[palavra]
+                for doc in docs:
+                    if permitido is not None and not permitido(doc):
+                        continue
+                    atual = melhores.setdefault(doc, {}).get(parte)
+                    if atual is None or sim > atual[0]:
+                        melhores[doc][parte] = (sim, palavra)
+
+        if not melhores:
+            return []
+
+        # Só os documentos que casam com o maior número de termos
+        max_termos = max(len(casados) for casados in melhores.values())
+        ranked = []
+        for doc, casados in melhores.items():
+            if len(casados) < max_termos:
+                continue
+            media = sum(sim for sim, _ in casados.values()) / len(partes)
+            ranked.append((-media, doc))
+
+        return [
+            (doc, -neg_media, [melhores[doc][p][1] for p in partes if p in melhores[doc]])
+            for neg_media, doc in heapq.nsmallest(limit, ranked)
+        ]
+
+    def candidates_by_source(self, docs: Iterable[int]) -> Dict[str, Set[int]]:
+        grouped: Dict[str, Set[int]] = {source: set() for source in SOURCES}
+        for doc in docs:
+            grouped[self.sources[doc]].add(self.ids[doc])
+        return grouped
+
+
+class FoodCatalogIndex:
+    """
+    Índice completo do catálogo: tabelas de referência + alimentos
+    personalizados. As duas partes são versionadas separadamente para que
+    cadastrar um alimento em "Sua Tabela" não reconstrua TACO/TBCA/USDA.
+    """
+
+    def __init__(self, reference: FoodSearchIndex, custom: FoodSearchIndex):
+        self.reference = reference
+        self.custom = custom
+
+    def candidates(self, query: str) -> Optional[Dict[str, Set[int]]]:
+        """
+        IDs candidatos por fonte para a busca, ou None se a busca não puder ser
+        resolvida pelo índice (o chamador deve usar `apply_search_filter`).
+        """
+        q_tokens = normalizar_para_scoring(query)
+        if not q_tokens:
+            return None
+
+        reference_docs = self.reference.match_docs(q_tokens)
+        custom_docs = self.custom.match_docs(q_tokens)
+        if reference_docs is None or custom_docs is None:
+            return None
+
+        result = self.reference.candidates_by_source(reference_docs)
+        result["PERSONAL"] = self.custom.candidates_by_source(custom_docs)["PERSONAL"]
+        return result
+
+    def suggest(
+        self,
+        query: str,
+        limit: int = 10,
+        sources: Optional[Set[str]] = None,
+        custom_ids: Optional[Set[int]] = None,
+    ) -> List[Tuple[str, int, str, float]]:
+        """
+        Melhores sugestões (fonte, id, nome, score) para o autocomplete, com o
+        mesmo ranking da busca (`calcular_score_radical`). Empates seguem a
+        ordem da busca: alimentos personalizados primeiro, depois por fonte e nome.
+
+        - sources: fontes permitidas (None = todas).
+        - custom_ids: alimentos personalizados visíveis para o usuário.
+        """
+        q_tokens = normalizar_para_scoring(query)
+        if not q_tokens:
+            return []
+
+        ranked = []
+        for part in (self.custom, self.reference):
+            docs = part.match_docs(q_tokens)
+            if not docs:
+                continue
+            docs = [
+                doc
+                for doc in sorted(docs)
+                if (sources is None or part.sources[doc] in sources)
+                and (part is not self.custom or part.ids[doc] in (custom_ids or ()))
+            ]
+            if not docs:
+                continue
+            valores = part.scoring.pontuar(q_tokens, np.array(docs, dtype=np.intp))
+            for doc, valor in zip(docs, valores.tolist()):
+                ranked.append((-valor, len(ranked), part.sources[doc], part.ids[doc], part.nomes[doc]))
+
+        return [
+            (source, food_id, nome, -neg_score)
+            for neg_score, _, source, food_id, nome in heapq.nsmallest(limit, ranked)
+        ]
+
+    def fuzzy_candidates(
+        self,
+        query: str,
+        limit: int = 50,
+        sources: Optional[Set[str]] = None,
+        custom_ids: Optional[Set[int]] = None,
+    ) -> List[Tuple[str, int, float, List[str]]]:
+        """
+        Candidatos da busca aproximada (fonte, id, similaridade, palavras
+        casadas), em ordem de similaridade, para quando a busca exata não
+        encontra (quase) nada.
+
+        Os filtros são os mesmos do `suggest` e são aplicados antes do corte em
+        `limit`, para que alimentos de outras fontes ou de outros
+        nutricionistas não ocupem as vagas.
+        """
+        q_tokens = normalizar_para_scoring(query)
+        ranked = []
+        for part in (self.custom, self.reference):
+            def permitido(doc, part=part):
+                if sources is not None and part.sources[doc] not in sources:
+                    return False
+                return part is not self.custom or part.ids[doc] in (custom_ids or ())
+
+            for doc, sim, palavras in part.fuzzy_match(q_tokens, limit, permitido):
+                ranked.append((-sim, len(ranked), part.sources[doc], part.ids[doc], palavras))
+        return [
+            (source, food_id, -neg_sim, palavras)
+            for neg_sim, _, source, food_id, palavras in heapq.nsmallest(limit, ranked)
+        ]
+
+    def score(self, keys: List[Tuple[str, int]], q_tokens: List[str]) -> List[Optional[float]]:
+        """
+        Scores em lote para uma lista de chaves (fonte, id).
+        Itens que não estão no índice recebem None.
+        """
+        scores: List[Optional[float]] = [None] * len(keys)
+        for part in (self.reference, self.custom):
+            posicoes, docs = [], []
+            for i, key in enumerate(keys):
+                doc = part.doc_by_key.get(key)
+                if doc is not None:
+                    posicoes.append(i)
+                    docs.append(doc)
+            if docs:
+                valores = part.scoring.pontuar(q_tokens, np.array(docs, dtype=np.intp))
+                for i, valor in zip(posicoes, valores.tolist()):
+                    scores[i] = valor
+        return scores
+
+
+def _load_reference_rows():
+    from .models import AlimentoTACO, AlimentoTBCA, AlimentoUSDA
+
+    for food_id, nome in AlimentoTACO.objects.values_list("id", "nome").iterator():
+        yield "TACO", food_id, nome
+    for food_id, nome in AlimentoTBCA.objects.values_list("id", "nome").iterator():
+        yield "TBCA", food_id, nome
+    for food_id, nome in AlimentoUSDA.objects.values_list("id", "nome").iterator():
+        yield "USDA", food_id, nome
+
+
+def _load_custom_rows():
+    from .models import CustomFood
+
+    rows = CustomFood.objects.filter(is_active=True).values_list("id", "nome")
+    for food_id, nome in rows.iterator():
+        yield "PERSONAL", food_id, nome
+
+
+_lock = threading.Lock()
+_parts = {REFERENCE: (None, None), CUSTOM: (None, None)}
+_loaders = {REFERENCE: _load_reference_rows, CUSTOM: _load_custom_rows}
+
+
+def _get_part(scope: str) -> FoodSearchIndex:
+    version = get_catalog_version(scope)
+    index, built_version = _parts[scope]
+    if index is not None and built_version == version:
+        return index
+
+    with _lock:
+        index, built_version = _parts[scope]
+        if index is None or built_version != version:
+            index = FoodSearchIndex(_loaders[scope]())
+            _parts[scope] = (index, version)
+            logger.info("Food search index (%s) built: %d foods", scope, len(index))
+    return index
+
+
+def get_food_index() -> FoodCatalogIndex:
+    """Retorna o índice do processo, reconstruindo as partes desatualizadas."""
+    return FoodCatalogIndex(_get_part(REFERENCE), _get_part(CUSTOM))
+
+
+def reset_food_index():
+    """Descarta o índice do processo, forçando a reconstrução no próximo uso."""
+    with _lock:
+        for scope in _parts:
+            _parts[scope] = (None, None)
@@ -0,0 +1,165 @@
+"""
+Catálogo IBGE (medidas caseiras + nutrientes da TBCA) compartilhado entre workers.
+
+Antes cada worker do gunicorn montava o `IBGE_CACHE` na primeira busca,
+carregando todas as linhas de AlimentoMedidaIBGE e a TBCA inteira. Agora o
+catálogo é montado uma única vez, serializado no cache do Django (Redis em
+produção) junto com a versão com que foi construído, e cada processo guarda
+uma cópia local enquanto a versão não mudar.
+
+- Versão: combina a versão das tabelas de referência (TBCA) com a das medidas
+  IBGE (ver `catalog.py`); os signals as incrementam quando os dados mudam.
+- Single-flight: um lock por processo e um lock distribuído (`cache.add`)
+  garantem que requisições concorrentes não montem o catálogo em paralelo; quem
+  não pega o lock espera o resultado publicado por quem pegou.
+- Pré-carga: `gunicorn.conf.py` carrega o catálogo no master antes do fork.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from django.core.cache import cache
+
+from .catalog import MEASURES, REFERENCE, get_catalog_version
+
+logger = logging.getLogger(__name__)
+
+IBGE_CATALOG_KEY = "diets:ibge_catalog"
+IBGE_CATALOG_LOCK_KEY = "diets:ibge_catalog:lock"
+
+# Tempo máximo de montagem antes de o lock distribuído expirar sozinho
+BUILD_LOCK_TIMEOUT = 120
+# Quanto um worker espera pelo catálogo montado por outro antes de montar o seu
+BUILD_WAIT_SECONDS = 15
+BUILD_POLL_INTERVAL = 0.1
+
+_lock = threading.Lock()
+_local: Tuple[object, Dict[str, dict]] = (None, {})
+
+
+def ibge_catalog_version() -> Tuple[int, int]:
+    return get_catalog_version(REFERENCE), get_catalog_version(MEASURES)
+
+
+def build_ibge_catalog() -> Dict[str, dict]:
+    """
+    Monta o catálogo a partir do banco: uma entrada por nome de alimento IBGE
+    (id = md5 do nome) com a primeira medida e os nutrientes da TBCA.
+    """
+    from .models import AlimentoMedidaIBGE, AlimentoTBCA
+
+    tbca_lookup = {}
+    try:
+        tbca_qs = AlimentoTBCA.objects.all().values(
+            "nome", "energia_kcal", "proteina_g", "lipidios_g",
+            "carboidrato_g", "fibra_g"
+        )
+        for item in tbca_qs:
+            tbca_lookup[item["nome"].lower()] = item
+    except Exception as e:
+        print(f"Error loading TBCA for lookup: {e}")
+
+    items = AlimentoMedidaIBGE.objects.values_list("nome_alimento", "medida__nome", "peso_g")
+
+    catalog = {}
+    for name, medida_nome, peso_g in items.iterator():
+        if not name:
+            continue
+
+        md5_id = hashlib.md5(name.encode("utf-8")).hexdigest()
+        if md5_id in catalog:
+            continue
+
+        name_lower = name.lower()
+        nutri = tbca_lookup.get(name_lower)
+        if not nutri:
+            simplified = name_lower.split(",")[0]
+            nutri = tbca_lookup.get(simplified)
+        nutri = nutri or {}
+
+        catalog[md5_id] = {
+            "id": md5_id,
+            "nome": name,
+            "nome_lower": name_lower,
+            "medida_nome": medida_nome or "Medida",
+            "peso_g": peso_g,
+            "energia_kcal": nutri.get("energia_kcal", 0),
+            "proteina_g": nutri.get("proteina_g", 0),
+            "lipidios_g": nutri.get("lipidios_g", 0),
+            "carboidrato_g": nutri.get("carboidrato_g", 0),
+            "fibra_g": nutri.get("fibra_g", 0),
+            "grupo": "Medida Caseira (IBGE)",
+        }
+    return catalog
+
+
+def _from_shared_cache(version):
+    payload = cache.get(IBGE_CATALOG_KEY)
+    if payload and payload.get("version") == version:
+        return payload["items"]
+    return None
+
+
+def _build_single_flight(version) -> Dict[str, dict]:
+    """Monta e publica o catálogo, ou espera quem já está montando."""
+    if cache.add(IBGE_CATALOG_LOCK_KEY, version, timeout=BUILD_LOCK_TIMEOUT):
+        try:
+            # Outro worker pode ter publicado entre a leitura e o lock
+            items = _from_shared_cache(version)
+            if items is None:
+                items = build_ibge_catalog()
+                cache.set(IBGE_CATALOG_KEY, {"version": version, "items": items}, timeout=None)
+                logger.info("IBGE catalog built: %d items", len(items))
+            return items
+        finally:
+            cache.delete(IBGE_CATALOG_LOCK_KEY)
+
+    deadline = time.monotonic() + BUILD_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_POLL_INTERVAL)
+        items = _from_shared_cache(version)
+        if items is not None:
+            return items
+        if cache.get(IBGE_CATALOG_LOCK_KEY) is None:
+            break
+
+    # Quem tinha o lock falhou ou demorou demais: monta localmente sem publicar
+    logger.warning("IBGE catalog build by another worker timed out, building locally")
+    return build_ibge_catalog()
+
+
+def get_ibge_catalog() -> Dict[str, dict]:
+    """Catálogo IBGE na versão atual: cópia do processo, cache compartilhado ou banco."""
+    global _local
+
+    version = ibge_catalog_version()
+    local_version, items = _local
+    if local_version == version:
+        return items
+
+    with _lock:
+        local_version, items = _local
+        if local_version == version:
+            return items
+
+        try:
+            items = _from_shared_cache(version)
+            if items is None:
+                items = _build_single_flight(version)
+        except Exception as e:
+            # Tabelas ainda não migradas, banco indisponível, etc.
+            print(f"Error loading IBGE cache: {e}")
+            return {}
+
+        _local = (version, items)
+        return items
+
+
+def reset_ibge_catalog():
+    """Descarta a cópia do processo (o cache compartilhado continua válido)."""
+    global _local
+    with _lock:
+        _local = (None, {})
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from diets.models import FoodSubstitutionRule
+from diets.substitution_pool import get_substitution_pool
+from diets.substitution_rules import TOP_PADRAO, sincronizar_regras
+
+
+class Command(BaseCommand):
+    help = 'Gera regras de substituição por similaridade nutricional dentro de cada grupo (incremental)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top', type=int, default=TOP_PADRAO,
+            help=f'Substitutos por alimento e tipo de dieta (padrão: {TOP_PADRAO})',
+        )
+        parser.add_argument(
+            '--dieta', action='append', dest='dietas',
+            help='Tipo de dieta (pode repetir). Padrão: todos, exceto personalizada',
+        )
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Recalcula todos os grupos, mesmo os que não mudaram desde a última execução',
+        )
+
+    def handle(self, *args, **options):
+        validos = [codigo for codigo, _ in FoodSubstitutionRule.DIET_TYPE_CHOICES]
+        dietas = options['dietas'] or [codigo for codigo in validos if codigo != 'personalizada']
+        invalidas = [d for d in dietas if d not in validos]
+        if invalidas:
+            raise CommandError(f'Tipo de dieta inválido: {", ".join(invalidas)}')
+        if options['top'] < 1:
+            raise CommandError('--top deve ser maior que zero')
+
+        pool = get_substitution_pool()
+        self.stdout.write(
+            f'Calculando similaridade de {len(pool)} alimentos em {len(pool.reference)} grupos...'
+        )
+        total = sincronizar_regras(
+            pool.reference, dietas, options['top'], completo=options['completo']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Concluído! {total['gravadas']} regras gravadas, {total['removidas']} removidas, "
+            f"{total['inalteradas']} inalteradas ({total['grupos']} grupos recalculados)."
+        ))
@@ -1,9 +1,12 @@
 from django.core.management.base import BaseCommand
 from diets.models import AlimentoTACO
+from diets.medidas_utils import recalculo_em_lote
 
 class Command(BaseCommand):
     help = 'Importa dados da Tabela TACO para o banco de dados'
 
+    # Recalcula as medidas padrão uma única vez ao final da carga
+    @recalculo_em_lote()
     def handle(self, *args, **options):
         import json
         import os
@@ -1,11 +1,14 @@
 from django.core.management.base import BaseCommand
 from diets.models import AlimentoTBCA
+from diets.medidas_utils import recalculo_em_lote
 import json
 import os
 
 class Command(BaseCommand):
     help = 'Importa dados da TBCA (Tabela Brasileira de Composição de Alimentos - USP)'
 
+    # Recalcula as medidas padrão uma única vez ao final da carga
+    @recalculo_em_lote()
     def handle(self, *args, **options):
         from django.conf import settings
         
@@ -1,11 +1,14 @@
 from django.core.management.base import BaseCommand
 from diets.models import AlimentoUSDA
+from diets.medidas_utils import recalculo_em_lote
 import json
 import os
 
 class Command(BaseCommand):
     help = 'Importa dados do USDA FoodData Central'
 
+    # Recalcula as medidas padrão uma única vez ao final da carga
+    @recalculo_em_lote()
     def handle(self, *args, **options):
         from django.conf import settings
         
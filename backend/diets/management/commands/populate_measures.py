@@ -1,12 +1,15 @@
 
 from django.core.management.base import BaseCommand
 from diets.models import MedidaCaseira, AlimentoMedidaIBGE
+from diets.medidas_utils import recalculo_em_lote
 import json
 import os
 
 class Command(BaseCommand):
     help = 'Popula o banco de dados com medidas do IBGE'
 
+    # Recalcula as medidas padrão uma única vez ao final da carga
+    @recalculo_em_lote()
     def handle(self, *args, **kwargs):
         # backend/diets/management/commands/populate_measures.py
         cmd_dir = os.path.dirname(os.path.abspath(__file__))
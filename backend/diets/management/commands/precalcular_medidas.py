@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from diets.medidas_utils import consumir_nomes_pendentes, recalcular_medidas, recalcular_medidas_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Pré-calcula a medida caseira padrão (IBGE) de todos os alimentos TACO/TBCA/USDA'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pendentes',
+            action='store_true',
+            help='Recalcula só os alimentos afetados pelas medidas IBGE alteradas desde a última execução',
+        )
+
+    def handle(self, *args, **options):
+        if options['pendentes']:
+            self.stdout.write('Calculando medidas dos alimentos afetados por alterações pendentes...')
+            total = recalcular_medidas_pendentes()
+        else:
+            self.stdout.write('Calculando medidas padrão...')
+            # O recálculo completo já cobre as alterações pendentes
+            consumir_nomes_pendentes()
+            total = recalcular_medidas()
+        self.stdout.write(self.style.SUCCESS(f'Concluído! {total} alimentos com medidas pré-calculadas.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from diets.catalog import CUSTOM, REFERENCE, bump_catalog_version
+from diets.models import AlimentoTACO, AlimentoTBCA, AlimentoUSDA, CustomFood
+from diets.nutritional_substitution import recalcular_grupos_nutricionais
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o grupo nutricional de todos os alimentos (rodar após alterar GRUPOS_NUTRICIONAIS)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Recalculando grupos nutricionais...')
+        total = recalcular_grupos_nutricionais(
+            [AlimentoTACO, AlimentoTBCA, AlimentoUSDA, CustomFood]
+        )
+        if total:
+            # UPDATE em massa não dispara signals: invalida os catálogos manualmente
+            bump_catalog_version(REFERENCE)
+            bump_catalog_version(CUSTOM)
+            for nutritionist_id in CustomFood.objects.values_list("nutritionist_id", flat=True).distinct():
+                bump_catalog_version(CUSTOM, owner=nutritionist_id)
+        self.stdout.write(self.style.SUCCESS(f'Concluído! {total} alimentos com grupo alterado.'))
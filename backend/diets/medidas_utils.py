@@ -0,0 +1,441 @@
+"""
+Medidas caseiras padrão dos alimentos TACO/TBCA/USDA.
+
+A escolha da medida padrão (e da lista de medidas disponíveis) a partir da
+tabela IBGE era feita na busca, item a item, varrendo todas as medidas com
+testes de substring. Aqui o mesmo cálculo é feito uma vez por alimento e
+gravado em `MedidaPadraoAlimento`; a busca só faz o lookup.
+
+A tabela é recalculada inteira pelo comando `precalcular_medidas` e de forma
+incremental quando medidas IBGE, medidas caseiras ou alimentos mudam: um
+alimento alterado é recalculado direto pelo signal; uma medida alterada só
+anota o nome IBGE como pendente, e os alimentos afetados são recalculados
+fora da requisição (ver "Nomes IBGE pendentes").
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+MEDIDAS_TRIVIAIS = ["Grama", "Quilo", "Miligrama"]
+
+PALAVRAS_LIQUIDOS = [
+    "suco", "agua", "água", "cafe", "café", "cha", "chá", "leite", "bebida",
+    "vitamina", "refrigerante", "iogurte", "yogurte", "cerveja", "vinho",
+]
+PALAVRAS_FRUTAS_INTEIRAS = [
+    "laranja", "maca", "maçã", "banana", "mamao", "mamão", "melancia", "melao",
+    "pao", "pão", "pera", "pêra", "tangerina", "mexerica", "kiwi", "batata doce",
+]
+PALAVRAS_DOCES = ["bolo", "torta", "pizza", "pudim", "chocolate"]
+PALAVRAS_FOLHOSOS = [
+    "alface", "rucula", "rúcula", "agriao", "agrião", "couve", "espinafre",
+    "escarola", "acelga",
+]
+
+PRIORIDADES_LIQUIDOS = ["Mililitro", "Ml", "Copo", "Xícara", "Caneca", "Taça"]
+PRIORIDADES_FRUTAS_INTEIRAS = ["Unidade", "Fatia", "Gomo", "Pedaço"]
+PRIORIDADES_DOCES = ["Fatia", "Pedaço", "Unidade", "Barra"]
+PRIORIDADES_FOLHOSOS = ["Prato", "Folha", "Pires"]
+PRIORIDADES_PADRAO = [
+    "Colher de arroz", "Colher de sopa", "Concha", "Escumadeira", "Colher",
+]
+PRIORIDADES_FALLBACK = ["Unidade", "Colher de sopa", "Fatia", "Copo"]
+
+MedidaAlimento = Tuple[Optional[str], Optional[float], List[dict]]
+
+
+def carregar_medidas_ibge() -> List[dict]:
+    """
+    Medidas IBGE no mesmo formato do `FoodSearchViewSet.IBGE_CACHE`: uma
+    entrada por nome de alimento (a primeira na ordenação do modelo).
+    """
+    from .models import AlimentoMedidaIBGE
+
+    medidas = {}
+    rows = AlimentoMedidaIBGE.objects.order_by("nome_alimento", "medida__nome").values_list(
+        "nome_alimento", "medida__nome", "peso_g"
+    )
+    for nome, medida_nome, peso_g in rows.iterator():
+        if not nome or nome in medidas:
+            continue
+        medidas[nome] = {
+            "nome_lower": nome.lower(),
+            "medida_nome": medida_nome or "Medida",
+            "peso_g": peso_g,
+        }
+    return list(medidas.values())
+
+
+def termo_busca_medida(food_name: str) -> str:
+    """Nome limpo usado para casar o alimento com as medidas IBGE."""
+    parts = food_name.split(",")
+    clean_name = parts[0].strip()
+
+    if len(parts) > 1 and len(clean_name.split()) == 1:
+        potential_name = f"{clean_name} {parts[1].strip()}"
+        if len(potential_name) < 30:
+            clean_name = potential_name
+
+    return clean_name
+
+
+def _prioridades(name_lower: str) -> List[str]:
+    if any(x in name_lower for x in PALAVRAS_LIQUIDOS):
+        return PRIORIDADES_LIQUIDOS
+    if any(x in name_lower for x in PALAVRAS_FRUTAS_INTEIRAS):
+        return PRIORIDADES_FRUTAS_INTEIRAS
+    if any(x in name_lower for x in PALAVRAS_DOCES):
+        return PRIORIDADES_DOCES
+    if any(x in name_lower for x in PALAVRAS_FOLHOSOS):
+        return PRIORIDADES_FOLHOSOS
+    return PRIORIDADES_PADRAO
+
+
+def calcular_medidas_alimento(food_name: str, medidas_ibge: Iterable[dict]) -> MedidaAlimento:
+    """
+    Retorna a melhor medida padrão e uma lista de todas as medidas disponíveis
+    para o alimento: (nome da medida, peso em g, [{label, weight}, ...]).
+    """
+    if not food_name:
+        return None, None, []
+
+    medidas_ibge = list(medidas_ibge)
+    clean_name = termo_busca_medida(food_name)
+    search_term = clean_name.lower()
+
+    matches = [
+        m for m in medidas_ibge
+        if search_term in m["nome_lower"] and m["medida_nome"] not in MEDIDAS_TRIVIAIS
+    ]
+
+    palavras = clean_name.split()
+    if not matches and palavras:
+        first_word = palavras[0].lower()
+        if len(first_word) > 3:
+            matches = [
+                m for m in medidas_ibge
+                if first_word in m["nome_lower"] and m["medida_nome"] not in MEDIDAS_TRIVIAIS
+            ]
+
+    if not matches:
+        return None, None, []
+
+    available_measures = []
+    seen_measures = set()
+    for m in matches:
+        if m["medida_nome"] not in seen_measures:
+            available_measures.append({"label": m["medida_nome"], "weight": m["peso_g"]})
+            seen_measures.add(m["medida_nome"])
+
+    priorities = _prioridades(search_term)
+
+    # Primeiro por prefixo (mais específico: 'Colher de arroz' antes de 'Colher'),
+    # depois por substring e, por fim, pelas prioridades genéricas.
+    best_match = None
+    for priority in priorities:
+        best_match = next(
+            (m for m in available_measures if m["label"].lower().startswith(priority.lower())),
+            None,
+        )
+        if best_match:
+            break
+
+    for priority in ([] if best_match else priorities + PRIORIDADES_FALLBACK):
+        best_match = next(
+            (m for m in available_measures if priority.lower() in m["label"].lower()),
+            None,
+        )
+        if best_match:
+            break
+
+    if not best_match:
+        best_match = available_measures[0]
+
+    return best_match["label"], best_match["weight"], available_measures
+
+
+# --- Tabela pré-calculada -----------------------------------------------------
+
+
+def _nomes_alimentos(alimentos: Optional[Iterable[Tuple[str, int]]] = None):
+    """(fonte, id, nome) dos alimentos de referência, todos ou só os informados."""
+    from .models import AlimentoTACO, AlimentoTBCA, AlimentoUSDA
+
+    modelos = {"TACO": AlimentoTACO, "TBCA": AlimentoTBCA, "USDA": AlimentoUSDA}
+    ids_por_fonte = None
+    if alimentos is not None:
+        ids_por_fonte = {source: set() for source in modelos}
+        for source, food_id in alimentos:
+            if source in ids_por_fonte:
+                ids_por_fonte[source].add(food_id)
+
+    for source, model in modelos.items():
+        qs = model.objects.all()
+        if ids_por_fonte is not None:
+            if not ids_por_fonte[source]:
+                continue
+            qs = qs.filter(id__in=ids_por_fonte[source])
+        for food_id, nome in qs.values_list("id", "nome").iterator():
+            yield source, food_id, nome
+
+
+def _medidas_existentes(alimentos: Optional[List[Tuple[str, int]]] = None):
+    """{(fonte, id): (pk, medida_nome, peso_g, medidas)} já gravados."""
+    from .models import MedidaPadraoAlimento
+
+    campos = ("food_source", "food_id", "pk", "medida_nome", "peso_g", "medidas")
+    if alimentos is None:
+        consultas = [MedidaPadraoAlimento.objects.all()]
+    else:
+        ids_por_fonte: Dict[str, set] = {}
+        for source, food_id in alimentos:
+            ids_por_fonte.setdefault(source, set()).add(food_id)
+        consultas = [
+            MedidaPadraoAlimento.objects.filter(food_source=source, food_id__in=ids)
+            for source, ids in ids_por_fonte.items()
+        ]
+    existentes = {}
+    for qs in consultas:
+        for source, food_id, *valores in qs.values_list(*campos).iterator():
+            existentes[(source, food_id)] = tuple(valores)
+    return existentes
+
+
+def recalcular_medidas(alimentos: Optional[Iterable[Tuple[str, int]]] = None, batch_size: int = 1000) -> int:
+    """
+    Recalcula a medida padrão de todos os alimentos (ou só dos informados, como
+    pares (fonte, id)) e grava em `MedidaPadraoAlimento`. Retorna o número de
+    alimentos gravados.
+    """
+    from .models import MedidaPadraoAlimento
+
+    if alimentos is not None:
+        alimentos = list(alimentos)
+        if not alimentos:
+            return 0
+
+    medidas_ibge = carregar_medidas_ibge()
+    objs = []
+    for source, food_id, nome in _nomes_alimentos(alimentos):
+        medida_nome, peso_g, medidas = calcular_medidas_alimento(nome, medidas_ibge)
+        objs.append(
+            MedidaPadraoAlimento(
+                food_source=source,
+                food_id=food_id,
+                medida_nome=medida_nome,
+                peso_g=peso_g,
+                medidas=medidas,
+            )
+        )
+
+    # Upsert portável (MySQL/MariaDB não aceitam update_conflicts com
+    # unique_fields): atualiza pela pk só as linhas que mudaram e insere as novas
+    existentes = _medidas_existentes(alimentos)
+    alteradas, novas = [], []
+    agora = timezone.now()
+    for obj in objs:
+        atual = existentes.get((obj.food_source, obj.food_id))
+        if atual is None:
+            novas.append(obj)
+        elif atual[1:] != (obj.medida_nome, obj.peso_g, obj.medidas):
+            obj.pk = atual[0]
+            obj.updated_at = agora
+            alteradas.append(obj)
+
+    with transaction.atomic():
+        MedidaPadraoAlimento.objects.bulk_update(
+            alteradas,
+            ["medida_nome", "peso_g", "medidas", "updated_at"],
+            batch_size=batch_size,
+        )
+        # Linha criada por um recálculo concorrente: o valor é o mesmo
+        MedidaPadraoAlimento.objects.bulk_create(
+            novas, batch_size=batch_size, ignore_conflicts=True
+        )
+
+    # Alimentos removidos desde o último cálculo
+    calculados = {(obj.food_source, obj.food_id) for obj in objs}
+    if alimentos is None:
+        obsoletos = set(existentes) - calculados
+    else:
+        obsoletos = set(alimentos) - calculados
+    for source in {source for source, _ in obsoletos}:
+        MedidaPadraoAlimento.objects.filter(
+            food_source=source,
+            food_id__in=[food_id for s, food_id in obsoletos if s == source],
+        ).delete()
+
+    return len(objs)
+
+
+_indice = {"version": None, "termos": {}}
+_indice_lock = threading.Lock()
+
+
+def _termos_do_alimento(nome: str) -> List[str]:
+    """Termos que `calcular_medidas_alimento` procura como substring do nome IBGE."""
+    clean_name = termo_busca_medida(nome)
+    termos = [clean_name.lower()]
+    palavras = clean_name.split()
+    if palavras and len(palavras[0]) > 3:
+        termos.append(palavras[0].lower())
+    return termos
+
+
+def _indice_termos() -> Dict[str, List[Tuple[str, int]]]:
+    """
+    {termo: [(fonte, id), ...]} dos alimentos de referência, montado uma vez
+    por versão do catálogo REFERENCE (o worker que consome os pendentes
+    reaproveita o índice entre execuções).
+    """
+    from .catalog import REFERENCE, get_catalog_version
+
+    version = get_catalog_version(REFERENCE)
+    with _indice_lock:
+        if _indice["version"] == version:
+            return _indice["termos"]
+        termos: Dict[str, List[Tuple[str, int]]] = {}
+        for source, food_id, nome in _nomes_alimentos():
+            if not nome:
+                continue
+            for termo in set(_termos_do_alimento(nome)):
+                if termo:
+                    termos.setdefault(termo, []).append((source, food_id))
+        _indice.update(version=version, termos=termos)
+        return termos
+
+
+def alimentos_afetados(nomes_ibge: Iterable[str]) -> List[Tuple[str, int]]:
+    """
+    Alimentos cuja medida pode mudar quando as medidas IBGE com esses nomes
+    mudam: os que casariam com eles em `calcular_medidas_alimento`.
+
+    Em vez de testar o termo de cada alimento contra os nomes IBGE, procura
+    cada substring do nome IBGE no índice de termos (nomes IBGE são curtos),
+    o que dá exatamente o mesmo conjunto.
+    """
+    nomes = [nome.lower() for nome in nomes_ibge if nome]
+    if not nomes:
+        return []
+
+    indice = _indice_termos()
+    afetados = set()
+    for nome_ibge in nomes:
+        tamanho = len(nome_ibge)
+        for inicio in range(tamanho):
+            for fim in range(inicio + 1, tamanho + 1):
+                afetados.update(indice.get(nome_ibge[inicio:fim], ()))
+    return sorted(afetados)
+
+
+# --- Nomes IBGE pendentes -----------------------------------------------------
+#
+# Uma medida IBGE ou caseira alterada pode mudar a medida padrão de muitos
+# alimentos. Os signals só anotam os nomes IBGE alterados no cache do Django
+# (compartilhado entre os workers); o recálculo roda fora da requisição, na
+# task `recalcular_medidas_pendentes` (agendada com atraso, agrupando as
+# alterações próximas) ou no comando `precalcular_medidas --pendentes`.
+
+MEDIDAS_PENDENTES_KEY = "diets:medidas:nomes_pendentes"
+MEDIDAS_PENDENTES_LOCK_KEY = "diets:medidas:nomes_pendentes:lock"
+MEDIDAS_AGENDADO_KEY = "diets:medidas:recalculo_agendado"
+MEDIDAS_DEBOUNCE_S = 60
+# Marcador de "recalcular tudo": usado quando a trava não pôde ser obtida,
+# para nunca perder um nome anotado por outro worker.
+TODOS_PENDENTES = "*"
+
+
+@contextmanager
+def _trava_pendentes(tentativas: int = 50):
+    from django.core.cache import cache
+
+    for _ in range(tentativas):
+        if cache.add(MEDIDAS_PENDENTES_LOCK_KEY, 1, timeout=10):
+            try:
+                yield True
+            finally:
+                cache.delete(MEDIDAS_PENDENTES_LOCK_KEY)
+            return
+        time.sleep(0.01)
+    yield False
+
+
+def marcar_nomes_pendentes(nomes_ibge: Iterable[str]) -> None:
+    """Anota nomes IBGE cujas medidas mudaram para o próximo recálculo."""
+    from django.core.cache import cache
+
+    nomes = {nome for nome in nomes_ibge if nome}
+    if not nomes:
+        return
+    with _trava_pendentes() as travado:
+        if not travado:
+            nomes = {TODOS_PENDENTES}
+        pendentes = set(cache.get(MEDIDAS_PENDENTES_KEY) or ())
+        cache.set(MEDIDAS_PENDENTES_KEY, sorted(pendentes | nomes), timeout=None)
+
+
+def consumir_nomes_pendentes() -> Optional[List[str]]:
+    """
+    Retira e retorna os nomes IBGE pendentes; None quando for preciso
+    recalcular a tabela inteira.
+    """
+    from django.core.cache import cache
+
+    with _trava_pendentes() as travado:
+        pendentes = cache.get(MEDIDAS_PENDENTES_KEY) or []
+        cache.delete(MEDIDAS_PENDENTES_KEY)
+        cache.delete(MEDIDAS_AGENDADO_KEY)
+    if not travado or TODOS_PENDENTES in pendentes:
+        return None
+    return pendentes
+
+
+def recalcular_medidas_pendentes() -> int:
+    """Recalcula os alimentos afetados pelos nomes IBGE pendentes."""
+    nomes = consumir_nomes_pendentes()
+    if nomes is None:
+        return recalcular_medidas()
+    return recalcular_medidas(alimentos_afetados(nomes))
+
+
+def buscar_medidas(source: str, ids: Iterable[int]) -> Dict[int, MedidaAlimento]:
+    """Medidas pré-calculadas por id para uma fonte, em uma única query."""
+    from .models import MedidaPadraoAlimento
+
+    rows = MedidaPadraoAlimento.objects.filter(food_source=source, food_id__in=list(ids))
+    return {
+        food_id: (medida_nome, peso_g, medidas)
+        for food_id, medida_nome, peso_g, medidas in rows.values_list(
+            "food_id", "medida_nome", "peso_g", "medidas"
+        )
+    }
+
+
+# --- Recálculo incremental ----------------------------------------------------
+
+_estado = threading.local()
+
+
+def recalculo_suspenso() -> bool:
+    return getattr(_estado, "suspenso", False)
+
+
+@contextmanager
+def recalculo_em_lote():
+    """
+    Suspende o recálculo incremental durante cargas em massa (importação de
+    tabelas, medidas IBGE) e recalcula a tabela inteira uma vez no final.
+    """
+    anterior = recalculo_suspenso()
+    _estado.suspenso = True
+    try:
+        yield
+    finally:
+        _estado.suspenso = anterior
+    if not anterior:
+        recalcular_medidas()
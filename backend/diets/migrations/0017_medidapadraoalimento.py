@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0016_customfood'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedidaPadraoAlimento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('food_source', models.CharField(max_length=10)),
+                ('food_id', models.IntegerField()),
+                ('medida_nome', models.CharField(blank=True, max_length=100, null=True)),
+                ('peso_g', models.FloatField(blank=True, null=True)),
+                ('medidas', models.JSONField(default=list, help_text='Lista de medidas disponíveis ({label, weight})')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Medida Padrão de Alimento',
+                'verbose_name_plural': 'Medidas Padrão de Alimentos',
+                'unique_together': {('food_source', 'food_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0017_medidapadraoalimento'),
+    ]
+
+    # O preenchimento dos alimentos existentes fica com o comando
+    # `recalcular_grupos_nutricionais`; até lá o grupo vazio é calculado pelo nome.
+    operations = [
+        migrations.AddField(
+            model_name='alimentotaco',
+            name='grupo_nutricional',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Grupo de substituição (calculado a partir do nome ao salvar)', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='alimentotbca',
+            name='grupo_nutricional',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Grupo de substituição (calculado a partir do nome ao salvar)', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='alimentousda',
+            name='grupo_nutricional',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Grupo de substituição (calculado a partir do nome ao salvar)', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='customfood',
+            name='grupo_nutricional',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, help_text='Grupo de substituição (calculado a partir do nome ao salvar)', max_length=50),
+        ),
+    ]
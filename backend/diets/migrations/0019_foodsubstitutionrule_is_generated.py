@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0018_grupo_nutricional'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodsubstitutionrule',
+            name='is_generated',
+            field=models.BooleanField(default=False, editable=False, help_text='Gerada pelo comando calcular_regras_substituicao (recalculada a cada execução)'),
+        ),
+        migrations.AddIndex(
+            model_name='foodsubstitutionrule',
+            index=models.Index(fields=['diet_type', 'is_generated'], name='diets_foods_diet_ty_b93cf5_idx'),
+        ),
+    ]
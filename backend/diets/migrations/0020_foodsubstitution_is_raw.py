@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+def marcar_crus(apps, schema_editor):
+    # Mesmo critério do save(): "cru" no nome (cobre "crua"). O termo é ASCII,
+    # então icontains equivale ao lower() do Python
+    FoodSubstitution = apps.get_model("diets", "FoodSubstitution")
+    FoodSubstitution.objects.filter(substitute_food_name__icontains="cru").update(is_raw=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0019_foodsubstitutionrule_is_generated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodsubstitution',
+            name='is_raw',
+            field=models.BooleanField(db_index=True, default=False, editable=False, help_text='Substituto cru (calculado no save a partir do nome)'),
+        ),
+        migrations.AddIndex(
+            model_name='foodsubstitution',
+            index=models.Index(fields=['original_source', 'original_food_id', 'is_approved', 'group'], name='diets_foods_origina_73464c_idx'),
+        ),
+        migrations.RunPython(marcar_crus, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0020_foodsubstitution_is_raw'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DietDaySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day_of_week', models.IntegerField(help_text='0=Segunda, 6=Domingo')),
+                ('source_day', models.IntegerField(blank=True, help_text='Dia cujas refeições foram usadas (fallback)', null=True)),
+                ('version', models.CharField(max_length=100)),
+                ('data', models.JSONField(default=list, help_text='Refeições do dia, sem status')),
+                ('built_at', models.DateTimeField(auto_now=True)),
+                ('diet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_snapshots', to='diets.diet')),
+            ],
+            options={
+                'verbose_name': 'Snapshot do Dia da Dieta',
+                'verbose_name_plural': 'Snapshots dos Dias da Dieta',
+                'unique_together': {('diet', 'day_of_week')},
+            },
+        ),
+    ]
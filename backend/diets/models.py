@@ -4,6 +4,7 @@ from django.core.exceptions import ValidationError
 import json
 from django.conf import settings
 from utils.sanitization import sanitize_string
+from .nutritional_substitution import identificar_grupo_nutricional
 
 
 # Modelo para Favoritos
@@ -152,6 +153,14 @@ class AlimentoTACO(models.Model):
     grupo = models.CharField(
         max_length=50, help_text="Grupo alimentar (ex: Cereais, Carnes, etc.)"
     )
+    grupo_nutricional = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        db_index=True,
+        editable=False,
+        help_text="Grupo de substituição (calculado a partir do nome ao salvar)",
+    )
 
     # Unidades de medida mais comuns
     unidade_caseira = models.CharField(
@@ -179,6 +188,10 @@ class AlimentoTACO(models.Model):
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        self.grupo_nutricional = identificar_grupo_nutricional(self.nome) or ""
+        super().save(*args, **kwargs)
+
     @property
     def calorias(self):
         """Alias para energia_kcal para compatibilidade"""
@@ -238,6 +251,14 @@ class AlimentoTBCA(models.Model):
 
     # Categorização
     grupo = models.CharField(max_length=100, help_text="Grupo alimentar")
+    grupo_nutricional = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        db_index=True,
+        editable=False,
+        help_text="Grupo de substituição (calculado a partir do nome ao salvar)",
+    )
 
     # Unidade caseira
     unidade_caseira = models.CharField(
@@ -262,6 +283,10 @@ class AlimentoTBCA(models.Model):
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        self.grupo_nutricional = identificar_grupo_nutricional(self.nome) or ""
+        super().save(*args, **kwargs)
+
     @property
     def calorias(self):
         return self.energia_kcal
@@ -318,6 +343,14 @@ class AlimentoUSDA(models.Model):
 
     # Categorização
     categoria = models.CharField(max_length=100, help_text="Categoria USDA")
+    grupo_nutricional = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        db_index=True,
+        editable=False,
+        help_text="Grupo de substituição (calculado a partir do nome ao salvar)",
+    )
 
     # Porção padrão
     porcao_padrao_g = models.FloatField(
@@ -339,6 +372,10 @@ class AlimentoUSDA(models.Model):
     def __str__(self):
         return self.nome
 
+    def save(self, *args, **kwargs):
+        self.grupo_nutricional = identificar_grupo_nutricional(self.nome) or ""
+        super().save(*args, **kwargs)
+
     @property
     def calorias(self):
         return self.energia_kcal
@@ -651,6 +688,32 @@ class FoodItem(models.Model):
         return f"{self.food_name} - {self.quantity}{self.unit}"
 
 
+class DietDaySnapshot(models.Model):
+    """
+    Plano do dia pré-calculado para o app do paciente (ver `day_snapshot.py`):
+    refeições, itens, macros e substituições já resolvidas de um dia da semana.
+    Reconstruído em background quando a dieta é salva; `version` identifica
+    a dieta e os catálogos com que foi montado.
+    """
+
+    diet = models.ForeignKey(Diet, on_delete=models.CASCADE, related_name="day_snapshots")
+    day_of_week = models.IntegerField(help_text="0=Segunda, 6=Domingo")
+    source_day = models.IntegerField(
+        null=True, blank=True, help_text="Dia cujas refeições foram usadas (fallback)"
+    )
+    version = models.CharField(max_length=100)
+    data = models.JSONField(default=list, help_text="Refeições do dia, sem status")
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Snapshot do Dia da Dieta"
+        verbose_name_plural = "Snapshots dos Dias da Dieta"
+        unique_together = ["diet", "day_of_week"]
+
+    def __str__(self):
+        return f"{self.diet_id} - dia {self.day_of_week} ({self.version})"
+
+
 # =============================================================================
 # MODELOS DE SUBSTITUIÇÃO DE ALIMENTOS
 # Substituições com equivalência nutricional baseada no macronutriente predominante
@@ -700,6 +763,9 @@ class FoodSubstitution(models.Model):
     Contém os dados nutricionais do substituto para cálculo de equivalência.
     """
 
+    # Substitutos com estes termos no nome são alimentos crus, fora da lista
+    RAW_KEYWORDS = ("cru", "crua")
+
     SOURCE_CHOICES = [
         ("TACO", "Tabela TACO"),
         ("TBCA", "Tabela TBCA"),
@@ -757,6 +823,12 @@ class FoodSubstitution(models.Model):
     order = models.IntegerField(
         default=0, help_text="Ordem de exibição na lista de substitutos"
     )
+    is_raw = models.BooleanField(
+        default=False,
+        db_index=True,
+        editable=False,
+        help_text="Substituto cru (calculado no save a partir do nome)",
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -771,10 +843,20 @@ class FoodSubstitution(models.Model):
             "substitute_food_id",
         ]
         ordering = ["group", "order", "substitute_food_name"]
+        indexes = [
+            models.Index(
+                fields=["original_source", "original_food_id", "is_approved", "group"]
+            ),
+        ]
 
     def __str__(self):
         return f"{self.original_food_name} → {self.substitute_food_name}"
 
+    def save(self, *args, **kwargs):
+        nome = (self.substitute_food_name or "").lower()
+        self.is_raw = any(kw in nome for kw in self.RAW_KEYWORDS)
+        super().save(*args, **kwargs)
+
 
 # =============================================================================
 # MODELOS DE MEDIDAS CASEIRAS IBGE
@@ -925,6 +1007,31 @@ class AlimentoMedidaIBGE(models.Model):
         return f"1 {self.medida.nome} = {self.peso_g}g"
 
 
+class MedidaPadraoAlimento(models.Model):
+    """
+    Medida caseira padrão pré-calculada para cada alimento TACO/TBCA/USDA.
+    Derivada das medidas IBGE (ver `medidas_utils.py`) para que a busca de
+    alimentos faça um lookup em vez de varrer todas as medidas a cada item.
+    """
+
+    food_source = models.CharField(max_length=10)  # TACO, TBCA, USDA
+    food_id = models.IntegerField()  # ID na tabela de origem
+    medida_nome = models.CharField(max_length=100, null=True, blank=True)
+    peso_g = models.FloatField(null=True, blank=True)
+    medidas = models.JSONField(
+        default=list, help_text="Lista de medidas disponíveis ({label, weight})"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Medida Padrão de Alimento"
+        verbose_name_plural = "Medidas Padrão de Alimentos"
+        unique_together = ["food_source", "food_id"]
+
+    def __str__(self):
+        return f"{self.food_source}_{self.food_id}: {self.medida_nome} ({self.peso_g}g)"
+
+
 class DietViewLog(models.Model):
     """
     Registra cada vez que um paciente visualiza seu plano alimentar.
@@ -1156,6 +1263,14 @@ class CustomFood(models.Model):
     )
     nome = models.CharField(max_length=200, help_text="Nome do alimento personalizado")
     grupo = models.CharField(max_length=100, blank=True, null=True, help_text="Grupo alimentar")
+    grupo_nutricional = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        db_index=True,
+        editable=False,
+        help_text="Grupo de substituição (calculado a partir do nome ao salvar)",
+    )
 
     # Macronutrientes por 100g
     energia_kcal = models.FloatField(default=0, help_text="Energia em kcal por 100g")
@@ -1189,6 +1304,7 @@ class CustomFood(models.Model):
             self.grupo = sanitize_string(self.grupo)
         if self.unidade_caseira:
             self.unidade_caseira = sanitize_string(self.unidade_caseira)
+        self.grupo_nutricional = identificar_grupo_nutricional(self.nome) or ""
         super().save(*args, **kwargs)
 
     @property
@@ -1286,6 +1402,11 @@ class FoodSubstitutionRule(models.Model):
     )
     is_active = models.BooleanField(default=True, help_text="Se a regra está ativa")
     notes = models.TextField(blank=True, help_text="Observações para o nutricionista")
+    is_generated = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="Gerada pelo comando calcular_regras_substituicao (recalculada a cada execução)",
+    )
 
     # Rastreamento
     created_by = models.ForeignKey(
@@ -1315,6 +1436,7 @@ class FoodSubstitutionRule(models.Model):
             models.Index(fields=["diet_type", "nutrient_predominant"]),
             models.Index(fields=["original_source", "original_food_id"]),
             models.Index(fields=["is_active"]),
+            models.Index(fields=["diet_type", "is_generated"]),
         ]
 
     def __str__(self):
@@ -11,7 +11,8 @@ Data: 2025
 """
 
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import numpy as np
 from unidecode import unidecode
 from .search_utils import calcular_score_radical, normalizar_para_scoring
 
@@ -215,6 +216,32 @@ GRUPOS_NUTRICIONAIS = {
 }
 
 
+# Grupos sem substituição automática: Água de Coco e Iogurtes (bloqueio total
+# a pedido do usuário)
+GRUPOS_BLOQUEADOS = frozenset({"agua_de_coco", "iogurtes"})
+
+# Modos de cálculo das gramas equivalentes: "macro" equaliza o macro
+# preponderante do grupo; "multi" ajusta proteína, carboidrato, gordura e
+# calorias juntos (ver MatrizSubstituicao.calcular_multi)
+MODO_MACRO = "macro"
+MODO_MULTI = "multi"
+MODOS_SUBSTITUICAO = (MODO_MACRO, MODO_MULTI)
+
+# Nomes dos grupos já normalizados, calculados uma única vez na importação do
+# módulo: (grupo, nomes completos, nomes base antes da primeira vírgula)
+_GRUPOS_NORMALIZADOS = [
+    (
+        grupo,
+        frozenset(unidecode(a.lower()) for a in dados["alimentos_recomendados"]),
+        tuple(
+            unidecode(a.lower()).split(",")[0].strip()
+            for a in dados["alimentos_recomendados"]
+        ),
+    )
+    for grupo, dados in GRUPOS_NUTRICIONAIS.items()
+]
+
+
 # =============================================================================
 # CLASSES DE DADOS
 # =============================================================================
@@ -232,6 +259,8 @@ class NutricaoAlimento:
     fibra_g: float = 0.0
     grupo: str = ""
     fonte: str = ""  # TACO, TBCA, USDA
+    grupo_nutricional: Optional[str] = None  # Pré-calculado no banco, quando disponível
+    id: Optional[int] = None  # Chave primária na tabela de origem, quando disponível
 
 
 @dataclass
@@ -249,6 +278,11 @@ class ResultadoSubstituicao:
     diferenca_calorica: float
     calorias_por_100g_original: float
     calorias_por_100g_substituto: float
+    # Erro ponderado (kcal) do ajuste em proteína, carboidrato, gordura e
+    # calorias; só no modo "multi"
+    erro_macros: Optional[float] = None
+    # Dados completos do substituto (fonte, id, macros), quando vem do motor vetorizado
+    substituto: Optional[NutricaoAlimento] = field(default=None, compare=False, repr=False)
 
 
 # =============================================================================
@@ -287,19 +321,15 @@ def identificar_grupo_nutricional(alimento_nome: str) -> Optional[str]:
     if "leite" in nome_normalizado and not any(x in nome_normalizado for x in ["coco", "condensado", "creme", "doce"]):
          return "laticinios"
 
-    # Resto dos grupos
-    for grupo, dados in GRUPOS_NUTRICIONAIS.items():
-        # Normalizar também os alimentos da lista para comparação
-        alimentos_grupo = [unidecode(a.lower()) for a in dados["alimentos_recomendados"]]
-
+    # Resto dos grupos (na ordem de GRUPOS_NUTRICIONAIS)
+    for grupo, nomes_exatos, nomes_base in _GRUPOS_NORMALIZADOS:
         # Busca exata primeiro
-        if nome_normalizado in alimentos_grupo:
+        if nome_normalizado in nomes_exatos:
             return grupo
 
-        # Busca por contém
-        for alimento in alimentos_grupo:
-            alimento_tokens = alimento.split(",")[0].strip() # Pega só o nome base ex "Arroz"
-            if alimento_tokens in nome_normalizado:
+        # Busca por contém (só o nome base, ex "arroz")
+        for base in nomes_base:
+            if base in nome_normalizado:
                 return grupo
 
     return None
@@ -318,6 +348,8 @@ def alimento_taco_para_nutricao(alimento_taco) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_taco.fibra_g),
         grupo=alimento_taco.grupo or "",
         fonte="TACO",
+        grupo_nutricional=alimento_taco.grupo_nutricional or identificar_grupo_nutricional(alimento_taco.nome),
+        id=alimento_taco.id,
     )
 
 
@@ -332,6 +364,8 @@ def alimento_tbca_para_nutricao(alimento_tbca) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_tbca.fibra_g),
         grupo=alimento_tbca.grupo or "",
         fonte="TBCA",
+        grupo_nutricional=alimento_tbca.grupo_nutricional or identificar_grupo_nutricional(alimento_tbca.nome),
+        id=alimento_tbca.id,
     )
 
 
@@ -346,26 +380,15 @@ def alimento_usda_para_nutricao(alimento_usda) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_usda.fibra_g),
         grupo=alimento_usda.categoria or "",
         fonte="USDA",
+        grupo_nutricional=alimento_usda.grupo_nutricional or identificar_grupo_nutricional(alimento_usda.nome),
+        id=alimento_usda.id,
     )
 
 
-def calcular_substituicao(
-    alimento_original: NutricaoAlimento,
-    alimento_substituto: NutricaoAlimento,
-    grupo: str,
-    quantidade_original_g: float = 100.0,
-) -> ResultadoSubstituicao:
+def macro_preponderante_do_grupo(grupo: str, alimento_original: NutricaoAlimento) -> str:
     """
-    Calcula a substituição ideal entre dois alimentos do mesmo grupo.
-
-    Args:
-        alimento_original: Dados nutricionais do alimento original
-        alimento_substituto: Dados nutricionais do alimento substituto
-        grupo: Grupo nutricional dos alimentos
-        quantidade_original_g: Quantidade do alimento original em gramas
-
-    Returns:
-        ResultadoSubstituicao com a quantidade equivalente calculada
+    Macronutriente usado na equalização: o do grupo ou, para grupos fora de
+    GRUPOS_NUTRICIONAIS, o predominante no alimento original.
     """
     # Obter dados do grupo
     dados_grupo = GRUPOS_NUTRICIONAIS.get(grupo, {})
@@ -387,6 +410,29 @@ def calcular_substituicao(
             else:
                 macro_preponderante = "gordura"
 
+    return macro_preponderante
+
+
+def calcular_substituicao(
+    alimento_original: NutricaoAlimento,
+    alimento_substituto: NutricaoAlimento,
+    grupo: str,
+    quantidade_original_g: float = 100.0,
+) -> ResultadoSubstituicao:
+    """
+    Calcula a substituição ideal entre dois alimentos do mesmo grupo.
+
+    Args:
+        alimento_original: Dados nutricionais do alimento original
+        alimento_substituto: Dados nutricionais do alimento substituto
+        grupo: Grupo nutricional dos alimentos
+        quantidade_original_g: Quantidade do alimento original em gramas
+
+    Returns:
+        ResultadoSubstituicao com a quantidade equivalente calculada
+    """
+    macro_preponderante = macro_preponderante_do_grupo(grupo, alimento_original)
+
     # Calcular valores do alimento original na quantidade especificada
     cal_original = (alimento_original.energia_kcal * quantidade_original_g) / 100
     ptn_original = (alimento_original.proteina_g * quantidade_original_g) / 100
@@ -462,6 +508,7 @@ def sugerir_substitucoes(
     lista_substitutos: List[NutricaoAlimento],
     quantidade_original_g: float = 100.0,
     limite_resultados: int = 10,
+    modo: str = MODO_MACRO,
 ) -> List[ResultadoSubstituicao]:
     """
     Gera uma lista de substituições para um alimento.
@@ -471,39 +518,35 @@ def sugerir_substitucoes(
         lista_substitutos: Lista de alimentos substitutos
         quantidade_original_g: Quantidade do alimento original em gramas
         limite_resultados: Número máximo de substituições a retornar
+        modo: "macro" (equaliza o macro preponderante do grupo) ou "multi"
+            (ajuste de proteína, carboidrato, gordura e calorias juntos)
 
     Returns:
         Lista de ResultadoSubstituicao ordenada por menor diferença calórica
+        (modo "macro") ou menor erro de macros (modo "multi")
     """
     grupo = identificar_grupo_nutricional(alimento_original.nome)
 
     if not grupo:
         return []
     
-    # REGRA ESPECIAL: Água de Coco -> SEM SUBSTITUIÇÕES (BLOQUEIO TOTAL)
-    if grupo == "agua_de_coco":
-        return []
-
-    # REGRA ESPECIAL: Iogurtes -> SEM SUBSTITUIÇÕES (BLOQUEIO TOTAL A PEDIDO DO USUÁRIO)
-    if grupo == "iogurtes":
+    # REGRAS ESPECIAIS: Água de Coco e Iogurtes -> SEM SUBSTITUIÇÕES (BLOQUEIO TOTAL)
+    if grupo in GRUPOS_BLOQUEADOS:
         return []
 
-    candidatos_validos = []
-
+    candidatos = []
     for substituto in lista_substitutos:
-        grupo_substituto = identificar_grupo_nutricional(substituto.nome)
+        grupo_substituto = substituto.grupo_nutricional
+        if grupo_substituto is None:
+            grupo_substituto = identificar_grupo_nutricional(substituto.nome)
 
         # Só sugere se for do mesmo grupo
-        if grupo == grupo_substituto and substituto.nome != alimento_original.nome:
-            resultado = calcular_substituicao(
-                alimento_original, substituto, grupo, quantidade_original_g
-            )
-            resultados.append(resultado)
-
-    # Ordenar por menor diferença calórica
-    resultados.sort(key=lambda x: x.diferenca_calorica)
+        if grupo == grupo_substituto:
+            candidatos.append(substituto)
 
-    return resultados[:limite_resultados]
+    return MatrizSubstituicao(grupo, candidatos).sugerir(
+        alimento_original, quantidade_original_g, limite_resultados, modo
+    )
 
 
 def formatar_resultado(resultado: ResultadoSubstituicao) -> str:
@@ -527,6 +570,204 @@ def formatar_resultado(resultado: ResultadoSubstituicao) -> str:
     )
 
 
+# =============================================================================
+# MOTOR VETORIZADO (MATRIZ POR GRUPO)
+# =============================================================================
+
+# Colunas da matriz de nutrientes (valores por 100g)
+KCAL, PTN, CHO, LIP, FIBRA = range(5)
+
+COLUNA_DO_MACRO = {"proteína": PTN, "carboidrato": CHO, "gordura": LIP}
+
+# Modo "multi": erros de proteína, carboidrato e gordura medidos em kcal
+# (4, 4 e 9 kcal/g), somados ao erro de calorias totais
+COLUNAS_MULTI = [PTN, CHO, LIP, KCAL]
+PESOS_MULTI = np.array([4.0 ** 2, 4.0 ** 2, 9.0 ** 2, 1.0])
+IGUALIZACAO_MULTI = "proteína, carboidrato, gordura e calorias"
+
+
+class MatrizSubstituicao:
+    """
+    Candidatos de um grupo nutricional em uma matriz NumPy (n x 5) com kcal,
+    proteína, carboidrato, gordura e fibra por 100g.
+
+    Calcula gramas equivalentes e diferença calórica de todos os candidatos em
+    uma única expressão, seleciona os N melhores com `argpartition` e só monta
+    ResultadoSubstituicao para eles. O resultado é o mesmo de aplicar
+    `calcular_substituicao` a cada candidato e ordenar pela diferença calórica,
+    exceto que candidatos sem o macro e sem calorias (divisão por zero na
+    versão escalar) são ignorados.
+    """
+
+    # O arredondamento para 1 casa move cada valor no máximo 0.05 kcal: quem
+    # está a mais de 0.1 kcal do N-ésimo colocado não empata com ele depois
+    MARGEM_ARREDONDAMENTO = 0.11
+
+    def __init__(self, grupo: str, alimentos: List[NutricaoAlimento]):
+        self.grupo = grupo
+        self.alimentos = list(alimentos)
+        self.nomes = np.array([a.nome for a in self.alimentos], dtype=object)
+        self.valores = np.array(
+            [
+                (a.energia_kcal, a.proteina_g, a.carboidrato_g, a.lipidios_g, a.fibra_g)
+                for a in self.alimentos
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 5)
+
+    def __len__(self):
+        return len(self.alimentos)
+
+    @classmethod
+    def concatenar(cls, grupo: str, matrizes: List["MatrizSubstituicao"]) -> "MatrizSubstituicao":
+        """Junta matrizes já montadas sem reconverter os alimentos."""
+        matriz = cls.__new__(cls)
+        matriz.grupo = grupo
+        matriz.alimentos = [a for m in matrizes for a in m.alimentos]
+        matriz.nomes = np.concatenate([m.nomes for m in matrizes])
+        matriz.valores = np.concatenate([m.valores for m in matrizes])
+        return matriz
+
+    def calcular(self, alimento_original: NutricaoAlimento, quantidade_original_g: float):
+        """
+        Retorna (gramas equivalentes, kcal resultantes, diferença calórica,
+        máscara de candidatos válidos), sem arredondamento, na ordem da matriz.
+        """
+        macro = macro_preponderante_do_grupo(self.grupo, alimento_original)
+        original = (
+            alimento_original.energia_kcal,
+            alimento_original.proteina_g,
+            alimento_original.carboidrato_g,
+            alimento_original.lipidios_g,
+            alimento_original.fibra_g,
+        )
+        cal_original = (original[KCAL] * quantidade_original_g) / 100
+        kcal_100g = self.valores[:, KCAL]
+        validos = (self.nomes != alimento_original.nome) & (kcal_100g != 0)
+
+        # Mesma ordem de operações da versão escalar, para valores idênticos
+        with np.errstate(divide="ignore", invalid="ignore"):
+            equiv_g = (cal_original / kcal_100g) * 100
+            coluna = COLUNA_DO_MACRO.get(macro)
+            if coluna is not None:
+                macro_original = (original[coluna] * quantidade_original_g) / 100
+                macro_100g = self.valores[:, coluna]
+                tem_macro = macro_100g > 0
+                equiv_g = np.where(tem_macro, (macro_original / macro_100g) * 100, equiv_g)
+                validos |= tem_macro & (self.nomes != alimento_original.nome)
+            cal_calculada = (kcal_100g * equiv_g) / 100
+            diferenca = np.abs(cal_calculada - cal_original)
+
+        return equiv_g, cal_calculada, diferenca, validos
+
+    def calcular_multi(self, alimento_original: NutricaoAlimento, quantidade_original_g: float):
+        """
+        Modo "multi": para cada candidato, as gramas que minimizam o erro
+        ponderado (PESOS_MULTI) em proteína, carboidrato, gordura e calorias
+        em relação à porção original. Mínimos quadrados com uma incógnita por
+        candidato, resolvido em forma fechada para o grupo inteiro:
+        x = Σ w·v·alvo / Σ w·v².
+
+        Retorna (gramas, kcal resultantes, diferença calórica, erro ponderado
+        em kcal, máscara de candidatos válidos).
+        """
+        original = np.array([
+            alimento_original.proteina_g,
+            alimento_original.carboidrato_g,
+            alimento_original.lipidios_g,
+            alimento_original.energia_kcal,
+        ])
+        alvo = original * quantidade_original_g / 100
+        por_grama = self.valores[:, COLUNAS_MULTI] / 100
+        denominador = (por_grama ** 2) @ PESOS_MULTI
+        validos = (self.nomes != alimento_original.nome) & (denominador > 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            equiv_g = np.where(validos, ((por_grama * PESOS_MULTI) @ alvo) / denominador, 0.0)
+        residuos = por_grama * equiv_g[:, None] - alvo
+        erro = np.sqrt((residuos ** 2) @ PESOS_MULTI)
+        cal_calculada = (self.valores[:, KCAL] * equiv_g) / 100
+        diferenca = np.abs(cal_calculada - alvo[3])
+        return equiv_g, cal_calculada, diferenca, erro, validos
+
+    def avaliar(self, alimento_original: NutricaoAlimento, quantidade_original_g: float, modo: str = MODO_MACRO):
+        """
+        (gramas, kcal resultantes, diferença calórica, critério de ordenação,
+        máscara de válidos) no modo pedido. O critério é a diferença calórica
+        no modo "macro" e o erro de macros no modo "multi".
+        """
+        if modo == MODO_MULTI:
+            return self.calcular_multi(alimento_original, quantidade_original_g)
+        equiv_g, cal_calculada, diferenca, validos = self.calcular(
+            alimento_original, quantidade_original_g
+        )
+        return equiv_g, cal_calculada, diferenca, diferenca, validos
+
+    def sugerir(
+        self,
+        alimento_original: NutricaoAlimento,
+        quantidade_original_g: float = 100.0,
+        limite_resultados: int = 10,
+        modo: str = MODO_MACRO,
+    ) -> List[ResultadoSubstituicao]:
+        """Os `limite_resultados` candidatos com menor diferença calórica (ou erro de macros)."""
+        if limite_resultados <= 0 or not self.alimentos:
+            return []
+
+        equiv_g, cal_calculada, diferenca, criterio, validos = self.avaliar(
+            alimento_original, quantidade_original_g, modo
+        )
+        indices = np.flatnonzero(validos)
+        if len(indices) > limite_resultados:
+            valores = criterio[indices]
+            corte = valores[np.argpartition(valores, limite_resultados - 1)[limite_resultados - 1]]
+            indices = indices[valores <= corte + self.MARGEM_ARREDONDAMENTO]
+
+        # Ordenação final igual à escalar: critério arredondado, empates na
+        # ordem original da lista de candidatos
+        vencedores = sorted(
+            indices.tolist(), key=lambda i: (round(float(criterio[i]), 1), i)
+        )[:limite_resultados]
+
+        if modo == MODO_MULTI:
+            macro = IGUALIZACAO_MULTI
+        else:
+            macro = macro_preponderante_do_grupo(self.grupo, alimento_original)
+        cal_original = (alimento_original.energia_kcal * quantidade_original_g) / 100
+        return [
+            ResultadoSubstituicao(
+                alimento_original=alimento_original.nome,
+                alimento_substituto=self.alimentos[i].nome,
+                quantidade_original_g=quantidade_original_g,
+                quantidade_substituto_g=round(float(equiv_g[i]), 1),
+                grupo=self.grupo,
+                macronutriente_igualizado=macro,
+                calorias_original=round(cal_original, 1),
+                calorias_substituto=round(float(cal_calculada[i]), 1),
+                diferenca_calorica=round(float(diferenca[i]), 1),
+                calorias_por_100g_original=alimento_original.energia_kcal,
+                calorias_por_100g_substituto=self.alimentos[i].energia_kcal,
+                erro_macros=round(float(criterio[i]), 1) if modo == MODO_MULTI else None,
+                substituto=self.alimentos[i],
+            )
+            for i in vencedores
+        ]
+
+
+def montar_matrizes_por_grupo(
+    alimentos: List[NutricaoAlimento],
+) -> Dict[str, MatrizSubstituicao]:
+    """Agrupa os alimentos pelo grupo nutricional (pré-calculado ou pelo nome)."""
+    por_grupo: Dict[str, List[NutricaoAlimento]] = {}
+    for alimento in alimentos:
+        grupo = alimento.grupo_nutricional
+        if grupo is None:
+            grupo = identificar_grupo_nutricional(alimento.nome)
+        if grupo:
+            por_grupo.setdefault(grupo, []).append(alimento)
+    return {grupo: MatrizSubstituicao(grupo, itens) for grupo, itens in por_grupo.items()}
+
+
 # =============================================================================
 # FUNÇÕES AUXILIARES PARA INTEGRAÇÃO COM BANCO DE DADOS
 # =============================================================================
@@ -553,6 +794,8 @@ def alimento_taco_para_nutricao(alimento_taco) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_taco.fibra_g),
         grupo=alimento_taco.grupo or "",
         fonte="TACO",
+        grupo_nutricional=alimento_taco.grupo_nutricional or identificar_grupo_nutricional(alimento_taco.nome),
+        id=alimento_taco.id,
     )
 
 
@@ -567,6 +810,8 @@ def alimento_tbca_para_nutricao(alimento_tbca) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_tbca.fibra_g),
         grupo=alimento_tbca.grupo or "",
         fonte="TBCA",
+        grupo_nutricional=alimento_tbca.grupo_nutricional or identificar_grupo_nutricional(alimento_tbca.nome),
+        id=alimento_tbca.id,
     )
 
 
@@ -581,9 +826,38 @@ def alimento_usda_para_nutricao(alimento_usda) -> NutricaoAlimento:
         fibra_g=safe_val(alimento_usda.fibra_g),
         grupo=alimento_usda.categoria,
         fonte="USDA",
+        grupo_nutricional=alimento_usda.grupo_nutricional or identificar_grupo_nutricional(alimento_usda.nome),
+        id=alimento_usda.id,
     )
 
 
+def recalcular_grupos_nutricionais(modelos) -> int:
+    """
+    Recalcula a coluna `grupo_nutricional` dos modelos informados (TACO, TBCA,
+    USDA, CustomFood). Só grava as linhas cujo grupo mudou, com um UPDATE por
+    grupo. Usado pelo comando `recalcular_grupos_nutricionais`, após a migração
+    que cria a coluna e sempre que GRUPOS_NUTRICIONAIS muda.
+
+    Returns:
+        Número de alimentos atualizados
+    """
+    total = 0
+    for modelo in modelos:
+        mudancas: Dict[str, List[int]] = {}
+        linhas = modelo.objects.values_list("id", "nome", "grupo_nutricional")
+        for pk, nome, atual in linhas.iterator():
+            grupo = identificar_grupo_nutricional(nome) or ""
+            if grupo != atual:
+                mudancas.setdefault(grupo, []).append(pk)
+
+        for grupo, ids in mudancas.items():
+            # Lotes para não estourar o limite de parâmetros do SQLite
+            for i in range(0, len(ids), 500):
+                modelo.objects.filter(pk__in=ids[i:i + 500]).update(grupo_nutricional=grupo)
+            total += len(ids)
+    return total
+
+
 # =============================================================================
 # TESTES E EXEMPLOS
 # =============================================================================
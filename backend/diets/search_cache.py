@@ -0,0 +1,114 @@
+"""
+Cache de resultados da busca de alimentos.
+
+Nutricionistas repetem as mesmas buscas o dia todo ("arroz", "frango
+grelhado", "banana"); o trabalho pesado de cada uma (candidatos do índice,
+queries por fonte e scoring) não depende do usuário. Este cache guarda, por
+(tokens normalizados, fonte, grupo), as janelas de candidatos já pontuados de
+TACO/TBCA/USDA. Favoritos e alimentos personalizados do usuário são mesclados
+na hora pela view.
+
+O cache é por processo, com despejo LRU, e guarda a versão do catálogo de
+referência (ver `catalog.py`): quando ela muda, todas as entradas são
+descartadas. Além do número de entradas, o tamanho pode ser limitado por um
+peso por entrada (`weigh`): na busca, o total de linhas guardadas, já que
+uma entrada vai de poucas linhas a milhares por fonte.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from django.conf import settings
+
+
+class SearchResultCache:
+    def __init__(
+        self,
+        maxsize: int = 500,
+        max_weight: Optional[int] = None,
+        weigh: Optional[Callable[[Any], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._weights: Dict[Hashable, int] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._weights.clear()
+            self.weight = 0
+            self._version = version
+
+    def _pop_oldest(self):
+        key, _ = self._entries.popitem(last=False)
+        self.weight -= self._weights.pop(key, 0)
+
+    def get(self, key: Hashable, version) -> Optional[Any]:
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: Hashable, version, entry: Any):
+        weight = self.weigh(entry) if self.weigh is not None else 0
+        with self._lock:
+            self._check_version(version)
+            self.weight -= self._weights.pop(key, 0)
+            self._entries.pop(key, None)
+            if self.max_weight is not None and weight > self.max_weight:
+                # Sozinha já passa do limite: não despeja as outras por ela
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._weights[key] = weight
+            self.weight += weight
+            while len(self._entries) > self.maxsize or (
+                self.max_weight is not None and self.weight > self.max_weight
+            ):
+                self._pop_oldest()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weights.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "weight": self.weight,
+                "max_weight": self.max_weight,
+            }
+
+
+def _linhas_guardadas(windows) -> int:
+    """Peso de uma entrada da busca: linhas (id, nome, score) de todas as fontes."""
+    return sum(len(rows) for rows, _, _ in windows.values())
+
+
+search_result_cache = SearchResultCache(
+    getattr(settings, "FOOD_SEARCH_CACHE_SIZE", 500),
+    max_weight=getattr(settings, "FOOD_SEARCH_CACHE_ROWS", 100000),
+    weigh=_linhas_guardadas,
+)
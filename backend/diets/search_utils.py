@@ -4,10 +4,77 @@ Ranking Clínico Nutri 4.0 - Prioridade Total para Alimentos In Natura e Grelhad
 """
 
 import re
+import numpy as np
 from django.db.models import Q
 from unidecode import unidecode
 
 
+# =============================================================================
+# TABELAS DO MOTOR DE SCORING
+# (compartilhadas entre o scoring item a item e o scoring em lote)
+# =============================================================================
+
+# Penalidades críticas: a "Lista Negra" de preparações não recomendadas.
+# Se o nutricionista busca "filé", ele NÃO quer "parmegiana" ou "milanesa".
+PREPARACOES_RUINS = {
+    'parmegiana': 700.0,
+    'milanesa': 650.0,
+    'empanado': 600.0,
+    'frito': 600.0,
+    'frita': 600.0,
+    'fritura': 600.0,
+    'congelado': 400.0,
+    'congelada': 400.0,
+    'nuggets': 500.0,
+    'maionese': 300.0,
+    'industrializado': 300.0,
+    'chips': 400.0,
+    'snack': 300.0,
+    'ultraprocessado': 500.0,
+    'embutido': 400.0,
+    'cru': 200.0,
+    'crua': 200.0,
+}
+
+# Pratos compostos e comida rápida (exclusão massiva)
+PRATOS_COMPOSTOS = {
+    'salada', 'pizza', 'sanduiche', 'hamburguer', 'sopa', 'lasanha',
+    'quiche', 'torta', 'pastel', 'salgadinho', 'bolinho', 'recheado',
+    'recheada', 'doce', 'sorvete', 'bolo'
+}
+PENALIDADE_PRATO_COMPOSTO = 800.0
+
+# Bônus de preparo saudável e naturalidade
+PREPAROS_BONS = {
+    'grelhado': 80.0,
+    'cozido': 70.0,
+    'assado': 60.0,
+    'vapor': 75.0,
+    'grelhada': 80.0,
+    'cozida': 70.0,
+    'assada': 60.0,
+    'natural': 100.0,
+    'fresco': 50.0,
+    'fresca': 50.0,
+    'integral': 40.0,
+}
+
+# Partes/extratos (Gema, Clara, Pó, Seco)
+PARTES_ALIMENTOS = {
+    'gema': 400.0,
+    'clara': 400.0,
+    'po': 300.0,
+    'pó': 300.0,
+    'extrato': 300.0,
+    'isolado': 300.0,
+    'concentrado': 200.0,
+    'seco': 200.0,
+    'seca': 200.0,
+    'desidratado': 300.0,
+    'desidratada': 300.0,
+}
+
+
 def normalizar_para_scoring(texto: str) -> list:
     """
     Normaliza o texto de busca, removendo acentos e separando em palavras.
@@ -63,56 +130,17 @@ def calcular_score_radical(item_nome: str, q_tokens: list) -> float:
         score += 150.0  # Bônus massivo para quem tem todas as palavras
         
     # 4. PENALIDADES CRÍTICAS (A "Lista Negra" de preparações não recomendadas)
-    # Se o nutricionista busca "filé", ele NÃO quer "parmegiana" ou "milanesa".
-    preparacoes_ruins = {
-        'parmegiana': 700.0,
-        'milanesa': 650.0,
-        'empanado': 600.0,
-        'frito': 600.0,
-        'frita': 600.0,
-        'fritura': 600.0,
-        'congelado': 400.0,
-        'congelada': 400.0,
-        'nuggets': 500.0,
-        'maionese': 300.0,
-        'industrializado': 300.0,
-        'chips': 400.0,
-        'snack': 300.0,
-        'ultraprocessado': 500.0,
-        'embutido': 400.0,
-        'cru': 200.0,
-        'crua': 200.0,
-    }
-    
-    for termo, penalidade in preparacoes_ruins.items():
+    for termo, penalidade in PREPARACOES_RUINS.items():
         if termo in item_nome_lower and termo not in q_tokens:
             score -= penalidade
 
     # 5. BLOQUEIO DE PRATOS COMPOSTOS E COMIDA RÁPIDA
-    pratos_compostos = {
-        'salada', 'pizza', 'sanduiche', 'hamburguer', 'sopa', 'lasanha', 
-        'quiche', 'torta', 'pastel', 'salgadinho', 'bolinho', 'recheado',
-        'recheada', 'doce', 'sorvete', 'bolo'
-    }
-    for prato in pratos_compostos:
+    for prato in PRATOS_COMPOSTOS:
         if prato in item_nome_lower and prato not in q_tokens:
-            score -= 800.0 # Bônus de exclusão massivo para pratos prontos
+            score -= PENALIDADE_PRATO_COMPOSTO # Bônus de exclusão massivo para pratos prontos
 
     # 6. BÔNUS DE PREPARO SAUDÁVEL E NATURALIDADE
-    preparos_bons = {
-        'grelhado': 80.0,
-        'cozido': 70.0,
-        'assado': 60.0,
-        'vapor': 75.0,
-        'grelhada': 80.0,
-        'cozida': 70.0,
-        'assada': 60.0,
-        'natural': 100.0,
-        'fresco': 50.0,
-        'fresca': 50.0,
-        'integral': 40.0,
-    }
-    for preparo, bonus in preparos_bons.items():
+    for preparo, bonus in PREPAROS_BONS.items():
         if preparo in item_nome_lower:
             score += bonus
 
@@ -127,20 +155,7 @@ def calcular_score_radical(item_nome: str, q_tokens: list) -> float:
 
     # 9. PENALIDADE PARA PARTES/EXTRATOS (Gema, Clara, Pó, Seco)
     # Se o usuário busca "Ovo", ele provavelmente não quer apenas a "Gema".
-    partes_alimentos = {
-        'gema': 400.0,
-        'clara': 400.0,
-        'po': 300.0,
-        'pó': 300.0,
-        'extrato': 300.0,
-        'isolado': 300.0,
-        'concentrado': 200.0,
-        'seco': 200.0,
-        'seca': 200.0,
-        'desidratado': 300.0,
-        'desidratada': 300.0,
-    }
-    for parte, penalidade in partes_alimentos.items():
+    for parte, penalidade in PARTES_ALIMENTOS.items():
         if parte in item_nome_lower and parte not in q_tokens:
             score -= penalidade
 
@@ -153,6 +168,151 @@ def calcular_score_radical(item_nome: str, q_tokens: list) -> float:
     return score
 
 
+class CatalogoScoring:
+    """
+    Scoring em lote do Motor Nutri 4.0 (mesmo resultado de `calcular_score_radical`).
+
+    Tudo o que não depende da busca (nome normalizado, número de palavras,
+    bônus de preparo, presença dos termos penalizados) é calculado uma única vez
+    na carga do catálogo e guardado em arrays NumPy. Por requisição restam
+    apenas os termos que dependem dos tokens da busca, avaliados de uma vez para
+    todos os candidatos.
+    """
+
+    # Termos penalizados quando presentes no nome e ausentes da busca
+    TERMOS_PENALIZADOS = (
+        list(PREPARACOES_RUINS.items())
+        + [(prato, PENALIDADE_PRATO_COMPOSTO) for prato in sorted(PRATOS_COMPOSTOS)]
+        + list(PARTES_ALIMENTOS.items())
+    )
+
+    def __init__(self, nomes):
+        nomes_norm = [unidecode(nome.lower()) if nome else "" for nome in nomes]
+        palavras = [nome.split() for nome in nomes_norm]
+
+        # Nome normalizado e nome com palavras delimitadas por espaço, para que
+        # "palavra exata" vire uma busca de substring " token "
+        self.nomes = np.array(nomes_norm, dtype=str)
+        self.palavras = np.array(
+            [" " + " ".join(p) + " " for p in palavras], dtype=str
+        )
+        self.vazio = np.array([not nome for nome in nomes], dtype=bool)
+
+        termos = [termo for termo, _ in self.TERMOS_PENALIZADOS]
+        self.pesos = np.array([peso for _, peso in self.TERMOS_PENALIZADOS], dtype=np.float32)
+        self.presenca = np.array(
+            [[termo in nome for termo in termos] for nome in nomes_norm],
+            dtype=np.float32,
+        ).reshape(len(nomes_norm), len(termos))
+        self.termos = termos
+
+        # Parte estática do score (passos 6, 7, 8 e 10)
+        estatico = np.zeros(len(nomes_norm), dtype=np.float64)
+        for i, (nome, p) in enumerate(zip(nomes_norm, palavras)):
+            score = 0.0
+            for preparo, bonus in PREPAROS_BONS.items():
+                if preparo in nome:
+                    score += bonus
+            if len(p) <= 3:
+                score += 50.0
+            if 'inteiro' in nome or 'inteira' in nome:
+                score += 120.0
+            score -= len(p) * 15.0
+            score -= len(nome) / 2.0
+            estatico[i] = score
+        self.estatico = estatico
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def pontuar(self, q_tokens: list, linhas=None) -> np.ndarray:
+        """
+        Scores das linhas indicadas (índices no catálogo) ou de todo o catálogo.
+        """
+        if linhas is None:
+            linhas = np.arange(len(self.nomes))
+        else:
+            linhas = np.asarray(linhas, dtype=np.intp)
+
+        if not q_tokens:
+            return np.full(len(linhas), -1000.0)
+
+        nomes = self.nomes[linhas]
+        palavras = self.palavras[linhas]
+        score = np.zeros(len(linhas), dtype=np.float64)
+        encontrados = np.zeros(len(linhas), dtype=np.int64)
+
+        for token in q_tokens:
+            # 1. Bônus de posição
+            pos = np.char.find(nomes, token)
+            achou = pos >= 0
+            score += np.where(pos == 0, 100.0, np.where(pos < 15, 50.0, 10.0)) * achou
+            encontrados += achou
+            # 2. Palavra exata
+            score += 40.0 * (np.char.find(palavras, f" {token} ") >= 0)
+
+        # 3. Coerência: todos os termos encontrados
+        score += 150.0 * (encontrados == len(q_tokens))
+
+        # 4, 5 e 9. Penalidades dos termos que não fazem parte da busca
+        pesos = self.pesos * np.array(
+            [termo not in q_tokens for termo in self.termos], dtype=np.float32
+        )
+        score -= self.presenca[linhas] @ pesos
+
+        score += self.estatico[linhas]
+        score[self.vazio[linhas]] = -1000.0
+        return score
+
+
+def calcular_scores_em_lote(nomes: list, q_tokens: list) -> list:
+    """Versão em lote de `calcular_score_radical` para uma lista de nomes."""
+    if not nomes:
+        return []
+    return CatalogoScoring(nomes).pontuar(q_tokens).tolist()
+
+
+def trigramas(palavra: str) -> set:
+    """Trigramas de caracteres da palavra, com bordas (mesmo esquema do pg_trgm)."""
+    texto = f"  {palavra} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """
+    Índice de trigramas de caracteres sobre um vocabulário de palavras
+    normalizadas, para tolerar erros de digitação ("brocolis", "tilapa",
+    "frnago"). A similaridade é a de Jaccard entre os conjuntos de trigramas.
+    """
+
+    def __init__(self, palavras):
+        self.palavras = list(palavras)
+        postings = {}
+        tamanhos = np.zeros(len(self.palavras), dtype=np.float32)
+        for i, palavra in enumerate(self.palavras):
+            tris = trigramas(palavra)
+            tamanhos[i] = len(tris)
+            for tri in tris:
+                postings.setdefault(tri, []).append(i)
+        self.postings = {tri: np.array(ids, dtype=np.intp) for tri, ids in postings.items()}
+        self.tamanhos = tamanhos
+
+    def similares(self, palavra: str, limite: int = 5, minimo: float = 0.3) -> list:
+        """As `limite` palavras mais parecidas: [(palavra, similaridade), ...]."""
+        tris = trigramas(palavra)
+        listas = [self.postings[tri] for tri in tris if tri in self.postings]
+        if not listas:
+            return []
+
+        comuns = np.bincount(np.concatenate(listas), minlength=len(self.palavras))
+        sim = comuns / (len(tris) + self.tamanhos - comuns)
+        candidatos = np.flatnonzero(sim >= minimo)
+        if len(candidatos) > limite:
+            candidatos = candidatos[np.argpartition(-sim[candidatos], limite)[:limite]]
+        ordem = sorted(candidatos.tolist(), key=lambda i: (-sim[i], i))
+        return [(self.palavras[i], float(sim[i])) for i in ordem]
+
+
 def apply_search_filter(queryset, query: str, field: str = "nome"):
     """
     Filtro que garante que os termos principais estejam no nome.
@@ -1,4 +1,6 @@
+from django.db import transaction
 from rest_framework import serializers
+from .day_snapshot import snapshots_em_lote
 from .models import (
     AlimentoTACO,
     AlimentoTBCA,
@@ -278,18 +280,31 @@ class DietSerializer(serializers.ModelSerializer):
                     fiber=food_json.get("fiber", 0),
                 )
 
+    def _schedule_day_snapshots(self, diet):
+        """Remonta em background o plano do dia usado pelo app do paciente."""
+        from .tasks import construir_snapshots_dieta
+
+        # robust: com o celery eager a montagem roda dentro da requisição, e uma
+        # falha nela não pode derrubar o salvamento da dieta (sem snapshot, o
+        # app monta o dia na hora)
+        transaction.on_commit(lambda: construir_snapshots_dieta.delay(diet.id), robust=True)
+
     def create(self, validated_data):
         meals_data = validated_data.pop("meals_data", None)
         diet = super().create(validated_data)
         if meals_data:
-            self._process_meals_data(diet, meals_data)
+            with snapshots_em_lote():
+                self._process_meals_data(diet, meals_data)
+        self._schedule_day_snapshots(diet)
         return diet
 
     def update(self, instance, validated_data):
         meals_data = validated_data.pop("meals_data", None)
         diet = super().update(instance, validated_data)
         if meals_data:
-            self._process_meals_data(diet, meals_data)
+            with snapshots_em_lote():
+                self._process_meals_data(diet, meals_data)
+        self._schedule_day_snapshots(diet)
         return diet
 
 
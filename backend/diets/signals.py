@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog import CUSTOM, MEASURES, REFERENCE, bump_catalog_version
+from .day_snapshot import invalidacao_suspensa
+from .medidas_utils import (
+    MEDIDAS_AGENDADO_KEY,
+    MEDIDAS_DEBOUNCE_S,
+    marcar_nomes_pendentes,
+    recalculo_suspenso,
+)
+from .models import (
+    AlimentoMedidaIBGE,
+    AlimentoTACO,
+    AlimentoTBCA,
+    AlimentoUSDA,
+    CustomFood,
+    Diet,
+    FoodItem,
+    Meal,
+    MedidaCaseira,
+)
+
+FONTES_REFERENCIA = {AlimentoTACO: "TACO", AlimentoTBCA: "TBCA", AlimentoUSDA: "USDA"}
+
+
+@receiver(post_save, sender=AlimentoTACO)
+@receiver(post_save, sender=AlimentoTBCA)
+@receiver(post_save, sender=AlimentoUSDA)
+@receiver(post_delete, sender=AlimentoTACO)
+@receiver(post_delete, sender=AlimentoTBCA)
+@receiver(post_delete, sender=AlimentoUSDA)
+def invalidate_reference_catalog(sender, **kwargs):
+    """Alterações em TACO/TBCA/USDA invalidam o índice de busca de todos os workers."""
+    transaction.on_commit(lambda: bump_catalog_version(REFERENCE))
+
+
+@receiver(post_save, sender=CustomFood)
+@receiver(post_delete, sender=CustomFood)
+def invalidate_custom_catalog(sender, instance, **kwargs):
+    """Alimentos personalizados têm versão própria para não invalidar as tabelas oficiais."""
+    nutritionist_id = instance.nutritionist_id
+
+    def bump():
+        bump_catalog_version(CUSTOM)
+        bump_catalog_version(CUSTOM, owner=nutritionist_id)
+
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=AlimentoMedidaIBGE)
+@receiver(post_delete, sender=AlimentoMedidaIBGE)
+@receiver(post_save, sender=MedidaCaseira)
+@receiver(post_delete, sender=MedidaCaseira)
+def invalidate_ibge_measures(sender, **kwargs):
+    """Medidas IBGE alteradas invalidam o catálogo IBGE compartilhado."""
+    transaction.on_commit(lambda: bump_catalog_version(MEASURES))
+
+
+# --- Medidas padrão pré-calculadas (MedidaPadraoAlimento) --------------------
+
+
+def _agendar_recalculo_medidas(alimentos=(), nomes_ibge=()):
+    """
+    Alimentos alterados são recalculados direto (um por vez, barato). Nomes
+    IBGE alterados podem afetar milhares de alimentos: ficam pendentes e são
+    recalculados fora da requisição (ver `medidas_utils`).
+    """
+    if recalculo_suspenso():
+        return
+
+    from .tasks import recalcular_medidas_alimentos, recalcular_medidas_pendentes
+
+    alimentos = [list(key) for key in alimentos]
+    nomes_ibge = [nome for nome in nomes_ibge if nome]
+    if alimentos:
+        transaction.on_commit(lambda: recalcular_medidas_alimentos.delay(alimentos=alimentos))
+    if not nomes_ibge:
+        return
+
+    def marcar():
+        marcar_nomes_pendentes(nomes_ibge)
+        # Com CELERY_TASK_ALWAYS_EAGER a task rodaria dentro da requisição:
+        # os pendentes ficam para o comando `precalcular_medidas --pendentes`.
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            return
+        # Uma task por janela agrupa as alterações feitas em sequência
+        if cache.add(MEDIDAS_AGENDADO_KEY, 1, timeout=MEDIDAS_DEBOUNCE_S * 2):
+            recalcular_medidas_pendentes.apply_async(countdown=MEDIDAS_DEBOUNCE_S)
+
+    transaction.on_commit(marcar)
+
+
+@receiver(post_save, sender=AlimentoTACO)
+@receiver(post_save, sender=AlimentoTBCA)
+@receiver(post_save, sender=AlimentoUSDA)
+@receiver(post_delete, sender=AlimentoTACO)
+@receiver(post_delete, sender=AlimentoTBCA)
+@receiver(post_delete, sender=AlimentoUSDA)
+def refresh_food_measure(sender, instance, **kwargs):
+    """Recalcula a medida padrão do alimento criado, renomeado ou removido."""
+    _agendar_recalculo_medidas(alimentos=[(FONTES_REFERENCIA[sender], instance.pk)])
+
+
+@receiver(pre_save, sender=AlimentoMedidaIBGE)
+def remember_ibge_name(sender, instance, **kwargs):
+    """Guarda o nome anterior para recalcular também os alimentos que casavam com ele."""
+    instance._nome_alimento_anterior = None
+    if instance.pk and not recalculo_suspenso():
+        instance._nome_alimento_anterior = (
+            AlimentoMedidaIBGE.objects.filter(pk=instance.pk)
+            .values_list("nome_alimento", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=AlimentoMedidaIBGE)
+@receiver(post_delete, sender=AlimentoMedidaIBGE)
+def refresh_measures_for_ibge_food(sender, instance, **kwargs):
+    """Medidas IBGE alteradas afetam todos os alimentos que casam com o nome."""
+    nomes = {instance.nome_alimento, getattr(instance, "_nome_alimento_anterior", None)}
+    _agendar_recalculo_medidas(nomes_ibge=nomes)
+
+
+@receiver(post_save, sender=MedidaCaseira)
+def refresh_measures_for_household_measure(sender, instance, **kwargs):
+    """
+    Renomear uma medida caseira muda o rótulo em todos os alimentos que a usam.
+    (A remoção cascateia para AlimentoMedidaIBGE, que tem signal próprio.)
+    """
+    if recalculo_suspenso():
+        return
+    nomes = AlimentoMedidaIBGE.objects.filter(medida=instance).values_list(
+        "nome_alimento", flat=True
+    ).distinct()
+    _agendar_recalculo_medidas(nomes_ibge=list(nomes))
+
+
+# --- Plano do dia pré-calculado (DietDaySnapshot) ----------------------------
+
+
+@receiver(post_save, sender=Meal)
+@receiver(post_delete, sender=Meal)
+def touch_diet_for_meal(sender, instance, **kwargs):
+    """
+    Refeição editada fora do serializer da dieta: atualizar `updated_at` tira
+    os snapshots de versão (remontados sob demanda) e muda o ETag da semana.
+    """
+    if invalidacao_suspensa():
+        return
+    Diet.objects.filter(pk=instance.diet_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+def touch_diet_for_item(sender, instance, **kwargs):
+    if invalidacao_suspensa():
+        return
+    Diet.objects.filter(meals_rel__id=instance.meal_id).update(updated_at=timezone.now())
@@ -0,0 +1,145 @@
+"""
+Cache de substituições independente da quantidade.
+
+A equivalência é linear na quantidade original: para um par original/
+substituto, o critério de ordenação (diferença calórica no modo "macro", erro
+de macros no "multi") é proporcional a `quantidade_original_g`, então a ordem
+dos candidatos não depende da quantidade. O cache guarda, por alimento de
+origem, os RATIO_CACHE_FINALISTAS melhores substitutos do grupo e o menor
+critério por grama entre os que ficaram de fora; qualquer quantidade é
+atendida recalculando só os finalistas, sem refazer a conta sobre o grupo
+inteiro.
+
+Chave: (fonte, id do alimento, modo, versão das tabelas de referência, versão
+dos personalizados do nutricionista quando eles participam do grupo). Dois
+níveis: LRU por processo (`SearchResultCache`) e o cache do Django (Redis em
+produção), compartilhado entre os workers.
+
+Os finalistas são avaliados por `MatrizSubstituicao.sugerir`, na ordem da
+matriz do grupo: valores, arredondamento e desempate pela posição são os da
+versão sem cache. Resta o corte: na quantidade pedida, um candidato de fora
+pode empatar (critério arredondado a 0.1 kcal) com o último servido. Quando o
+critério de corte fica a menos de MARGEM_ARREDONDAMENTO do último servido
+(na prática, só em quantidades de poucos gramas), `aplicar_finalistas`
+devolve None e o chamador recalcula sobre o grupo inteiro.
+"""
+
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .nutritional_substitution import (
+    MODO_MACRO,
+    MODO_MULTI,
+    MatrizSubstituicao,
+    NutricaoAlimento,
+    ResultadoSubstituicao,
+)
+from .search_cache import SearchResultCache
+
+# Limite máximo de sugestões atendido pelo cache
+RATIO_CACHE_TOP = 20
+# Finalistas guardados por alimento: a folga além de RATIO_CACHE_TOP cobre os
+# empates de arredondamento no corte, que senão exigiriam recalcular o grupo
+RATIO_CACHE_FINALISTAS = 2 * RATIO_CACHE_TOP
+
+SUBSTITUTION_CACHE_PREFIX = "diets:substitution_ratios:v3"
+
+# (matriz dos finalistas, menor critério por grama entre os que ficaram de fora)
+Finalistas = Tuple[Optional[MatrizSubstituicao], Optional[float]]
+
+
+def calcular_finalistas(
+    matriz: MatrizSubstituicao, alimento_original: NutricaoAlimento, modo: str = MODO_MACRO
+) -> Finalistas:
+    """
+    Os RATIO_CACHE_FINALISTAS melhores substitutos, em uma matriz na mesma ordem
+    relativa da matriz do grupo, e o critério por grama do primeiro candidato
+    que ficou de fora (None se todos os válidos couberam).
+    """
+    _, _, _, criterio, validos = matriz.avaliar(alimento_original, 100.0, modo)
+    # Ruído de ponto flutuante (ex.: equalizados por caloria, diferença ~0)
+    # conta como empate, decidido pela posição na matriz como na versão escalar
+    diferenca_ordem = np.round(criterio, 9)
+    indices = np.flatnonzero(validos)
+    if len(indices) > RATIO_CACHE_FINALISTAS:
+        difs = diferenca_ordem[indices]
+        corte = difs[np.argpartition(difs, RATIO_CACHE_FINALISTAS - 1)[RATIO_CACHE_FINALISTAS - 1]]
+        indices = indices[difs <= corte]
+    vencedores = sorted(indices.tolist(), key=lambda i: (float(diferenca_ordem[i]), i))
+    guardados = sorted(vencedores[:RATIO_CACHE_FINALISTAS])
+
+    de_fora = validos.copy()
+    de_fora[guardados] = False
+    corte = float(criterio[de_fora].min()) / 100 if de_fora.any() else None
+    if not guardados:
+        return None, corte
+    return MatrizSubstituicao(matriz.grupo, [matriz.alimentos[i] for i in guardados]), corte
+
+
+def aplicar_finalistas(
+    finalistas: Finalistas,
+    alimento_original: NutricaoAlimento,
+    quantidade_original_g: float,
+    limite_resultados: int,
+    modo: str = MODO_MACRO,
+) -> Optional[List[ResultadoSubstituicao]]:
+    """
+    Resultados para `quantidade_original_g` a partir dos finalistas, ou None se
+    um candidato de fora pode empatar no corte (o chamador deve usar a matriz
+    do grupo inteiro).
+    """
+    candidatos, corte = finalistas
+    if limite_resultados <= 0:
+        return []
+    resultados = candidatos.sugerir(
+        alimento_original, quantidade_original_g, limite_resultados, modo
+    ) if candidatos is not None else []
+    if corte is None:
+        return resultados
+    if len(resultados) < limite_resultados:
+        return None
+
+    ultimo = resultados[-1]
+    criterio_ultimo = ultimo.erro_macros if modo == MODO_MULTI else ultimo.diferenca_calorica
+    if corte * quantidade_original_g <= criterio_ultimo + MatrizSubstituicao.MARGEM_ARREDONDAMENTO:
+        return None
+    return resultados
+
+
+class SubstitutionRatioCache:
+    """LRU do processo na frente do cache compartilhado do Django."""
+
+    def __init__(self, maxsize: int = 2000, timeout: int = 86400):
+        self.local = SearchResultCache(maxsize)
+        self.timeout = timeout
+
+    @staticmethod
+    def _shared_key(key: Hashable) -> str:
+        return SUBSTITUTION_CACHE_PREFIX + ":" + ":".join(str(part) for part in key)
+
+    def get(self, key: Hashable, version):
+        finalistas = self.local.get(key, version)
+        if finalistas is None:
+            finalistas = cache.get(self._shared_key(key))
+            if finalistas is not None:
+                self.local.set(key, version, finalistas)
+        return finalistas
+
+    def set(self, key: Hashable, version, finalistas: Finalistas):
+        self.local.set(key, version, finalistas)
+        cache.set(self._shared_key(key), finalistas, timeout=self.timeout)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        return self.local.stats()
+
+
+substitution_ratio_cache = SubstitutionRatioCache(
+    getattr(settings, "SUBSTITUTION_CACHE_SIZE", 2000),
+    getattr(settings, "SUBSTITUTION_CACHE_TIMEOUT", 86400),
+)
@@ -0,0 +1,313 @@
+"""
+Pool em memória de candidatos a substituição, indexado por grupo nutricional.
+
+As sugestões automáticas carregavam fatias arbitrárias de uma única tabela
+(`AlimentoTACO.objects.all()[:1500]`, `[:500]` da fonte do alimento), então a
+qualidade dependia da ordem alfabética e cada requisição materializava
+centenas de instâncias do ORM. O pool reúne TACO, TBCA e USDA inteiras, já
+separadas pela coluna `grupo_nutricional` em matrizes de nutrientes
+(`MatrizSubstituicao`), e os alimentos personalizados de cada nutricionista,
+que entram apenas nas sugestões do próprio dono.
+
+Como o índice de busca (`food_index.py`), cada parte guarda a versão do
+catálogo com que foi montada (ver `catalog.py`) e é recarregada quando ela
+muda: alimentos personalizados não invalidam as tabelas de referência.
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .catalog import CUSTOM, REFERENCE, get_catalog_version
+from .nutritional_substitution import (
+    GRUPOS_BLOQUEADOS,
+    MODO_MACRO,
+    MatrizSubstituicao,
+    NutricaoAlimento,
+    ResultadoSubstituicao,
+    identificar_grupo_nutricional,
+    safe_val,
+)
+from .substitution_cache import (
+    RATIO_CACHE_TOP,
+    aplicar_finalistas,
+    calcular_finalistas,
+    substitution_ratio_cache,
+)
+
+logger = logging.getLogger(__name__)
+
+_CAMPOS = (
+    "id", "nome", "energia_kcal", "proteina_g", "lipidios_g",
+    "carboidrato_g", "fibra_g", "grupo_nutricional",
+)
+
+
+def _grupo_da_linha(row) -> Optional[str]:
+    # A coluna só é preenchida no save(): linhas gravadas por bulk_create ou
+    # .update() (importadores, comandos) ficam vazias até o próximo
+    # `recalcular_grupos_nutricionais` e são classificadas pelo nome.
+    return row[7] or identificar_grupo_nutricional(row[1])
+
+
+def _nutricao(fonte: str, row, grupo_nutricional: str) -> NutricaoAlimento:
+    food_id, nome, kcal, ptn, lip, cho, fibra, _, grupo = row[:9]
+    return NutricaoAlimento(
+        nome=nome,
+        energia_kcal=safe_val(kcal),
+        proteina_g=safe_val(ptn),
+        lipidios_g=safe_val(lip),
+        carboidrato_g=safe_val(cho),
+        fibra_g=safe_val(fibra),
+        grupo=grupo or "",
+        fonte=fonte,
+        grupo_nutricional=grupo_nutricional,
+        id=food_id,
+    )
+
+
+def _load_reference_pool() -> Dict[str, MatrizSubstituicao]:
+    from .models import AlimentoTACO, AlimentoTBCA, AlimentoUSDA
+
+    por_grupo: Dict[str, List[NutricaoAlimento]] = {}
+    vistos = set()
+    fontes = [
+        ("TACO", AlimentoTACO, "grupo"),
+        ("TBCA", AlimentoTBCA, "grupo"),
+        ("USDA", AlimentoUSDA, "categoria"),
+    ]
+    for fonte, modelo, campo_grupo in fontes:
+        rows = modelo.objects.values_list(*_CAMPOS, campo_grupo)
+        for row in rows.iterator():
+            grupo_nutricional = _grupo_da_linha(row)
+            if not grupo_nutricional:
+                continue
+            # Mesmo alimento em mais de uma tabela: vale a primeira (TACO > TBCA > USDA)
+            chave = row[1].lower()
+            if chave in vistos:
+                continue
+            vistos.add(chave)
+            por_grupo.setdefault(grupo_nutricional, []).append(
+                _nutricao(fonte, row, grupo_nutricional)
+            )
+
+    return {grupo: MatrizSubstituicao(grupo, itens) for grupo, itens in por_grupo.items()}
+
+
+def _load_custom_pool() -> Dict[int, Dict[str, MatrizSubstituicao]]:
+    from .models import CustomFood
+
+    por_nutricionista: Dict[int, Dict[str, List[NutricaoAlimento]]] = {}
+    rows = CustomFood.objects.filter(is_active=True).values_list(*_CAMPOS, "grupo", "nutritionist_id")
+    for row in rows.iterator():
+        grupo_nutricional = _grupo_da_linha(row)
+        if not grupo_nutricional:
+            continue
+        grupos = por_nutricionista.setdefault(row[9], {})
+        grupos.setdefault(grupo_nutricional, []).append(
+            _nutricao("PERSONAL", row, grupo_nutricional)
+        )
+
+    return {
+        nutritionist_id: {g: MatrizSubstituicao(g, itens) for g, itens in grupos.items()}
+        for nutritionist_id, grupos in por_nutricionista.items()
+    }
+
+
+class SubstitutionPool:
+    """Visão do pool nas versões atuais das tabelas de referência e personalizadas."""
+
+    def __init__(
+        self,
+        reference: Dict[str, MatrizSubstituicao],
+        custom: Dict[int, Dict[str, MatrizSubstituicao]],
+        versions: Tuple[object, object] = (None, None),
+    ):
+        self.reference = reference
+        self.custom = custom
+        self.reference_version, self.custom_version = versions
+
+    def __len__(self):
+        return sum(len(matriz) for matriz in self.reference.values())
+
+    def group_size(self, grupo: str, nutritionist_id: Optional[int] = None) -> int:
+        """Número de candidatos do grupo, sem montar a matriz combinada."""
+        base = self.reference.get(grupo)
+        propria = self.custom.get(nutritionist_id, {}).get(grupo)
+        return (len(base) if base is not None else 0) + (len(propria) if propria is not None else 0)
+
+    def matrix(self, grupo: str, nutritionist_id: Optional[int] = None) -> Optional[MatrizSubstituicao]:
+        """Candidatos do grupo: tabelas de referência + personalizados do nutricionista."""
+        base = self.reference.get(grupo)
+        propria = self.custom.get(nutritionist_id, {}).get(grupo)
+        if propria is None:
+            return base
+        if base is None:
+            return propria
+        # Alimentos do nutricionista primeiro: em empates, aparecem antes
+        return MatrizSubstituicao.concatenar(grupo, [propria, base])
+
+    def _ratio_key(self, grupo, alimento, nutritionist_id, modo):
+        """Chave do cache de finalistas, ou None se o alimento não vem do catálogo."""
+        if alimento.id is None or not alimento.fonte:
+            return None
+        # Personalizados do nutricionista só entram na chave quando fazem parte
+        # do resultado (ou são o próprio original): os demais compartilham
+        if alimento.fonte == "PERSONAL" or grupo in self.custom.get(nutritionist_id, {}):
+            custom = f"{nutritionist_id}.{self.custom_version}"
+        else:
+            custom = "-"
+        return (alimento.fonte, alimento.id, modo, self.reference_version, custom)
+
+    def _cached_finalists(self, key, grupo, alimento, nutritionist_id, modo):
+        finalistas = substitution_ratio_cache.get(key, self.reference_version)
+        if finalistas is None:
+            matriz = self.matrix(grupo, nutritionist_id)
+            finalistas = calcular_finalistas(matriz, alimento, modo) if matriz is not None else (None, None)
+            substitution_ratio_cache.set(key, self.reference_version, finalistas)
+        return finalistas
+
+    def suggest(
+        self,
+        alimento_original: NutricaoAlimento,
+        quantidade_original_g: float = 100.0,
+        limite_resultados: int = 10,
+        nutritionist_id: Optional[int] = None,
+        modo: str = MODO_MACRO,
+    ) -> List[ResultadoSubstituicao]:
+        """
+        Mesmas regras de `sugerir_substitucoes`, sobre o catálogo inteiro.
+        Alimentos do catálogo (com fonte e id) usam o cache de finalistas.
+        """
+        grupo = identificar_grupo_nutricional(alimento_original.nome)
+        if not grupo or grupo in GRUPOS_BLOQUEADOS:
+            return []
+
+        key = self._ratio_key(grupo, alimento_original, nutritionist_id, modo)
+        if key is not None and limite_resultados <= RATIO_CACHE_TOP:
+            finalistas = self._cached_finalists(key, grupo, alimento_original, nutritionist_id, modo)
+            resultados = aplicar_finalistas(
+                finalistas, alimento_original, quantidade_original_g, limite_resultados, modo
+            )
+            if resultados is not None:
+                return resultados
+            # Empate no corte: recalcula sobre o grupo inteiro
+
+        matriz = self.matrix(grupo, nutritionist_id)
+        if matriz is None:
+            return []
+        return matriz.sugerir(alimento_original, quantidade_original_g, limite_resultados, modo)
+
+    def suggest_batch(
+        self,
+        pedidos: List[Tuple[NutricaoAlimento, float]],
+        limite_resultados: int = 10,
+        nutritionist_id: Optional[int] = None,
+        orcamento: Optional[int] = None,
+        modo: str = MODO_MACRO,
+    ) -> List[Optional[List[ResultadoSubstituicao]]]:
+        """
+        Sugestões para vários (alimento, quantidade) de uma vez, na ordem dos
+        pedidos. O grupo de cada nome e a matriz de cada grupo são resolvidos
+        uma única vez, e pedidos repetidos (mesmo alimento, mesma quantidade)
+        reaproveitam o resultado. Alimentos do catálogo passam pelo cache de
+        finalistas (acerto não consome orçamento).
+
+        `orcamento` limita o total de candidatos avaliados: a partir do pedido
+        que o estouraria, os demais ficam sem resposta (None).
+        """
+        grupos: Dict[str, Optional[str]] = {}
+        matrizes: Dict[str, Optional[MatrizSubstituicao]] = {}
+        calculados: Dict[tuple, List[ResultadoSubstituicao]] = {}
+        custo = 0
+        esgotado = False
+        saida: List[Optional[List[ResultadoSubstituicao]]] = []
+
+        for alimento, quantidade in pedidos:
+            nome = alimento.nome
+            if nome not in grupos:
+                grupos[nome] = identificar_grupo_nutricional(nome)
+            grupo = grupos[nome]
+            if not grupo or grupo in GRUPOS_BLOQUEADOS:
+                saida.append([])
+                continue
+
+            key = self._ratio_key(grupo, alimento, nutritionist_id, modo)
+            if key is not None and limite_resultados <= RATIO_CACHE_TOP:
+                finalistas = substitution_ratio_cache.get(key, self.reference_version)
+                if finalistas is None:
+                    tamanho = self.group_size(grupo, nutritionist_id)
+                    if esgotado or (orcamento is not None and custo + tamanho > orcamento):
+                        esgotado = True
+                        saida.append(None)
+                        continue
+                    finalistas = self._cached_finalists(key, grupo, alimento, nutritionist_id, modo)
+                    custo += tamanho
+                resultados = aplicar_finalistas(
+                    finalistas, alimento, quantidade, limite_resultados, modo
+                )
+                if resultados is not None:
+                    saida.append(resultados)
+                    continue
+                # Empate no corte: segue para a matriz do grupo inteiro
+
+            if grupo not in matrizes:
+                matrizes[grupo] = self.matrix(grupo, nutritionist_id)
+            matriz = matrizes[grupo]
+            if matriz is None:
+                saida.append([])
+                continue
+
+            chave = (
+                nome, alimento.energia_kcal, alimento.proteina_g, alimento.lipidios_g,
+                alimento.carboidrato_g, alimento.fibra_g, quantidade,
+            )
+            if chave in calculados:
+                saida.append(calculados[chave])
+                continue
+
+            if esgotado or (orcamento is not None and custo + len(matriz) > orcamento):
+                esgotado = True
+                saida.append(None)
+                continue
+
+            custo += len(matriz)
+            calculados[chave] = matriz.sugerir(alimento, quantidade, limite_resultados, modo)
+            saida.append(calculados[chave])
+
+        return saida
+
+
+_lock = threading.Lock()
+_parts = {REFERENCE: (None, None), CUSTOM: (None, None)}
+_loaders = {REFERENCE: _load_reference_pool, CUSTOM: _load_custom_pool}
+
+
+def _get_part(scope: str):
+    version = get_catalog_version(scope)
+    part, built_version = _parts[scope]
+    if part is not None and built_version == version:
+        return part, version
+
+    with _lock:
+        part, built_version = _parts[scope]
+        if part is None or built_version != version:
+            part = _loaders[scope]()
+            _parts[scope] = (part, version)
+            logger.info("Substitution pool (%s) built: %d groups", scope, len(part))
+    return part, version
+
+
+def get_substitution_pool() -> SubstitutionPool:
+    """Retorna o pool do processo, recarregando as partes desatualizadas."""
+    reference, reference_version = _get_part(REFERENCE)
+    custom, custom_version = _get_part(CUSTOM)
+    return SubstitutionPool(reference, custom, (reference_version, custom_version))
+
+
+def reset_substitution_pool():
+    """Descarta o pool do processo (e os finalistas em memória), forçando a recarga."""
+    with _lock:
+        for scope in _parts:
+            _parts[scope] = (None, None)
+    substitution_ratio_cache.clear()
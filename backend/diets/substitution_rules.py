@@ -0,0 +1,448 @@
+"""
+Regras de substituição pré-calculadas por similaridade nutricional.
+
+As regras de `FoodSubstitutionRule` eram cadastradas à mão, com
+`similarity_score` e `conversion_factor` constantes. Aqui elas são geradas a
+partir das matrizes do pool de substituição (`substitution_pool.py`): dentro
+de cada grupo nutricional, o perfil de cada alimento é a fração das calorias
+vinda de proteína, carboidrato, gordura e fibra, e a similaridade entre dois
+alimentos vem da distância euclidiana entre os perfis (ponderados conforme o
+tipo de dieta), calculada para o grupo inteiro em uma multiplicação de matrizes.
+
+Para cada alimento e tipo de dieta ficam os `top` vizinhos mais parecidos,
+com o fator de conversão da equalização do motor de sugestões (gramas do
+substituto por grama do original, pelo macro preponderante do grupo).
+
+Reexecuções são incrementais: cada grupo tem uma assinatura (hash dos
+alimentos e valores nutricionais) e só os grupos cuja assinatura mudou são
+recalculados. O resultado deles é comparado com as regras geradas já gravadas
+e só são escritas as que mudaram; as que deixaram de existir são removidas.
+Regras cadastradas à mão (`is_generated=False`) nunca são alteradas.
+
+As sugestões por tipo de dieta (`sugerir_por_regras`) leem as regras gravadas
+em vez de recalcular o grupo a cada requisição.
+"""
+
+import hashlib
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from utils.sanitization import sanitize_string
+
+from .nutritional_substitution import (
+    CHO,
+    FIBRA,
+    GRUPOS_BLOQUEADOS,
+    LIP,
+    PTN,
+    MatrizSubstituicao,
+    NutricaoAlimento,
+    ResultadoSubstituicao,
+    macro_preponderante_do_grupo,
+)
+
+logger = logging.getLogger(__name__)
+
+TOP_PADRAO = 10
+
+# Regras geradas vêm depois das cadastradas à mão (menor = mais prioritário)
+PRIORIDADE_BASE = 100
+
+NOTA_REGRA_GERADA = "Gerada automaticamente por similaridade nutricional"
+
+# Assinatura de cada grupo na última execução, por tipo de dieta
+ESTADO_REGRAS_KEY = "diets:regras_geradas:estado"
+
+# kcal por grama de proteína, carboidrato, gordura e fibra
+_COLUNAS_PERFIL = [PTN, CHO, LIP, FIBRA]
+_KCAL_POR_GRAMA = np.array([4.0, 4.0, 9.0, 2.0])
+
+# Peso de cada componente do perfil (proteína, carboidrato, gordura, fibra):
+# quanto maior, mais uma diferença nele afasta dois alimentos
+PESOS_PADRAO = (1.0, 1.0, 1.0, 1.0)
+PESOS_POR_DIETA = {
+    "low_carb": (1.0, 2.0, 1.0, 1.0),
+    "cetogenica": (1.0, 3.0, 1.5, 1.0),
+    "high_carb": (1.0, 1.5, 1.0, 1.0),
+    "hiperproteica": (2.0, 1.0, 1.0, 1.0),
+}
+
+NUTRIENTE_DO_MACRO = {"proteína": "protein", "carboidrato": "carb", "gordura": "fat"}
+
+# Limite de `suggested_quantity` (DecimalField 6,1)
+QUANTIDADE_MAXIMA = 99999.9
+
+_CHAVE = ("original_source", "original_food_id", "substitute_source", "substitute_food_id")
+_VALORES = (
+    "original_food_name",
+    "substitute_food_name",
+    "nutrient_predominant",
+    "similarity_score",
+    "conversion_factor",
+    "suggested_quantity",
+    "priority",
+)
+
+
+def _estado_key(diet_type: str) -> str:
+    return f"{ESTADO_REGRAS_KEY}:{diet_type}"
+
+
+def perfis_normalizados(valores: np.ndarray) -> np.ndarray:
+    """Fração das calorias de proteína, carboidrato, gordura e fibra (cada linha soma 1 ou 0)."""
+    energia = valores[:, _COLUNAS_PERFIL] * _KCAL_POR_GRAMA
+    total = energia.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, energia / total, 0.0)
+
+
+def similaridade_euclidiana(perfis: np.ndarray, pesos=PESOS_PADRAO) -> np.ndarray:
+    """
+    Matriz n x n de similaridade: 1 - distância euclidiana entre os perfis
+    ponderados, dividida pela maior distância possível entre dois perfis
+    (toda a energia em componentes diferentes). Vai de 0 a 1.
+    """
+    pesos = np.asarray(pesos, dtype=np.float64)
+    ponderados = perfis * pesos
+    quadrados = (ponderados ** 2).sum(axis=1)
+    distancias = quadrados[:, None] + quadrados[None, :] - 2 * (ponderados @ ponderados.T)
+    distancias = np.sqrt(np.maximum(distancias, 0.0))
+    maior = np.sqrt((np.sort(pesos)[-2:] ** 2).sum())
+    return np.clip(1.0 - distancias / maior, 0.0, 1.0)
+
+
+def nutriente_predominante(grupo: str, alimento) -> str:
+    macro = macro_preponderante_do_grupo(grupo, alimento)
+    if macro in NUTRIENTE_DO_MACRO:
+        return NUTRIENTE_DO_MACRO[macro]
+    # Grupos equalizados por calorias: o macro que predomina no alimento
+    p, c, g = alimento.proteina_g, alimento.carboidrato_g, alimento.lipidios_g
+    if c >= p and c >= g:
+        return "carb"
+    if p >= g:
+        return "protein"
+    return "fat"
+
+
+class RegrasDoGrupo:
+    """
+    Perfis, fatores de conversão e candidatos válidos de um grupo, calculados
+    uma vez e reaproveitados para todos os tipos de dieta.
+    """
+
+    def __init__(self, matriz: MatrizSubstituicao):
+        self.matriz = matriz
+        n = len(matriz)
+        self.perfis = perfis_normalizados(matriz.valores)
+        self.fatores = np.zeros((n, n))
+        self.validos = np.zeros((n, n), dtype=bool)
+        for i, original in enumerate(matriz.alimentos):
+            # Mesma equalização das sugestões ao vivo, para 100g do original
+            equiv_g, _, _, validos = matriz.calcular(original, 100.0)
+            with np.errstate(invalid="ignore"):
+                validos = validos & np.isfinite(equiv_g) & (equiv_g <= QUANTIDADE_MAXIMA)
+            self.fatores[i] = np.where(validos, equiv_g / 100, 0.0)
+            self.validos[i] = validos
+        self.nutrientes = [nutriente_predominante(matriz.grupo, a) for a in matriz.alimentos]
+
+    def vizinhos(self, pesos, top: int) -> List[List[Tuple[int, float]]]:
+        """Para cada alimento, até `top` pares (índice, similaridade), do mais parecido."""
+        n = len(self.matriz)
+        if n < 2 or top <= 0:
+            return [[] for _ in range(n)]
+        sim = np.where(self.validos, similaridade_euclidiana(self.perfis, pesos), -1.0)
+        k = min(top, n - 1)
+        melhores = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        resultado = []
+        for i in range(n):
+            indices = melhores[i][sim[i, melhores[i]] >= 0]
+            # Empates pela posição na matriz, para reexecuções estáveis
+            ordem = np.lexsort((indices, -sim[i, indices]))
+            resultado.append([(int(j), float(sim[i, j])) for j in indices[ordem]])
+        return resultado
+
+    def regras(self, diet_type: str, top: int) -> Dict[tuple, tuple]:
+        """{chave da regra: valores} no formato de `_CHAVE` / `_VALORES`."""
+        pesos = PESOS_POR_DIETA.get(diet_type, PESOS_PADRAO)
+        alimentos = self.matriz.alimentos
+        regras = {}
+        for i, vizinhos in enumerate(self.vizinhos(pesos, top)):
+            original = alimentos[i]
+            for posicao, (j, similaridade) in enumerate(vizinhos, start=1):
+                substituto = alimentos[j]
+                fator = float(self.fatores[i, j])
+                chave = (original.fonte, str(original.id), substituto.fonte, str(substituto.id))
+                regras[chave] = (
+                    sanitize_string(original.nome),
+                    sanitize_string(substituto.nome),
+                    self.nutrientes[i],
+                    Decimal(f"{similaridade:.2f}"),
+                    Decimal(f"{fator:.4f}"),
+                    Decimal(f"{fator * 100:.1f}"),
+                    PRIORIDADE_BASE + posicao,
+                )
+        return regras
+
+
+def assinatura_do_grupo(matriz: MatrizSubstituicao, diet_type: str, top: int) -> str:
+    """
+    Hash do que determina as regras de um grupo para um tipo de dieta:
+    alimentos (fonte, id, nome), valores nutricionais, pesos e `top`.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((top, PESOS_POR_DIETA.get(diet_type, PESOS_PADRAO))).encode())
+    for alimento in matriz.alimentos:
+        h.update(f"{alimento.fonte}\x1f{alimento.id}\x1f{alimento.nome}\x1e".encode())
+    h.update(np.ascontiguousarray(matriz.valores).tobytes())
+    return h.hexdigest()
+
+
+def _originais(matriz: MatrizSubstituicao) -> List[Tuple[str, str]]:
+    return [(a.fonte, str(a.id)) for a in matriz.alimentos]
+
+
+def calcular_regras(
+    matrizes: Dict[str, MatrizSubstituicao],
+    diet_types: Iterable[str],
+    top: int = TOP_PADRAO,
+    grupos: Optional[Dict[str, Iterable[str]]] = None,
+) -> Dict[str, Dict[tuple, tuple]]:
+    """
+    {diet_type: {chave: valores}} para todos os grupos, ou só para os
+    informados em `grupos` ({grupo: tipos de dieta a recalcular}).
+    """
+    diet_types = list(diet_types)
+    por_dieta: Dict[str, Dict[tuple, tuple]] = {diet_type: {} for diet_type in diet_types}
+    for grupo in sorted(matrizes if grupos is None else grupos):
+        matriz = matrizes.get(grupo)
+        if matriz is None or grupo in GRUPOS_BLOQUEADOS or len(matriz) < 2:
+            continue
+        grupo_regras = RegrasDoGrupo(matriz)
+        for diet_type in (diet_types if grupos is None else grupos[grupo]):
+            por_dieta[diet_type].update(grupo_regras.regras(diet_type, top))
+    return por_dieta
+
+
+def _regras_existentes(diet_type: str, originais: Optional[Iterable[Tuple[str, str]]] = None):
+    """{chave: (pk, valores)} das regras geradas, todas ou só desses originais."""
+    from .models import FoodSubstitutionRule
+
+    qs = FoodSubstitutionRule.objects.filter(is_generated=True, diet_type=diet_type)
+    if originais is None:
+        consultas = [qs]
+    else:
+        ids_por_fonte: Dict[str, List[str]] = {}
+        for source, food_id in set(originais):
+            ids_por_fonte.setdefault(source, []).append(food_id)
+        consultas = [
+            qs.filter(original_source=source, original_food_id__in=ids[inicio:inicio + 500])
+            for source, ids in ids_por_fonte.items()
+            for inicio in range(0, len(ids), 500)
+        ]
+    existentes = {}
+    for consulta in consultas:
+        for row in consulta.values_list("pk", *_CHAVE, *_VALORES).iterator():
+            existentes[row[1:5]] = (row[0], row[5:])
+    return existentes
+
+
+def sincronizar_regras(
+    matrizes: Dict[str, MatrizSubstituicao],
+    diet_types: Iterable[str],
+    top: int = TOP_PADRAO,
+    completo: bool = False,
+) -> Dict[str, int]:
+    """
+    Grava as regras geradas, escrevendo só as novas ou alteradas e removendo
+    as que não fazem mais parte do resultado. Retorna contagens por operação.
+
+    Só os grupos cuja assinatura mudou desde a última execução (guardada no
+    cache do Django) são recalculados e comparados com o banco; os demais
+    contam como inalterados. Sem estado anterior para o tipo de dieta (ou com
+    `completo=True`), recalcula e compara tudo.
+    """
+    from .models import FoodSubstitutionRule
+
+    diet_types = list(diet_types)
+
+    # Estado anterior: {grupo: (assinatura, originais, regras gravadas)}
+    estados = {}
+    for diet_type in diet_types:
+        estado = None if completo else cache.get(_estado_key(diet_type))
+        estados[diet_type] = estado if isinstance(estado, dict) else None
+
+    assinaturas = {
+        diet_type: {grupo: assinatura_do_grupo(matriz, diet_type, top) for grupo, matriz in matrizes.items()}
+        for diet_type in diet_types
+    }
+    alterados: Dict[str, List[str]] = {}
+    for diet_type in diet_types:
+        estado = estados[diet_type]
+        for grupo, assinatura in assinaturas[diet_type].items():
+            if estado is None or estado.get(grupo, (None,))[0] != assinatura:
+                alterados.setdefault(grupo, []).append(diet_type)
+    calculadas = calcular_regras(matrizes, diet_types, top, grupos=alterados)
+
+    # Pares já cobertos por regras cadastradas à mão ficam como estão
+    manuais = set(
+        FoodSubstitutionRule.objects.filter(is_generated=False, diet_type__in=diet_types)
+        .values_list("diet_type", *_CHAVE)
+    )
+
+    total = {"gravadas": 0, "removidas": 0, "inalteradas": 0, "grupos": len(alterados)}
+    for diet_type in diet_types:
+        estado = estados[diet_type]
+        grupos_alterados = [g for g, dietas in alterados.items() if diet_type in dietas]
+        if estado is None:
+            existentes = _regras_existentes(diet_type)
+        else:
+            # Originais atuais e anteriores dos grupos alterados (alimentos
+            # removidos ou que mudaram de grupo) e dos grupos que sumiram
+            originais = []
+            for grupo in grupos_alterados:
+                originais.extend(_originais(matrizes[grupo]))
+            for grupo in (set(estado) - set(matrizes)) | set(grupos_alterados):
+                originais.extend(tuple(o) for o in estado.get(grupo, (None, (), 0))[1])
+            existentes = _regras_existentes(diet_type, originais) if originais else {}
+            total["inalteradas"] += sum(
+                estado[grupo][2] for grupo in matrizes
+                if grupo in estado and grupo not in grupos_alterados
+            )
+
+        # Upsert portável (MySQL/MariaDB não aceitam update_conflicts com
+        # unique_fields): as alteradas são atualizadas pela pk, as novas inseridas
+        alteradas, novas = [], []
+        por_grupo = {grupo: 0 for grupo in matrizes}
+        agora = timezone.now()
+        for chave, valores in calculadas[diet_type].items():
+            if (diet_type, *chave) in manuais:
+                continue
+            atual = existentes.get(chave)
+            if atual is not None and atual[1] == valores:
+                total["inalteradas"] += 1
+                continue
+            regra = FoodSubstitutionRule(
+                **dict(zip(_CHAVE, chave)),
+                **dict(zip(_VALORES, valores)),
+                diet_type=diet_type,
+                notes=NOTA_REGRA_GERADA,
+                is_generated=True,
+            )
+            if atual is None:
+                novas.append(regra)
+            else:
+                regra.pk = atual[0]
+                regra.updated_at = agora
+                alteradas.append(regra)
+        obsoletas = [
+            pk for chave, (pk, _) in existentes.items() if chave not in calculadas[diet_type]
+        ]
+
+        with transaction.atomic():
+            FoodSubstitutionRule.objects.bulk_update(
+                alteradas, [*_VALORES, "updated_at"], batch_size=500
+            )
+            # Regra criada por uma execução concorrente: o valor é o mesmo
+            FoodSubstitutionRule.objects.bulk_create(
+                novas, batch_size=500, ignore_conflicts=True
+            )
+            for inicio in range(0, len(obsoletas), 500):
+                FoodSubstitutionRule.objects.filter(
+                    pk__in=obsoletas[inicio:inicio + 500]
+                ).delete()
+
+        # Novo estado: grupos recalculados com as regras de agora, os demais
+        # como estavam
+        grupo_do_original = {
+            original: grupo for grupo in grupos_alterados for original in _originais(matrizes[grupo])
+        }
+        for chave in calculadas[diet_type]:
+            if (diet_type, *chave) not in manuais:
+                por_grupo[grupo_do_original[chave[:2]]] += 1
+        novo_estado = {}
+        for grupo, matriz in matrizes.items():
+            if grupo in grupos_alterados:
+                novo_estado[grupo] = (
+                    assinaturas[diet_type][grupo], _originais(matriz), por_grupo[grupo]
+                )
+            else:
+                novo_estado[grupo] = estado[grupo]
+        cache.set(_estado_key(diet_type), novo_estado, timeout=None)
+
+        total["gravadas"] += len(alteradas) + len(novas)
+        total["removidas"] += len(obsoletas)
+        logger.info(
+            "Regras geradas (%s): %d gravadas, %d removidas, %d grupos recalculados",
+            diet_type, len(alteradas) + len(novas), len(obsoletas), len(grupos_alterados),
+        )
+    return total
+
+
+def sugerir_por_regras(
+    alimento_original: NutricaoAlimento,
+    quantidade_original_g: float,
+    diet_type: str,
+    matriz: Optional[MatrizSubstituicao],
+    limite_resultados: int = 10,
+) -> List[ResultadoSubstituicao]:
+    """
+    Sugestões a partir das regras geradas gravadas para o tipo de dieta, na
+    ordem de prioridade, com a quantidade pelo fator de conversão. Os dados
+    do substituto vêm da matriz do grupo (pool). Lista vazia quando o
+    alimento não tem regras: o chamador recorre ao pool.
+    """
+    from .models import FoodSubstitutionRule
+
+    if matriz is None or alimento_original.id is None or not alimento_original.fonte:
+        return []
+
+    regras = list(
+        FoodSubstitutionRule.objects.filter(
+            is_generated=True,
+            is_active=True,
+            diet_type=diet_type,
+            original_source=alimento_original.fonte,
+            original_food_id=str(alimento_original.id),
+        )
+        .order_by("priority", "-similarity_score")
+        .values_list("substitute_source", "substitute_food_id", "conversion_factor")
+    )
+    if not regras:
+        return []
+
+    candidatos = {(a.fonte, str(a.id)): a for a in matriz.alimentos}
+    macro = macro_preponderante_do_grupo(matriz.grupo, alimento_original)
+    cal_original = (alimento_original.energia_kcal * quantidade_original_g) / 100
+    resultados = []
+    for fonte, food_id, fator in regras:
+        substituto = candidatos.get((fonte, food_id))
+        # Regra de um alimento removido desde a última execução do comando
+        if substituto is None:
+            continue
+        quantidade = round(float(fator) * quantidade_original_g, 1)
+        cal_substituto = (substituto.energia_kcal * quantidade) / 100
+        resultados.append(
+            ResultadoSubstituicao(
+                alimento_original=alimento_original.nome,
+                alimento_substituto=substituto.nome,
+                quantidade_original_g=quantidade_original_g,
+                quantidade_substituto_g=quantidade,
+                grupo=matriz.grupo,
+                macronutriente_igualizado=macro,
+                calorias_original=round(cal_original, 1),
+                calorias_substituto=round(cal_substituto, 1),
+                diferenca_calorica=round(abs(cal_substituto - cal_original), 1),
+                calorias_por_100g_original=alimento_original.energia_kcal,
+                calorias_por_100g_substituto=substituto.energia_kcal,
+                substituto=substituto,
+            )
+        )
+        if len(resultados) >= limite_resultados:
+            break
+    return resultados
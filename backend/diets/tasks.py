@@ -0,0 +1,40 @@
+from celery import shared_task
+
+from .day_snapshot import construir_snapshots
+from .medidas_utils import alimentos_afetados, recalcular_medidas
+from .medidas_utils import recalcular_medidas_pendentes as _recalcular_medidas_pendentes
+
+
+@shared_task
+def recalcular_medidas_alimentos(alimentos=None, nomes_ibge=None):
+    """
+    Recalcula as medidas padrão pré-calculadas de forma incremental.
+
+    - alimentos: pares [fonte, id] de alimentos TACO/TBCA/USDA alterados.
+    - nomes_ibge: nomes de alimentos IBGE cujas medidas mudaram; todos os
+      alimentos que casam com eles são recalculados.
+    """
+    alvo = {(source, int(food_id)) for source, food_id in (alimentos or [])}
+    if nomes_ibge:
+        alvo.update(alimentos_afetados(nomes_ibge))
+    return recalcular_medidas(alvo)
+
+
+@shared_task
+def recalcular_medidas_pendentes():
+    """
+    Recalcula os alimentos afetados pelos nomes IBGE anotados como pendentes
+    pelos signals (agendada com atraso, agrupa as alterações da janela).
+    """
+    return _recalcular_medidas_pendentes()
+
+
+@shared_task
+def construir_snapshots_dieta(diet_id):
+    """Remonta o plano do dia pré-calculado (`DietDaySnapshot`) dos sete dias da dieta."""
+    from .models import Diet
+
+    diet = Diet.objects.select_related("patient").filter(pk=diet_id).first()
+    if diet is None:
+        return 0
+    return construir_snapshots(diet)
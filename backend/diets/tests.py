@@ -1,11 +1,20 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.contrib.auth import get_user_model
 from patients.models import PatientProfile
-from .models import Diet
+from .models import AlimentoTACO, Diet
 
 User = get_user_model()
 
 
+def sem_upsert():
+    """Como no MySQL/MariaDB: bulk_create(update_conflicts=True, unique_fields=...) indisponível."""
+    from unittest import mock
+
+    from django.db import connection
+
+    return mock.patch.object(connection.features, "supports_update_conflicts", False)
+
+
 class DietModelTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -48,3 +57,1150 @@ class DietModelTest(TestCase):
             str(saved_diet),
             f"Dieta de Emagrecimento - {self.patient.user.name}",
         )
+
+
+class FoodSearchIndexTest(TestCase):
+    def setUp(self):
+        from .food_index import reset_food_index
+
+        reset_food_index()
+        for codigo, nome in [
+            ("1", "Arroz, integral, cozido"),
+            ("2", "Arroz, tipo 1, cozido"),
+            ("3", "Feijão, carioca, cozido"),
+            ("4", "Frango, peito, sem pele, grelhado"),
+        ]:
+            AlimentoTACO.objects.create(
+                codigo=codigo,
+                nome=nome,
+                energia_kcal=100,
+                proteina_g=1,
+                lipidios_g=1,
+                carboidrato_g=20,
+                grupo="Teste",
+            )
+
+    def _taco_names(self, query):
+        from .food_index import get_food_index
+
+        ids = get_food_index().candidates(query)["TACO"]
+        return set(AlimentoTACO.objects.filter(id__in=ids).values_list("nome", flat=True))
+
+    def test_and_of_prefixes(self):
+        self.assertEqual(
+            self._taco_names("arroz integ"), {"Arroz, integral, cozido"}
+        )
+        self.assertEqual(len(self._taco_names("coz")), 3)
+        self.assertEqual(self._taco_names("feijao carioca"), {"Feijão, carioca, cozido"})
+        self.assertEqual(self._taco_names("arroz frango"), set())
+
+    def test_suggest_ranks_like_search(self):
+        from .food_index import get_food_index
+        from .search_utils import calcular_score_radical, normalizar_para_scoring
+
+        suggestions = get_food_index().suggest("arroz", limit=10)
+        q_tokens = normalizar_para_scoring("arroz")
+        self.assertEqual(
+            [nome for _, _, nome, _ in suggestions],
+            sorted(
+                ["Arroz, integral, cozido", "Arroz, tipo 1, cozido"],
+                key=lambda nome: -calcular_score_radical(nome, q_tokens),
+            ),
+        )
+        self.assertEqual(get_food_index().suggest("arroz", sources={"TBCA"}), [])
+
+    def test_fuzzy_match_tolerates_typos(self):
+        from .food_index import get_food_index
+
+        index = get_food_index()
+        self.assertEqual(self._taco_names("frnago grelhdo"), set())
+        [(source, food_id, sim, palavras)] = [
+            c for c in index.fuzzy_candidates("frnago grelhdo") if c[3] == ["frango", "grelhado"]
+        ]
+        self.assertEqual(
+            AlimentoTACO.objects.get(id=food_id).nome, "Frango, peito, sem pele, grelhado"
+        )
+        self.assertLess(sim, 1.0)
+        self.assertEqual(index.fuzzy_candidates("zzzz"), [])
+
+    def test_fuzzy_filters_before_limit(self):
+        from .food_index import get_food_index
+        from .models import CustomFood
+
+        nutri = User.objects.create_user(email="fuzzy@test.com", password="x", name="Fuzzy")
+        outro = User.objects.create_user(email="fuzzy2@test.com", password="x", name="Outro")
+        with self.captureOnCommitCallbacks(execute=True):
+            proprio = CustomFood.objects.create(
+                nutritionist=nutri, nome="Frango caseiro", energia_kcal=150
+            )
+            for i in range(3):
+                CustomFood.objects.create(nutritionist=outro, nome=f"Frango {i}", energia_kcal=150)
+
+        index = get_food_index()
+        # Alimentos de outro nutricionista não ocupam as vagas do corte
+        self.assertEqual(
+            [(s, i) for s, i, _, _ in index.fuzzy_candidates("frnago", limit=1, custom_ids={proprio.id})],
+            [("PERSONAL", proprio.id)],
+        )
+        [(source, _, _, _)] = index.fuzzy_candidates(
+            "frnago", limit=1, sources={"TACO"}, custom_ids={proprio.id}
+        )
+        self.assertEqual(source, "TACO")
+
+    def test_rebuilds_when_catalog_changes(self):
+        self.assertEqual(self._taco_names("batata"), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            AlimentoTACO.objects.create(
+                codigo="5",
+                nome="Batata, doce, cozida",
+                energia_kcal=77,
+                proteina_g=1.4,
+                lipidios_g=0.1,
+                carboidrato_g=17.9,
+                grupo="Teste",
+            )
+        self.assertEqual(self._taco_names("batata"), {"Batata, doce, cozida"})
+
+
+class BatchScoringTest(TestCase):
+    def test_batch_scores_match_scalar_engine(self):
+        from .search_utils import (
+            CatalogoScoring,
+            calcular_score_radical,
+            normalizar_para_scoring,
+        )
+
+        nomes = [
+            "Arroz, integral, cozido",
+            "Arroz, tipo 1, cozido",
+            "Bolo, arroz, doce",
+            "Frango, peito, sem pele, grelhado",
+            "Frango, empanado, frito, congelado",
+            "Ovo, de galinha, inteiro, cozido",
+            "Ovo, de galinha, gema, crua",
+            "",
+        ]
+        catalogo = CatalogoScoring(nomes)
+        for query in ["arroz", "frango grelhado", "ovo", "gema", "arroz doce"]:
+            q_tokens = normalizar_para_scoring(query)
+            self.assertEqual(
+                catalogo.pontuar(q_tokens).tolist(),
+                [calcular_score_radical(nome, q_tokens) for nome in nomes],
+            )
+            self.assertEqual(
+                catalogo.pontuar(q_tokens, [3, 0]).tolist(),
+                [calcular_score_radical(nomes[i], q_tokens) for i in (3, 0)],
+            )
+
+
+class MedidaPadraoAlimentoTest(TestCase):
+    def setUp(self):
+        from .models import AlimentoMedidaIBGE, MedidaCaseira
+
+        self.colher = MedidaCaseira.objects.create(nome="Colher de sopa")
+        self.concha = MedidaCaseira.objects.create(nome="Concha")
+        for medida, peso in [(self.colher, 25), (self.concha, 80)]:
+            AlimentoMedidaIBGE.objects.create(
+                codigo_ibge="63001",
+                nome_alimento="Feijão carioca",
+                medida=medida,
+                peso_g=peso,
+            )
+        self.feijao = AlimentoTACO.objects.create(
+            codigo="1",
+            nome="Feijão, carioca, cozido",
+            energia_kcal=76,
+            proteina_g=4.8,
+            lipidios_g=0.5,
+            carboidrato_g=13.6,
+            grupo="Leguminosas",
+        )
+
+    def _medida(self):
+        from .medidas_utils import buscar_medidas
+
+        return buscar_medidas("TACO", [self.feijao.id]).get(self.feijao.id)
+
+    def test_precomputed_matches_on_demand_heuristic(self):
+        from .medidas_utils import (
+            calcular_medidas_alimento,
+            carregar_medidas_ibge,
+            recalcular_medidas,
+        )
+
+        self.assertEqual(recalcular_medidas(), 1)
+        esperado = calcular_medidas_alimento(self.feijao.nome, carregar_medidas_ibge())
+        self.assertEqual(self._medida(), esperado)
+        self.assertEqual(esperado[0], "Colher de sopa")
+
+    @sem_upsert()
+    def test_refreshes_when_household_measure_changes(self):
+        from .medidas_utils import recalcular_medidas
+
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        recalcular_medidas()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.colher.nome = "Colher de servir"
+            self.colher.save()
+        # Eager: nada é recalculado dentro da requisição, só anotado
+        self.assertEqual(self._medida()[0], "Colher de sopa")
+        call_command("precalcular_medidas", pendentes=True, stdout=StringIO())
+        self.assertEqual(self._medida()[0], "Colher de servir")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feijao.delete()
+        self.assertIsNone(self._medida())
+
+    def test_affected_foods_index_matches_full_scan(self):
+        from .medidas_utils import alimentos_afetados, termo_busca_medida
+
+        for nome in ["Feijão, preto, cozido", "Arroz, integral, cozido", "Pão", "Leite, integral", "Brócolis, cozido"]:
+            AlimentoTACO.objects.create(
+                codigo=nome, nome=nome, energia_kcal=100, proteina_g=1,
+                lipidios_g=1, carboidrato_g=1, grupo="Outros",
+            )
+        nomes_ibge = ["feijão carioca", "arroz branco", "pão francês", "leite de vaca"]
+
+        esperado = []
+        for food in AlimentoTACO.objects.order_by("id"):
+            clean_name = termo_busca_medida(food.nome)
+            first_word = clean_name.split()[0].lower()
+            if any(
+                clean_name.lower() in nome or (len(first_word) > 3 and first_word in nome)
+                for nome in nomes_ibge
+            ):
+                esperado.append(("TACO", food.id))
+        self.assertEqual(alimentos_afetados(nomes_ibge), esperado)
+        self.assertEqual(len(esperado), 5)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+    def test_measure_changes_are_debounced_into_one_task(self):
+        from unittest import mock
+
+        from django.core.cache import cache
+
+        from .medidas_utils import MEDIDAS_PENDENTES_KEY, recalcular_medidas
+
+        recalcular_medidas()
+        cache.clear()
+        with mock.patch("diets.tasks.recalcular_medidas_pendentes.apply_async") as agendar:
+            for nome in ["Colher de servir", "Colher grande"]:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.colher.nome = nome
+                    self.colher.save()
+        agendar.assert_called_once()
+        self.assertEqual(cache.get(MEDIDAS_PENDENTES_KEY), ["Feijão carioca"])
+
+        from .tasks import recalcular_medidas_pendentes
+
+        self.assertEqual(recalcular_medidas_pendentes(), 1)
+        self.assertEqual(self._medida()[0], "Colher grande")
+        self.assertIsNone(cache.get(MEDIDAS_PENDENTES_KEY))
+
+    def test_shared_ibge_catalog_follows_measure_changes(self):
+        from django.core.cache import cache
+
+        from .ibge_catalog import IBGE_CATALOG_KEY, get_ibge_catalog, reset_ibge_catalog
+
+        reset_ibge_catalog()
+        [item] = get_ibge_catalog().values()
+        self.assertEqual(item["medida_nome"], "Colher de sopa")
+        self.assertEqual(cache.get(IBGE_CATALOG_KEY)["items"], get_ibge_catalog())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.colher.nome = "Colher de servir"
+            self.colher.save()
+        [item] = get_ibge_catalog().values()
+        self.assertEqual(item["medida_nome"], "Colher de servir")
+
+
+class TopKResultsTest(TestCase):
+    def test_slices_match_stable_sort(self):
+        from .views import TopKResults
+
+        scores = [3, 7, 7, 1, 9, 3, 7, 0]
+        materialized = []
+
+        def materialize(positions):
+            materialized.append(list(positions))
+            return [f"item{i}" for i in positions]
+
+        results = TopKResults(scores, 6, materialize)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:6]
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0:4], [f"item{i}" for i in ranked[0:4]])
+        self.assertEqual(results[4:20], [f"item{i}" for i in ranked[4:6]])
+        # Só a fatia pedida é materializada
+        self.assertEqual(materialized, [ranked[0:4], ranked[4:6]])
+
+
+class SearchResultCacheTest(TestCase):
+    def test_lru_eviction_and_version_invalidation(self):
+        from .search_cache import SearchResultCache
+
+        cache = SearchResultCache(maxsize=2)
+        cache.set(("arroz",), 1, "a")
+        cache.set(("feijao",), 1, "f")
+        self.assertEqual(cache.get(("arroz",), 1), "a")
+        cache.set(("banana",), 1, "b")  # despeja "feijao", o menos usado
+        self.assertIsNone(cache.get(("feijao",), 1))
+        self.assertEqual(cache.get(("banana",), 1), "b")
+        self.assertIsNone(cache.get(("arroz",), 2))
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_eviction_by_total_weight(self):
+        from .search_cache import SearchResultCache
+
+        cache = SearchResultCache(maxsize=10, max_weight=5, weigh=len)
+        cache.set(("arroz",), 1, "aaa")
+        cache.set(("feijao",), 1, "ff")
+        self.assertEqual(cache.stats()["weight"], 5)
+        cache.set(("banana",), 1, "bb")  # 7 > 5: despeja "arroz"
+        self.assertIsNone(cache.get(("arroz",), 1))
+        self.assertEqual(cache.get(("feijao",), 1), "ff")
+        cache.set(("feijao",), 1, "f")  # substituir desconta o peso anterior
+        self.assertEqual(cache.stats()["weight"], 3)
+        cache.set(("enorme",), 1, "x" * 6)  # maior que o limite: não fica
+        self.assertIsNone(cache.get(("enorme",), 1))
+        self.assertEqual(cache.get(("banana",), 1), "bb")
+        self.assertEqual(cache.stats()["weight"], 3)
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_favorites_are_overlaid_per_user(self):
+        from rest_framework.test import APIClient
+
+        from .models import FavoriteFood
+        from .search_cache import search_result_cache
+
+        search_result_cache.clear()
+        arroz = AlimentoTACO.objects.create(
+            codigo="1", nome="Arroz, integral, cozido", energia_kcal=124,
+            proteina_g=2.6, lipidios_g=1, carboidrato_g=25.8, grupo="Cereais",
+        )
+        users = [
+            User.objects.create_user(email=f"nutri{i}@test.com", password="x", name=f"Nutri {i}")
+            for i in range(2)
+        ]
+        FavoriteFood.objects.create(
+            user=users[0], food_source="TACO", food_id=str(arroz.id), food_name=arroz.nome
+        )
+
+        client = APIClient()
+        flags = []
+        for user in users:
+            client.force_authenticate(user)
+            response = client.get("/api/v1/diets/foods/", {"search": "arroz"})
+            flags.append([item["is_favorite"] for item in response.json()["results"]])
+
+        self.assertEqual(flags, [[True], [False]])
+        self.assertEqual(search_result_cache.stats()["hits"], 1)
+
+
+class RunPerSourceTest(SimpleTestCase):
+    def setUp(self):
+        from . import concurrency
+
+        # Espera as tarefas de outros testes devolverem as vagas do pool
+        executor, vagas = concurrency._get_executor()
+        for _ in range(executor._max_workers):
+            self.assertTrue(vagas.acquire(timeout=5))
+        for _ in range(executor._max_workers):
+            vagas.release()
+
+    def test_slow_source_is_dropped_after_timeout(self):
+        import threading
+        import time
+
+        from .concurrency import run_per_source
+
+        liberar = threading.Event()
+        tasks = {
+            "TACO": lambda: threading.current_thread().name,
+            "TBCA": lambda: liberar.wait(5),
+        }
+        try:
+            results, timed_out = run_per_source(tasks, timeout=0.2)
+        finally:
+            liberar.set()
+
+        self.assertTrue(results["TACO"].startswith("food-search"))
+        self.assertEqual(timed_out, ["TBCA"])
+
+    def test_busy_pool_runs_sources_inline(self):
+        import threading
+
+        from . import concurrency
+
+        liberar = threading.Event()
+        workers = concurrency._get_executor()[0]._max_workers
+        try:
+            # Fontes travadas ocupam todas as threads mesmo depois do timeout
+            _, timed_out = concurrency.run_per_source(
+                {f"S{i}": lambda: liberar.wait(5) for i in range(workers)}, timeout=0.1
+            )
+            self.assertEqual(len(timed_out), workers)
+
+            results, timed_out = concurrency.run_per_source(
+                {"TACO": lambda: threading.current_thread().name, "USDA": lambda: 1}, timeout=0.1
+            )
+        finally:
+            liberar.set()
+
+        self.assertEqual(results, {"TACO": threading.current_thread().name, "USDA": 1})
+        self.assertEqual(timed_out, [])
+
+    @override_settings(FOOD_SEARCH_PARALLEL=False)
+    def test_sequential_when_disabled(self):
+        import threading
+
+        from .concurrency import run_per_source
+
+        results, timed_out = run_per_source(
+            {"TACO": lambda: threading.current_thread().name, "USDA": lambda: 1}, timeout=1
+        )
+        self.assertEqual(results, {"TACO": threading.current_thread().name, "USDA": 1})
+        self.assertEqual(timed_out, [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class FavoritesEndpointTest(TestCase):
+    def test_bulk_resolution_keeps_order_and_supports_etag(self):
+        from rest_framework.test import APIClient
+
+        from .models import AlimentoUSDA, FavoriteFood
+
+        user = User.objects.create_user(email="fav@test.com", password="x", name="Fav")
+        for codigo, nome in [("10", "Arroz, integral, cozido"), ("20", "Feijão, carioca, cozido")]:
+            AlimentoTACO.objects.create(
+                codigo=codigo, nome=nome, energia_kcal=100, proteina_g=1,
+                lipidios_g=1, carboidrato_g=20, grupo="Teste",
+            )
+        AlimentoUSDA.objects.create(
+            fdc_id=171287, nome="Egg, whole, raw", categoria="Eggs", energia_kcal=143,
+            proteina_g=12.6, lipidios_g=9.5, carboidrato_g=0.7,
+        )
+        for source, food_id in [("TACO", "20"), ("USDA", "171287"), ("TACO", "10"), ("TACO", "999")]:
+            FavoriteFood.objects.create(user=user, food_source=source, food_id=food_id, food_name="x")
+
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.assertNumQueries(3):  # favoritos + TACO + USDA
+            response = client.get("/api/v1/diets/foods/favorites/")
+        self.assertEqual(
+            [item["nome"] for item in response.json()["results"]],
+            ["Arroz, integral, cozido", "Egg, whole, raw", "Feijão, carioca, cozido"],
+        )
+
+        etag = response["ETag"]
+        response = client.get("/api/v1/diets/foods/favorites/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        FavoriteFood.objects.filter(food_id="10").delete()
+        response = client.get("/api/v1/diets/foods/favorites/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class GrupoNutricionalTest(TestCase):
+    def _taco(self, codigo, nome, **macros):
+        valores = dict(energia_kcal=100, proteina_g=2, lipidios_g=1, carboidrato_g=20)
+        valores.update(macros)
+        return AlimentoTACO.objects.create(codigo=codigo, nome=nome, grupo="Teste", **valores)
+
+    def test_group_is_stored_on_save_and_recomputed_by_command(self):
+        from .nutritional_substitution import recalcular_grupos_nutricionais
+
+        arroz = self._taco("1", "Arroz, integral, cozido")
+        bolo = self._taco("2", "Bolo, pronto, chocolate")
+        self.assertEqual(arroz.grupo_nutricional, "carboidratos_complexos")
+        self.assertEqual(bolo.grupo_nutricional, "")
+
+        AlimentoTACO.objects.filter(pk=arroz.pk).update(grupo_nutricional="obsoleto")
+        self.assertEqual(recalcular_grupos_nutricionais([AlimentoTACO]), 1)
+        self.assertEqual(
+            list(AlimentoTACO.objects.filter(grupo_nutricional="carboidratos_complexos")),
+            [arroz],
+        )
+
+    def test_suggestions_use_precomputed_group(self):
+        from .nutritional_substitution import (
+            alimento_taco_para_nutricao,
+            sugerir_substitucoes,
+        )
+
+        arroz = self._taco("1", "Arroz, integral, cozido", carboidrato_g=25.8, energia_kcal=124)
+        self._taco("2", "Batata, doce, cozida", carboidrato_g=17.9, energia_kcal=77)
+        self._taco("3", "Frango, peito, grelhado", proteina_g=31, carboidrato_g=0)
+
+        candidatos = [
+            alimento_taco_para_nutricao(f)
+            for f in AlimentoTACO.objects.filter(grupo_nutricional=arroz.grupo_nutricional)
+        ]
+        [resultado] = sugerir_substitucoes(alimento_taco_para_nutricao(arroz), candidatos)
+        self.assertEqual(resultado.alimento_substituto, "Batata, doce, cozida")
+        self.assertEqual(resultado.quantidade_substituto_g, 144.1)
+
+
+class MatrizSubstituicaoTest(SimpleTestCase):
+    def test_matches_scalar_engine(self):
+        import random
+
+        from .nutritional_substitution import (
+            MatrizSubstituicao,
+            NutricaoAlimento,
+            calcular_substituicao,
+        )
+
+        rng = random.Random(7)
+        alimentos = [
+            NutricaoAlimento(
+                nome=f"Alimento {i}",
+                energia_kcal=rng.choice([rng.uniform(20, 400), 100.0]),
+                proteina_g=rng.choice([0.0, rng.uniform(0, 30)]),
+                lipidios_g=rng.choice([0.0, rng.uniform(0, 20)]),
+                carboidrato_g=rng.choice([0.0, rng.uniform(0, 80)]),
+                fibra_g=rng.uniform(0, 5),
+            )
+            for i in range(300)
+        ]
+        for grupo in ["carboidratos_complexos", "proteinas_animais_magras", "oleaginosas", "verduras_verdes"]:
+            matriz = MatrizSubstituicao(grupo, alimentos)
+            for original in alimentos[:20]:
+                for quantidade in (100.0, 37.5):
+                    escalar = sorted(
+                        (
+                            calcular_substituicao(original, s, grupo, quantidade)
+                            for s in alimentos
+                            if s.nome != original.nome
+                        ),
+                        key=lambda r: r.diferenca_calorica,
+                    )[:10]
+                    self.assertEqual(matriz.sugerir(original, quantidade, 10), escalar)
+
+    def test_multi_mode_fits_all_macros(self):
+        import numpy as np
+
+        from .nutritional_substitution import (
+            COLUNAS_MULTI,
+            MODO_MULTI,
+            PESOS_MULTI,
+            MatrizSubstituicao,
+            NutricaoAlimento,
+        )
+
+        arroz = NutricaoAlimento("Arroz, integral, cozido", 124, 2.6, 1.0, 25.8, 2.7)
+        candidatos = [
+            # Iguala o carboidrato, mas traz gordura junto
+            NutricaoAlimento("Pão, de queijo, assado", 363, 5.1, 24.6, 34.2, 0.6),
+            NutricaoAlimento("Batata, doce, cozida", 77, 0.6, 0.1, 18.4, 2.2),
+            NutricaoAlimento("Macarrão, trigo, cozido", 102, 3.4, 0.5, 19.9, 1.4),
+        ]
+        matriz = MatrizSubstituicao("carboidratos_complexos", candidatos)
+
+        equiv_g, _, _, erro, validos = matriz.calcular_multi(arroz, 150.0)
+        self.assertTrue(validos.all())
+        alvo = np.array([2.6, 25.8, 1.0, 124]) * 1.5
+        raiz = np.sqrt(PESOS_MULTI)
+        for i in range(len(candidatos)):
+            v = matriz.valores[i, COLUNAS_MULTI] / 100
+            x = np.linalg.lstsq((v * raiz)[:, None], alvo * raiz, rcond=None)[0][0]
+            self.assertAlmostEqual(equiv_g[i], x)
+            self.assertAlmostEqual(erro[i], np.sqrt((((v * x - alvo) * raiz) ** 2).sum()))
+
+        nomes = [r.alimento_substituto for r in matriz.sugerir(arroz, 150.0, 3, MODO_MULTI)]
+        self.assertEqual(nomes[-1], "Pão, de queijo, assado")
+        resultado = matriz.sugerir(arroz, 150.0, 1, MODO_MULTI)[0]
+        self.assertEqual(resultado.erro_macros, round(float(min(erro)), 1))
+
+
+class FinalistasTest(SimpleTestCase):
+    def test_cached_finalists_match_full_group(self):
+        import random
+
+        from .nutritional_substitution import MODOS_SUBSTITUICAO, MatrizSubstituicao, NutricaoAlimento
+        from .substitution_cache import aplicar_finalistas, calcular_finalistas
+
+        rng = random.Random(7)
+        # Poucos valores distintos: muitos empates no arredondamento
+        matriz = MatrizSubstituicao("carboidratos_complexos", [
+            NutricaoAlimento(
+                nome=f"Cereal {i}", energia_kcal=rng.choice([80, 100, 124, 130]),
+                proteina_g=rng.choice([1, 2.5]), lipidios_g=rng.choice([0.5, 1]),
+                carboidrato_g=rng.choice([18, 22, 25.8]), fonte="TACO", id=i,
+            )
+            for i in range(120)
+        ])
+        arroz = NutricaoAlimento(
+            nome="Arroz", energia_kcal=124, proteina_g=2.6, lipidios_g=1, carboidrato_g=25.8
+        )
+        recalculos = 0
+        for modo in MODOS_SUBSTITUICAO:
+            finalistas = calcular_finalistas(matriz, arroz, modo)
+            for quantidade in (1, 12.5, 100, 333):
+                for limite in (1, 10, 20):
+                    resultados = aplicar_finalistas(finalistas, arroz, quantidade, limite, modo)
+                    if resultados is None:
+                        recalculos += 1
+                        continue
+                    self.assertEqual(resultados, matriz.sugerir(arroz, quantidade, limite, modo))
+        # Empate no corte detectado: o chamador recalcula sobre o grupo inteiro
+        self.assertGreater(recalculos, 0)
+
+
+class SubstitutionPoolTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        from .models import AlimentoTBCA, AlimentoUSDA
+        from .substitution_pool import reset_substitution_pool
+
+        cache.clear()
+        reset_substitution_pool()
+        self.arroz = AlimentoTACO.objects.create(
+            codigo="1", nome="Arroz, integral, cozido", energia_kcal=124,
+            proteina_g=2.6, lipidios_g=1.0, carboidrato_g=25.8, grupo="Cereais",
+        )
+        AlimentoTBCA.objects.create(
+            codigo="B1", nome="Batata, doce, cozida", energia_kcal=77,
+            proteina_g=0.6, lipidios_g=0.1, carboidrato_g=18.4, grupo="Tubérculos",
+        )
+        AlimentoUSDA.objects.create(
+            fdc_id=1, nome="Quinoa, cooked", categoria="Cereal", energia_kcal=120,
+            proteina_g=4.4, lipidios_g=1.9, carboidrato_g=21.3,
+        )
+        self.nutri = User.objects.create_user(email="pool@test.com", password="x", name="Pool")
+        self.outro = User.objects.create_user(email="outro@test.com", password="x", name="Outro")
+
+    def _nomes(self, nutritionist_id=None):
+        from .nutritional_substitution import alimento_taco_para_nutricao
+        from .substitution_pool import get_substitution_pool
+
+        resultados = get_substitution_pool().suggest(
+            alimento_taco_para_nutricao(self.arroz), nutritionist_id=nutritionist_id
+        )
+        return {r.alimento_substituto for r in resultados}
+
+    def test_spans_all_sources_and_owner_custom_foods(self):
+        from .models import CustomFood
+
+        self.assertEqual(self._nomes(), {"Batata, doce, cozida", "Quinoa, cooked"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomFood.objects.create(
+                nutritionist=self.nutri, nome="Batata, baroa, cozida",
+                energia_kcal=80, carboidrato_g=19,
+            )
+        self.assertIn("Batata, baroa, cozida", self._nomes(self.nutri.id))
+        self.assertNotIn("Batata, baroa, cozida", self._nomes(self.outro.id))
+
+    def test_suggest_substitutions_labels_each_substitute_source(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+
+        from .models import AlimentoTBCA, AlimentoUSDA, CustomFood
+        from .views import FoodSearchViewSet
+
+        with self.captureOnCommitCallbacks(execute=True):
+            baroa = CustomFood.objects.create(
+                nutritionist=self.nutri, nome="Batata, baroa, cozida",
+                energia_kcal=80, carboidrato_g=19,
+            )
+        # A action não tem rota própria em urls.py: chamada direto na view
+        request = APIRequestFactory().get("/", {"food_name": "Arroz, integral", "source": "TACO"})
+        force_authenticate(request, self.nutri)
+        response = FoodSearchViewSet.as_view({"get": "suggest_substitutions"})(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["original_food"]["source"], "TACO")
+        fontes = {(s["name"], s["source"], s["id"]) for s in response.data["substitutions"]}
+        self.assertEqual(fontes, {
+            ("Batata, doce, cozida", "TBCA", AlimentoTBCA.objects.get().id),
+            ("Quinoa, cooked", "USDA", AlimentoUSDA.objects.get().fdc_id),
+            ("Batata, baroa, cozida", "Sua Tabela", baroa.id),
+        })
+
+    def test_rows_without_stored_group_are_classified_by_name(self):
+        from .substitution_pool import reset_substitution_pool
+
+        # bulk_create (importadores) não passa pelo save(): grupo fica vazio
+        [mandioca] = AlimentoTACO.objects.bulk_create([
+            AlimentoTACO(
+                codigo="2", nome="Mandioca, cozida", energia_kcal=125,
+                proteina_g=0.6, lipidios_g=0.3, carboidrato_g=30.1, grupo="Tubérculos",
+            )
+        ])
+        self.assertEqual(AlimentoTACO.objects.get(pk=mandioca.pk).grupo_nutricional, "")
+        reset_substitution_pool()
+        self.assertIn("Mandioca, cozida", self._nomes())
+
+    def test_ratio_cache_rescales_any_quantity(self):
+        from .nutritional_substitution import MODOS_SUBSTITUICAO, alimento_taco_para_nutricao
+        from .substitution_cache import substitution_ratio_cache
+        from .substitution_pool import get_substitution_pool
+
+        pool = get_substitution_pool()
+        original = alimento_taco_para_nutricao(self.arroz)
+        matriz = pool.matrix("carboidratos_complexos")
+        for modo in MODOS_SUBSTITUICAO:
+            pool.suggest(original, 100.0, modo=modo)
+            for quantidade in (250.0, 37.5):
+                self.assertEqual(
+                    pool.suggest(original, quantidade, modo=modo),
+                    matriz.sugerir(original, quantidade, modo=modo),
+                )
+        self.assertEqual(substitution_ratio_cache.stats()["hits"], 4)
+
+    def test_refreshes_on_reference_change(self):
+        self.assertIn("Quinoa, cooked", self._nomes())
+        with self.captureOnCommitCallbacks(execute=True):
+            AlimentoTACO.objects.create(
+                codigo="2", nome="Mandioca, cozida", energia_kcal=125,
+                proteina_g=0.6, lipidios_g=0.3, carboidrato_g=30.1, grupo="Tubérculos",
+            )
+        self.assertIn("Mandioca, cozida", self._nomes())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SubstitutionsBatchTest(TestCase):
+    def setUp(self):
+        import datetime
+
+        from django.core.cache import cache
+
+        from .models import FoodItem, Meal
+        from .substitution_pool import reset_substitution_pool
+
+        cache.clear()
+        reset_substitution_pool()
+        for codigo, nome, kcal, cho in [
+            ("1", "Arroz, integral, cozido", 124, 25.8),
+            ("2", "Batata, doce, cozida", 77, 17.9),
+            ("3", "Mandioca, cozida", 125, 30.1),
+        ]:
+            AlimentoTACO.objects.create(
+                codigo=codigo, nome=nome, energia_kcal=kcal, proteina_g=1,
+                lipidios_g=0.5, carboidrato_g=cho, grupo="Teste",
+            )
+        self.nutri = User.objects.create_user(email="batch@test.com", password="x", name="Batch")
+        patient_user = User.objects.create_user(email="pac@test.com", password="x", name="Pac")
+        patient = PatientProfile.objects.create(user=patient_user, nutritionist=self.nutri)
+        self.diet = Diet.objects.create(patient=patient, name="Dieta", meals=[])
+        self.items = []
+        for day in range(3):
+            meal = Meal.objects.create(diet=self.diet, name="Almoço", time=datetime.time(12), day_of_week=day)
+            self.items.append(FoodItem.objects.create(
+                meal=meal, food_name="Arroz, integral, cozido", quantity=100,
+                calories=124, protein=1, carbs=25.8, fats=0.5,
+            ))
+            self.items.append(FoodItem.objects.create(
+                meal=meal, food_name="Água de coco", quantity=200,
+                calories=44, protein=0, carbs=10, fats=0,
+            ))
+
+    def _post(self, **data):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.nutri)
+        return client.post(f"/api/v1/diets/{self.diet.id}/substitutions/batch/", data, format="json")
+
+    def test_all_items_in_one_response(self):
+        response = self._post()
+        self.assertEqual(response.status_code, 200)
+        items = response.json()["items"]
+        self.assertEqual([i["item_id"] for i in items], [item.id for item in self.items])
+
+        arroz = items[0]
+        self.assertEqual(arroz["group"], "carboidratos_complexos")
+        self.assertEqual(
+            [s["name"] for s in arroz["substitutions"]],
+            ["Batata, doce, cozida", "Mandioca, cozida"],
+        )
+        self.assertEqual(arroz["substitutions"][0]["source"], "TACO")
+        self.assertEqual(items[1]["substitutions"], [])  # água de coco: bloqueada
+
+    def test_rule_suggest_returns_complete_foods(self):
+        from rest_framework.test import APIClient
+
+        arroz = AlimentoTACO.objects.get(nome="Arroz, integral, cozido")
+        batata = AlimentoTACO.objects.get(nome="Batata, doce, cozida")
+        client = APIClient()
+        client.force_authenticate(self.nutri)
+        response = client.get("/api/v1/diets/substitutions/suggest/", {
+            "food_id": arroz.id, "food_source": "TACO", "quantity": 150,
+        })
+        self.assertEqual(response.status_code, 200)
+        primeira = response.json()["substitutions"][0]
+        self.assertEqual(primeira["id"], f"auto_TACO_{batata.id}")
+        self.assertEqual(primeira["food"]["id"], batata.id)
+        self.assertEqual(primeira["food"]["source"], "TACO")
+        self.assertEqual(primeira["food"]["carboidrato_g"], 17.9)
+        # 150g de arroz = 38.7g de carboidrato = 216.2g de batata
+        self.assertEqual(primeira["suggested_quantity"], 216.2)
+        self.assertEqual(primeira["macros"]["carbs"], 38.7)
+        self.assertEqual(primeira["macros"]["protein"], 2.2)
+
+    def test_meal_substitutes_skip_raw_foods(self):
+        from rest_framework.test import APIClient
+
+        from .models import FoodSubstitution, FoodSubstitutionGroup
+
+        grupo = FoodSubstitutionGroup.objects.create(name="Carboidratos", predominant_nutrient="carbs")
+        nomes = ["Arroz, integral, cru", "Mandioca, crua"] + [f"Cereal {i}, cozido" for i in range(9)]
+        for ordem, nome in enumerate(nomes):
+            FoodSubstitution.objects.create(
+                group=grupo, original_source="TACO", original_food_id="",
+                original_food_name="Arroz, integral, cozido", substitute_source="TACO",
+                substitute_food_id=str(ordem), substitute_food_name=nome,
+                substitute_calories_per_100g=120, substitute_protein_per_100g=2,
+                substitute_carbs_per_100g=25, substitute_fat_per_100g=1, order=ordem,
+            )
+        self.assertEqual(FoodSubstitution.objects.filter(is_raw=True).count(), 2)
+
+        client = APIClient()
+        client.force_authenticate(self.nutri)
+        item = self.items[0]
+        response = client.get(f"/api/v1/diets/meals/{item.meal_id}/foods/{item.id}/substitutes/")
+        self.assertEqual(
+            [s["substitute_food_name"] for s in response.json()["substitutions"]],
+            [f"Cereal {i}, cozido" for i in range(7)],
+        )
+
+    def test_multi_mode(self):
+        response = self._post(item_ids=[self.items[0].id], mode="multi")
+        substituicao = response.json()["items"][0]["substitutions"][0]
+        self.assertEqual(substituicao["macro_equalized"], "proteína, carboidrato, gordura e calorias")
+        self.assertIsNotNone(substituicao["macro_error"])
+        self.assertEqual(self._post(mode="exato").status_code, 400)
+
+    def test_rejects_malformed_body(self):
+        from rest_framework.test import APIClient
+
+        self.assertEqual(self._post(item_ids=str(self.items[0].id)).status_code, 400)
+
+        client = APIClient()
+        client.force_authenticate(self.nutri)
+        response = client.post(
+            f"/api/v1/diets/{self.diet.id}/substitutions/batch/", [self.items[0].id], format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_patient_meals_auto_substitutions(self):
+        from rest_framework.test import APIClient
+
+        patient_user = self.diet.patient.user
+        patient_user.user_type = "paciente"
+        patient_user.save()
+        client = APIClient()
+        client.force_authenticate(patient_user)
+        response = client.get("/api/v1/patients/me/meals/")
+        self.assertEqual(response.status_code, 200)
+        arroz, agua = response.json()[0]["items"]
+        self.assertEqual(
+            [s["name"] for s in arroz["substitutions"]],
+            ["Batata, doce, cozida", "Mandioca, cozida"],
+        )
+        self.assertEqual(arroz["substitutions"][0]["source"], "auto")
+        self.assertEqual(arroz["substitutions"][0]["group"], "Carboidratos Complexos")
+        self.assertEqual(agua["substitutions"], [])
+
+        # Dia montado na hora fica gravado; a próxima chamada lê o snapshot
+        from .models import DietDaySnapshot
+
+        self.assertEqual(DietDaySnapshot.objects.filter(diet=self.diet).count(), 1)
+        with self.assertNumQueries(3):
+            self.assertEqual(client.get("/api/v1/patients/me/meals/").json(), response.json())
+
+    def test_diet_save_builds_day_snapshots(self):
+        from .models import DietDaySnapshot
+        from .serializers import DietSerializer
+
+        serializer = DietSerializer(self.diet, data={"name": "Dieta nova"}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True), sem_upsert():
+            serializer.save()
+            # Remontagem sobre snapshots já gravados
+            serializer.save()
+
+        snapshots = {s.day_of_week: s for s in DietDaySnapshot.objects.filter(diet=self.diet)}
+        self.assertEqual(sorted(snapshots), list(range(7)))
+        self.assertEqual(snapshots[1].source_day, 1)
+        self.assertEqual(snapshots[5].source_day, 0)  # sem refeições: usa o dia 0
+        arroz = snapshots[5].data[0]["items"][0]
+        self.assertEqual(arroz["substitutions"][0]["name"], "Batata, doce, cozida")
+        self.assertNotIn("status", snapshots[5].data[0])
+
+        # Item editado fora do serializer: a dieta muda de versão e os
+        # snapshots são remontados sob demanda
+        from .day_snapshot import snapshot_version
+
+        self.items[0].food_name = "Mandioca, cozida"
+        self.items[0].save()
+        self.diet.refresh_from_db()
+        self.assertNotEqual(snapshots[0].version, snapshot_version(self.diet))
+
+    def test_snapshot_failure_does_not_break_diet_save(self):
+        from unittest import mock
+
+        from .serializers import DietSerializer
+
+        serializer = DietSerializer(self.diet, data={"name": "Dieta nova"}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with mock.patch("diets.tasks.construir_snapshots", side_effect=RuntimeError("falhou")):
+            with self.assertLogs("django", "ERROR"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    serializer.save()
+        self.diet.refresh_from_db()
+        self.assertEqual(self.diet.name, "Dieta nova")
+
+    def test_snapshot_version_ignores_other_nutritionists_foods(self):
+        from .day_snapshot import snapshot_version
+        from .models import CustomFood
+
+        version = snapshot_version(self.diet)
+        outro = User.objects.create_user(email="outro@test.com", password="x", name="Outro")
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomFood.objects.create(nutritionist=outro, nome="Pão caseiro", energia_kcal=250)
+        self.assertEqual(snapshot_version(self.diet), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomFood.objects.create(nutritionist=self.nutri, nome="Pão caseiro", energia_kcal=250)
+        self.assertNotEqual(snapshot_version(self.diet), version)
+
+    @sem_upsert()
+    def test_patient_week_plan_with_etag(self):
+        from rest_framework.test import APIClient
+
+        from .models import CustomFood
+
+        patient_user = self.diet.patient.user
+        patient_user.user_type = "paciente"
+        patient_user.save()
+        client = APIClient()
+        client.force_authenticate(patient_user)
+
+        response = client.get("/api/v1/patients/me/meals/week/")
+        self.assertEqual(response.status_code, 200)
+        days = response.json()
+        self.assertEqual([d["day_of_week"] for d in days], list(range(7)))
+        self.assertEqual(days[2]["meals"][0]["id"], self.items[4].meal_id)
+        self.assertEqual(days[6]["meals"], days[0]["meals"])  # sem refeições: dia 0
+        self.assertEqual(
+            days[1]["meals"][0]["items"][0]["substitutions"][0]["name"], "Batata, doce, cozida"
+        )
+
+        etag = response["ETag"]
+        with self.assertNumQueries(1):
+            cached = client.get("/api/v1/patients/me/meals/week/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        # Alimento personalizado de outro nutricionista não muda a semana
+        outro = User.objects.create_user(email="outro@test.com", password="x", name="Outro")
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomFood.objects.create(nutritionist=outro, nome="Pão caseiro", energia_kcal=250)
+        cached = client.get("/api/v1/patients/me/meals/week/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        self.items[0].quantity = 150
+        self.items[0].save()
+        changed = client.get("/api/v1/patients/me/meals/week/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+
+    @override_settings(SUBSTITUTION_BATCH_BUDGET=1)
+    def test_budget_skips_remaining_items(self):
+        response = self._post(item_ids=[self.items[0].id, self.items[1].id])
+        body = response.json()
+        self.assertTrue(body["budget_exhausted"])
+        self.assertEqual(body["skipped_item_ids"], [self.items[0].id])
+        self.assertEqual(self._post(item_ids=["x"]).status_code, 400)
+
+
+class SubstituicoesManuaisTest(SimpleTestCase):
+    def test_compiled_matcher_matches_containment_rules(self):
+        import random
+        from types import SimpleNamespace
+
+        from .day_snapshot import SubstituicoesManuais, normalize_text
+
+        nomes = [
+            "Arroz", "Arroz Branco", "arroz integral cozido", "Pão francês", "pão",
+            "Feijão", "Ovo", "ov", "", "  Frango grelhado ", "Batata, doce", "é",
+        ]
+        regras = [
+            {"original": nome, "options": [{"name": f"Opção {i}", "quantity": i}]}
+            for i, nome in enumerate(nomes)
+        ]
+        regras.append({"original": "Leite", "options": [{"name": "Soja", "quantity": "x"}]})
+        compiladas = SubstituicoesManuais(regras)
+
+        def ingenuo(item_nome):
+            item_norm = normalize_text(item_nome)
+            opcoes, achou = [], False
+            for regra in regras:
+                original_norm = normalize_text(regra["original"])
+                if original_norm and (
+                    original_norm == item_norm
+                    or original_norm in item_norm
+                    or item_norm in original_norm
+                ):
+                    try:
+                        for opt in regra["options"]:
+                            opcoes.append((opt["name"], float(opt["quantity"])))
+                        achou = True
+                    except ValueError:
+                        pass
+            return opcoes, achou
+
+        rng = random.Random(7)
+        itens = nomes + ["Leite desnatado", "Arroz branco cozido", "Pao", "o", "xyz"]
+        itens += ["".join(rng.choice("arozpãe ") for _ in range(rng.randint(0, 6))) for _ in range(300)]
+        for item_nome in itens:
+            opcoes, achou = compiladas.opcoes(SimpleNamespace(food_name=item_nome, unit="g"))
+            self.assertEqual(
+                ([(o["name"], o["quantity"]) for o in opcoes], achou), ingenuo(item_nome), item_nome
+            )
+
+
+class GeneratedSubstitutionRulesTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        from .substitution_pool import reset_substitution_pool
+
+        cache.clear()
+        reset_substitution_pool()
+        self.arroz = AlimentoTACO.objects.create(
+            codigo="1", nome="Arroz, integral, cozido", energia_kcal=124,
+            proteina_g=2.6, lipidios_g=1.0, carboidrato_g=25.8, grupo="Cereais",
+        )
+        self.batata = AlimentoTACO.objects.create(
+            codigo="2", nome="Batata, doce, cozida", energia_kcal=77,
+            proteina_g=0.6, lipidios_g=0.1, carboidrato_g=18.4, grupo="Tubérculos",
+        )
+        self.mandioca = AlimentoTACO.objects.create(
+            codigo="3", nome="Mandioca, cozida", energia_kcal=125,
+            proteina_g=0.6, lipidios_g=0.3, carboidrato_g=30.1, grupo="Tubérculos",
+        )
+
+    def _rodar(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        saida = StringIO()
+        call_command("calcular_regras_substituicao", dietas=["normocalorica"], top=1, stdout=saida)
+        return saida.getvalue()
+
+    def test_generates_scores_and_reruns_incrementally(self):
+        from decimal import Decimal
+
+        from .models import FoodSubstitutionRule
+
+        manual = FoodSubstitutionRule.objects.create(
+            original_source="TACO", original_food_id=str(self.mandioca.id),
+            original_food_name="Mandioca, cozida", substitute_source="TACO",
+            substitute_food_id=str(self.batata.id), substitute_food_name="Batata, doce, cozida",
+            diet_type="normocalorica", nutrient_predominant="carb",
+            similarity_score=Decimal("0.50"), conversion_factor=Decimal("1.0"),
+        )
+        self.assertIn("2 regras gravadas", self._rodar())
+
+        regra = FoodSubstitutionRule.objects.get(
+            is_generated=True, original_food_id=str(self.arroz.id)
+        )
+        self.assertEqual(regra.substitute_food_id, str(self.batata.id))
+        self.assertEqual(regra.nutrient_predominant, "carb")
+        self.assertTrue(Decimal("0") < regra.similarity_score <= Decimal("1"))
+        # Equaliza o carboidrato: 25.8g / 18.4g por grama de arroz
+        self.assertEqual(regra.conversion_factor, Decimal("1.4022"))
+        self.assertEqual(regra.suggested_quantity, Decimal("140.2"))
+        # O par cadastrado à mão não é sobrescrito
+        manual.refresh_from_db()
+        self.assertFalse(manual.is_generated)
+        self.assertEqual(manual.similarity_score, Decimal("0.50"))
+
+        self.assertIn("0 regras gravadas, 0 removidas, 2 inalteradas", self._rodar())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mandioca.delete()
+        self.assertIn("1 regras gravadas, 1 removidas, 1 inalteradas", self._rodar())
+        self.assertEqual(
+            set(FoodSubstitutionRule.objects.filter(is_generated=True).values_list(
+                "original_food_id", "substitute_food_id"
+            )),
+            {(str(self.arroz.id), str(self.batata.id)), (str(self.batata.id), str(self.arroz.id))},
+        )
+
+    def test_only_changed_groups_are_recomputed(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from .substitution_pool import get_substitution_pool
+
+        for codigo, nome, ptn in [("4", "Frango, peito, grelhado", 32.0), ("5", "Frango, coxa, assada", 26.9)]:
+            AlimentoTACO.objects.create(
+                codigo=codigo, nome=nome, energia_kcal=160, proteina_g=ptn,
+                lipidios_g=2.5, carboidrato_g=0, grupo="Carnes",
+            )
+        self.assertEqual(len(get_substitution_pool().reference), 2)
+        self.assertIn("5 regras gravadas, 0 removidas, 0 inalteradas (2 grupos", self._rodar())
+        self.assertIn("5 inalteradas (0 grupos recalculados)", self._rodar())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mandioca.delete()
+        self.assertIn("1 regras gravadas, 2 removidas, 3 inalteradas (1 grupos", self._rodar())
+
+        # O estado incremental bate com um recálculo completo
+        saida = StringIO()
+        call_command(
+            "calcular_regras_substituicao", dietas=["normocalorica"], top=1, completo=True, stdout=saida
+        )
+        self.assertIn("0 regras gravadas, 0 removidas, 4 inalteradas", saida.getvalue())
+
+    def test_suggest_serves_stored_rules_for_diet_type(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(
+            User.objects.create_user(email="regras@test.com", password="x", name="Regras")
+        )
+
+        def sugestoes(diet_type):
+            response = client.get("/api/v1/diets/substitutions/suggest/", {
+                "food_id": self.arroz.id, "food_source": "TACO",
+                "quantity": 150, "diet_type": diet_type,
+            })
+            self.assertEqual(response.status_code, 200)
+            return [(s["food"]["nome"], s["suggested_quantity"]) for s in response.json()["substitutions"]]
+
+        # Sem regras gravadas: pool do grupo
+        self.assertEqual(len(sugestoes("normocalorica")), 2)
+
+        self._rodar()
+        # top=1: só o substituto da regra, pelo fator gravado (1.4022 x 150g)
+        self.assertEqual(sugestoes("normocalorica"), [("Batata, doce, cozida", 210.3)])
+        # Tipo de dieta sem regras geradas: volta ao pool
+        self.assertEqual(len(sugestoes("low_carb")), 2)
+
+    @sem_upsert()
+    def test_changed_rules_are_updated_in_place(self):
+        from decimal import Decimal
+
+        from .models import FoodSubstitutionRule
+
+        self._rodar()
+        regra = FoodSubstitutionRule.objects.get(original_food_id=str(self.arroz.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.arroz.carboidrato_g = 36.8
+            self.arroz.save()
+        self.assertIn("1 regras gravadas, 0 removidas", self._rodar())
+
+        atualizada = FoodSubstitutionRule.objects.get(original_food_id=str(self.arroz.id))
+        self.assertEqual(atualizada.pk, regra.pk)
+        self.assertEqual(atualizada.conversion_factor, Decimal("2.0"))
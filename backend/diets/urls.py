@@ -6,6 +6,11 @@ app_name = "diets"
 urlpatterns = [
     # Food search
     path("foods/", views.FoodSearchViewSet.as_view({"get": "list"}), name="food-list"),
+    path(
+        "foods/autocomplete/",
+        views.FoodSearchViewSet.as_view({"get": "autocomplete"}),
+        name="food-autocomplete",
+    ),
     path(
         "foods/grupos/",
         views.FoodSearchViewSet.as_view({"get": "grupos"}),
@@ -50,6 +55,11 @@ urlpatterns = [
         ),
         name="diet-detail",
     ),
+    path(
+        "<int:pk>/substitutions/batch/",
+        views.DietViewSet.as_view({"post": "substitutions_batch"}),
+        name="diet-substitutions-batch",
+    ),
     # Meals
     path(
         "meals/",
@@ -4,8 +4,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.pagination import PageNumberPagination  # Importado
 from django.db.models import Q
-from itertools import chain
-import hashlib
+from django.conf import settings
+from functools import partial
+import heapq
 
 from .models import (
     AlimentoTACO,
@@ -45,7 +46,15 @@ from .search_utils import (
     calcular_score_radical,
     apply_search_filter,
 )
+from .catalog import MEASURES, REFERENCE, get_catalog_version
+from .concurrency import run_per_source
+from .food_index import get_food_index
+from .ibge_catalog import get_ibge_catalog
+from .medidas_utils import buscar_medidas, calcular_medidas_alimento
+from .search_cache import search_result_cache
+from .substitution_pool import get_substitution_pool
 from rest_framework.views import APIView
+from utils.http import compute_etag, etag_matches
 from rest_framework.parsers import MultiPartParser, FormParser
 
 
@@ -89,6 +98,36 @@ class FoodPageNumberPagination(PageNumberPagination):
     max_page_size = 100  # Reduzido para evitar abusos e sobrecarga
 
 
+class TopKResults:
+    """
+    Resultados ranqueados da busca, avaliados sob demanda pelo Paginator.
+
+    Guarda só os scores; ao fatiar, seleciona as `stop` primeiras posições com
+    heap (O(n log k)) em vez de ordenar tudo, e monta os itens completos apenas
+    para a fatia pedida. Empates mantêm a ordem de inserção, como no sort estável.
+    """
+
+    def __init__(self, scores, limit, materialize):
+        self.scores = scores
+        self.limit = min(len(scores), limit)
+        self.materialize = materialize
+
+    def __len__(self):
+        return self.limit
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop, _ = index.indices(self.limit)
+        if start >= stop:
+            return []
+
+        scores = self.scores
+        top = heapq.nsmallest(stop, range(len(scores)), key=lambda i: (-scores[i], i))
+        return self.materialize(top[start:stop])
+
+
 class FoodSearchViewSet(viewsets.ViewSet):
     """
     ViewSet para busca unificada de alimentos em todas as tabelas (TACO, TBCA, USDA).
@@ -98,74 +137,11 @@ class FoodSearchViewSet(viewsets.ViewSet):
 
     @classmethod
     def ensure_cache(cls):
-        """Cache global para evitar N+1 queries no IBGE com dados nutricionais"""
-        if not hasattr(cls, "IBGE_CACHE") or not cls.IBGE_CACHE:
-            cls.IBGE_CACHE = {}  # Initialize first
-            try:
-                # Import models inside method to avoid circular imports if any, but ensure they are available
-                from .models import AlimentoMedidaIBGE, MedidaCaseira, AlimentoTBCA
-                
-                # Check if tables exist by querying safely
-                try:
-                    if not AlimentoMedidaIBGE.objects.exists():
-                        print("IBGE table empty, skipping cache.")
-                        return
-                except Exception:
-                    # Table might not exist yet
-                    print("IBGE table not found, skipping cache.")
-                    return
-
-                items = AlimentoMedidaIBGE.objects.select_related("medida").all()
-                
-                tbca_lookup = {}
-                try:
-                    # Optimize lookup
-                    tbca_qs = AlimentoTBCA.objects.all().values(
-                        "nome", "energia_kcal", "proteina_g", "lipidios_g", 
-                        "carboidrato_g", "fibra_g"
-                    )
-                    for item in tbca_qs:
-                        tbca_lookup[item["nome"].lower()] = item
-                except Exception as e:
-                    print(f"Error loading TBCA for lookup: {e}")
-
-                cache = {}
-                for item in items:
-                    name = item.nome_alimento
-                    if not name: continue
-                    
-                    md5_id = hashlib.md5(name.encode("utf-8")).hexdigest()
-                    if md5_id not in cache:
-                        name_lower = name.lower()
-                        nutri = tbca_lookup.get(name_lower)
-                        if not nutri:
-                            simplified = name_lower.split(",")[0]
-                            nutri = tbca_lookup.get(simplified)
-
-                        # Helper to safely get value from dict or obj
-                        def get_val(obj, key, default=0):
-                            if isinstance(obj, dict):
-                                return obj.get(key, default)
-                            return getattr(obj, key, default)
-
-                        cache[md5_id] = {
-                            "id": md5_id,
-                            "nome": name,
-                            "nome_lower": name_lower,
-                            "medida_nome": getattr(item.medida, 'nome', 'Medida') if item.medida else 'Medida',
-                            "peso_g": getattr(item, 'peso_g', 0),
-                            "energia_kcal": get_val(nutri, 'energia_kcal') if nutri else 0,
-                            "proteina_g": get_val(nutri, 'proteina_g') if nutri else 0,
-                            "lipidios_g": get_val(nutri, 'lipidios_g') if nutri else 0,
-                            "carboidrato_g": get_val(nutri, 'carboidrato_g') if nutri else 0,
-                            "fibra_g": get_val(nutri, 'fibra_g') if nutri else 0,
-                            "grupo": "Medida Caseira (IBGE)",
-                        }
-                cls.IBGE_CACHE = cache
-                print(f"IBGE Cache loaded with nutrition: {len(cache)} items")
-            except Exception as e:
-                print(f"Error loading IBGE cache: {e}")
-                cls.IBGE_CACHE = {}
+        """
+        Catálogo IBGE com dados nutricionais (evita N+1 queries no IBGE).
+        Compartilhado entre workers e versionado, ver `ibge_catalog.py`.
+        """
+        cls.IBGE_CACHE = get_ibge_catalog()
 
     def list(self, request):
         """
@@ -226,198 +202,45 @@ class FoodSearchViewSet(viewsets.ViewSet):
 
         q_tokens = normalizar_para_scoring(search_query)
 
+        # Índice invertido em memória: evita o full scan com LIKE em cada tabela.
+        # Se o índice não puder responder, cai no filtro icontains tradicional.
+        # Lida antes do índice: uma entrada do cache de resultados nunca fica
+        # associada a uma versão mais nova que a dos dados usados para montá-la.
+        catalog_version = get_catalog_version(REFERENCE)
+        search_candidates = None
+        if search_query:
+            try:
+                search_candidates = get_food_index().candidates(search_query)
+            except Exception as e:
+                print(f"Food search index unavailable, using LIKE filter: {e}")
+
+        def filter_by_search(queryset, source):
+            if search_candidates is None:
+                return apply_search_filter(queryset, search_query)
+            return queryset.filter(id__in=search_candidates[source])
+
         # calcular_score_radical defined in backend.diets.search_utils
 
         def get_measure_data(food_name):
             """
-            Retorna a melhor medida padrão e uma lista de todas as medidas disponíveis.
-            Usa CACHE EM MEMÓRIA para performance extrema.
+            Cálculo sob demanda da medida padrão, para alimentos que ainda não
+            estão em MedidaPadraoAlimento (tabela não populada, alimento novo).
             """
             if not food_name:
                 return None, None, []
 
             # Garante que o cache está carregado
             self.ensure_cache()
+            return calcular_medidas_alimento(food_name, FoodSearchViewSet.IBGE_CACHE.values())
 
-            # Limpeza do nome
-            parts = food_name.split(",")
-            clean_name = parts[0].strip()
-
-            if len(parts) > 1 and len(clean_name.split()) == 1:
-                potential_name = f"{clean_name} {parts[1].strip()}"
-                if len(potential_name) < 30:
-                    clean_name = potential_name
-
-            search_term = clean_name.lower()
-
-            # Busca no CACHE (em memória)
-            # 1. Filtra matches
-            matches = [
-                m
-                for m in FoodSearchViewSet.IBGE_CACHE.values()
-                if search_term in m["nome_lower"]
-            ]
-
-            # Excluir medidas triviais
-            matches = [
-                m
-                for m in matches
-                if m["medida_nome"] not in ["Grama", "Quilo", "Miligrama"]
-            ]
-
-            if not matches:
-                first_word = clean_name.split()[0].lower()
-                if len(first_word) > 3:
-                    matches = [
-                        m
-                        for m in FoodSearchViewSet.IBGE_CACHE.values()
-                        if first_word in m["nome_lower"]
-                    ]
-                    matches = [
-                        m
-                        for m in matches
-                        if m["medida_nome"] not in ["Grama", "Quilo", "Miligrama"]
-                    ]
-
-            available_measures = []
-            if matches:
-                # Coletar todas as medidas únicas
-                seen_measures = set()
-                for m in matches:
-                    if m["medida_nome"] not in seen_measures:
-                        available_measures.append(
-                            {"label": m["medida_nome"], "weight": m["peso_g"]}
-                        )
-                        seen_measures.add(m["medida_nome"])
-
-                # HEURÍSTICA PARA MEDIDA PADRÃO
-
-                # Lista de prioridades baseada no tipo de alimento (tentativa por nome)
-                priorities = []
-                name_lower = search_term  # já é lower
-
-                # 1. Líquidos/Bebidas -> Mililitro, Copo, Xícara
-                if any(
-                    x in name_lower
-                    for x in [
-                        "suco",
-                        "agua",
-                        "água",
-                        "cafe",
-                        "café",
-                        "cha",
-                        "chá",
-                        "leite",
-                        "bebida",
-                        "vitamina",
-                        "refrigerante",
-                        "iogurte",
-                        "yogurte",
-                        "cerveja",
-                        "vinho",
-                    ]
-                ):
-                    priorities = ["Mililitro", "Ml", "Copo", "Xícara", "Caneca", "Taça"]
-
-                # 2. Frutas/Legumes Inteiros -> Unidade, Fatia
-                elif any(
-                    x in name_lower
-                    for x in [
-                        "laranja",
-                        "maca",
-                        "maçã",
-                        "banana",
-                        "mamao",
-                        "mamão",
-                        "melancia",
-                        "melao",
-                        "pao",
-                        "pão",
-                        "pera",
-                        "pêra",
-                        "tangerina",
-                        "mexerica",
-                        "kiwi",
-                        "batata doce",
-                    ]
-                ):
-                    priorities = ["Unidade", "Fatia", "Gomo", "Pedaço"]
-
-                # 3. Bolos/Tortas/Doces -> Fatia, Pedaço
-                elif any(
-                    x in name_lower
-                    for x in ["bolo", "torta", "pizza", "pudim", "chocolate"]
-                ):
-                    priorities = ["Fatia", "Pedaço", "Unidade", "Barra"]
-
-                # 4. Folhosos -> Prato, Folha
-                elif any(
-                    x in name_lower
-                    for x in [
-                        "alface",
-                        "rucula",
-                        "rúcula",
-                        "agriao",
-                        "agrião",
-                        "couve",
-                        "espinafre",
-                        "escarola",
-                        "acelga",
-                    ]
-                ):
-                    priorities = ["Prato", "Folha", "Pires"]
-
-                # 5. Grãos/Cozidos/Pastosos -> Colher, Concha
-                else:
-                    priorities = [
-                        "Colher de arroz",
-                        "Colher de sopa",
-                        "Concha",
-                        "Escumadeira",
-                        "Colher",
-                    ]
-
-                # Tentar encontrar a melhor match baseada na prioridade
-                best_match = None
-                for priority in priorities:
-                    # Tenta encontrar string que COMEÇA com a prioridade para ser mais específico
-                    # Ex: 'Colher de arroz' deve vir antes de 'Colher' genérica
-                    for m in available_measures:
-                        if m["label"].lower().startswith(priority.lower()):
-                            best_match = m
-                            break
-                    if best_match:
-                        break
-
-                # Se não achou por prefixo, tenta contains
-                if not best_match:
-                    for priority in priorities:
-                        for m in available_measures:
-                            if priority.lower() in m["label"].lower():
-                                best_match = m
-                                break
-                        if best_match:
-                            break
-
-                # Fallback genérico se a heurística específica falhar
-                if not best_match:
-                    fallback_priorities = ["Unidade", "Colher de sopa", "Fatia", "Copo"]
-                    for priority in fallback_priorities:
-                        for m in available_measures:
-                            if priority.lower() in m["label"].lower():
-                                best_match = m
-                                break
-                        if best_match:
-                            break
-
-                # Último recurso: pega o primeiro
-                if not best_match and available_measures:
-                    best_match = available_measures[0]
-
-                if best_match:
-                    return best_match["label"], best_match["weight"], available_measures
-
-            return None, None, []
+        def measures_lookup(source, items):
+            """Medidas pré-calculadas dos itens (uma query), com fallback sob demanda."""
+            try:
+                precalculated = buscar_medidas(source, [item.id for item in items])
+            except Exception as e:
+                print(f"Precomputed measures unavailable for {source}: {e}")
+                precalculated = {}
+            return lambda item: precalculated.get(item.id) or get_measure_data(item.nome)
 
         def is_invalid_measure(name):
             return not name or name.lower() in [
@@ -437,235 +260,336 @@ class FoodSearchViewSet(viewsets.ViewSet):
         # Limite de resultados por fonte aumentado para garantir que alimentos saudáveis 
         # (que podem estar no fim da ordem alfabética) cheguem à fase de scoring.
         MAX_RESULTS_PER_SOURCE = 2000
+        # Limite de resultados totais após o ranking (o que o Paginator enxerga)
+        MAX_TOTAL_RESULTS = 1000
 
-        # Search CustomFoods (User's own table)
-        if not source_filter or source_filter == "PERSONAL" or source_filter == "SUA TABELA":
-            custom_qs = CustomFood.objects.filter(nutritionist=request.user, is_active=True)
-            custom_qs = apply_search_filter(custom_qs, search_query)
-            
-            for item in custom_qs:
-                results.append(
-                    {
-                        "id": item.id,
-                        "nome": item.nome,
-                        "grupo": item.grupo or "Personalizado",
-                        "source": "Sua Tabela",
-                        "is_favorite": False, # Personal items are already 'special'
-                        "energia_kcal": item.energia_kcal,
-                        "proteina_g": item.proteina_g,
-                        "lipidios_g": item.lipidios_g,
-                        "carboidrato_g": item.carboidrato_g,
-                        "fibra_g": item.fibra_g,
-                        "unidade_caseira": item.unidade_caseira,
-                        "peso_unidade_caseira_g": item.peso_unidade_caseira_g,
-                        "medidas": [{"label": item.unidade_caseira, "weight": item.peso_unidade_caseira_g}] if item.unidade_caseira else [],
-                    }
-                )
+        # Candidatos leves (fonte, id, nome): o ranking usa só o nome, e o dict
+        # completo (medidas, favorito, macros) é montado apenas para a página pedida.
+        candidates = []
+        scores = []
 
-        # Search TACO
-        if not source_filter or source_filter == "TACO":
-            taco_qs = AlimentoTACO.objects.all()
-            taco_qs = apply_search_filter(taco_qs, search_query)
-            if grupo_filter:
-                taco_qs = taco_qs.filter(grupo__icontains=grupo_filter)
+        def score_rows(source, rows):
+            """
+            Scores de linhas (id, nome) de uma fonte. Em lote sobre as features
+            pré-calculadas do índice; itens fora do índice (ou índice
+            indisponível) usam o scoring item a item.
+            """
+            index_source = "PERSONAL" if source == "Sua Tabela" else source
+            batch_scores = [None] * len(rows)
+            try:
+                batch_scores = get_food_index().score(
+                    [(index_source, food_id) for food_id, _ in rows], q_tokens
+                )
+            except Exception as e:
+                print(f"Batch scoring unavailable, scoring item by item: {e}")
 
-            # Prioritize Favorites: Fetch them regardless of limit
-            taco_fav_ids = [
-                int(k.split("_")[1]) for k in user_fav_keys if k.startswith("TACO_")
+            row_scores = []
+            for (_, nome), batch_score in zip(rows, batch_scores):
+                if batch_score is not None:
+                    row_scores.append(batch_score)
+                    continue
+                try:
+                    row_scores.append(calcular_score_radical(nome or "", q_tokens))
+                except Exception:
+                    row_scores.append(0)
+            return row_scores
+
+        def add_rows(source, rows, row_scores):
+            candidates.extend((source, food_id, nome) for food_id, nome in rows)
+            scores.extend(row_scores)
+
+        # Cache de resultados (independente do usuário): por fonte, a janela
+        # com os primeiros matches em ordem alfabética, já pontuados. A folga
+        # além do limite cobre os favoritos do usuário que saem da janela.
+        FAVORITES_SLACK = 200
+        window_size = MAX_RESULTS_PER_SOURCE + FAVORITES_SLACK
+        cacheable = not search_query or search_candidates is not None
+        cache_key = (tuple(q_tokens), source_filter, grupo_filter)
+        cached_windows = search_result_cache.get(cache_key, catalog_version) if cacheable else None
+        windows = dict(cached_windows or {})
+
+        def reference_window(source, queryset):
+            if source not in windows:
+                rows = list(queryset.values_list("id", "nome")[:window_size + 1])
+                complete = len(rows) <= window_size
+                rows = rows[:window_size]
+                windows[source] = (rows, score_rows(source, rows), complete)
+            return windows[source]
+
+        def collect_candidates(source, queryset):
+            """
+            Favoritos do usuário primeiro (sem limite), depois a janela da fonte.
+            Retorna (linhas, scores).
+            """
+            fav_ids = [
+                int(k.split("_")[1]) for k in user_fav_keys if k.startswith(f"{source}_")
             ]
-            taco_favorites = taco_qs.filter(id__in=taco_fav_ids)
-            taco_others = taco_qs.exclude(id__in=taco_fav_ids)[:MAX_RESULTS_PER_SOURCE]
-
-            taco_qs = list(chain(taco_favorites, taco_others))
+            rows, row_scores, complete = reference_window(source, queryset)
+
+            favorites = []
+            if fav_ids:
+                favorites = list(queryset.filter(id__in=fav_ids).values_list("id", "nome"))
+            fav_found = {food_id for food_id, _ in favorites}
+
+            others = [
+                (row, score) for row, score in zip(rows, row_scores) if row[0] not in fav_found
+            ][:MAX_RESULTS_PER_SOURCE]
+            if len(others) < MAX_RESULTS_PER_SOURCE and not complete:
+                # Favoritos demais dentro da janela: busca a fonte sem cache
+                other_rows = list(
+                    queryset.exclude(id__in=fav_ids).values_list("id", "nome")[:MAX_RESULTS_PER_SOURCE]
+                )
+                others = list(zip(other_rows, score_rows(source, other_rows)))
 
-            for item in taco_qs:
-                uc, peso_uc = item.unidade_caseira, item.peso_unidade_caseira_g
-                measures_list = []
+            window_scores = {row[0]: score for row, score in zip(rows, row_scores)}
+            missing = [row for row in favorites if row[0] not in window_scores]
+            window_scores.update(
+                (row[0], score) for row, score in zip(missing, score_rows(source, missing))
+            )
 
-                # Sempre buscar medidas alternativas no IBGE para dar opções ao usuário
-                target_name = item.nome
-                mc_nome, mc_peso, mc_list = get_measure_data(target_name)
+            return (
+                favorites + [row for row, _ in others],
+                [window_scores[food_id] for food_id, _ in favorites] + [score for _, score in others],
+            )
 
-                if mc_list:
-                    measures_list = mc_list
+        def collect_custom(queryset):
+            custom_rows = list(queryset.values_list("id", "nome"))
+            return custom_rows, score_rows("Sua Tabela", custom_rows)
 
-                # Se a medida original for ruim, sobrescreve com a melhor do IBGE
-                if is_invalid_measure(uc) or not peso_uc:
-                    if mc_nome:
-                        uc, peso_uc = mc_nome, mc_peso
-                else:
-                    # Se a original for boa, adiciona ela na lista de opções também
-                    measures_list.insert(0, {"label": uc, "weight": peso_uc})
+        # Querysets de cada fonte pesquisada (já com o filtro de grupo), antes do
+        # filtro de busca: usados também pela busca aproximada.
+        source_querysets = {}
+        # Coleta de candidatos por fonte, executada em paralelo (ver concurrency.py)
+        source_tasks = {}
 
-                is_fav = f"TACO_{item.id}" in user_fav_keys
+        # Search CustomFoods (User's own table)
+        if not source_filter or source_filter == "PERSONAL" or source_filter == "SUA TABELA":
+            source_querysets["Sua Tabela"] = CustomFood.objects.filter(nutritionist=request.user, is_active=True)
+            custom_qs = filter_by_search(source_querysets["Sua Tabela"], "PERSONAL")
+            source_tasks["Sua Tabela"] = partial(collect_custom, custom_qs)
 
-                results.append(
-                    {
-                        "id": item.id,
-                        "nome": item.nome,
-                        "grupo": item.grupo,
-                        "source": "TACO",
-                        "is_favorite": is_fav,
-                        "energia_kcal": item.energia_kcal,
-                        "proteina_g": item.proteina_g,
-                        "lipidios_g": item.lipidios_g,
-                        "carboidrato_g": item.carboidrato_g,
-                        "fibra_g": item.fibra_g,
-                        "unidade_caseira": uc,
-                        "peso_unidade_caseira_g": peso_uc,
-                        "medidas": measures_list,  # Nova lista de opções
-                    }
-                )
+        # Search TACO
+        if not source_filter or source_filter == "TACO":
+            taco_qs = AlimentoTACO.objects.all()
+            if grupo_filter:
+                taco_qs = taco_qs.filter(grupo__icontains=grupo_filter)
+            source_querysets["TACO"] = taco_qs
+            source_tasks["TACO"] = partial(collect_candidates, "TACO", filter_by_search(taco_qs, "TACO"))
 
         # Search TBCA
         if not source_filter or source_filter == "TBCA":
             tbca_qs = AlimentoTBCA.objects.all()
-            tbca_qs = apply_search_filter(tbca_qs, search_query)
             if grupo_filter:
                 tbca_qs = tbca_qs.filter(grupo__icontains=grupo_filter)
-
-            # Prioritize Favorites
-            tbca_fav_ids = [
-                int(k.split("_")[1]) for k in user_fav_keys if k.startswith("TBCA_")
-            ]
-            tbca_favorites = tbca_qs.filter(id__in=tbca_fav_ids)
-            tbca_others = tbca_qs.exclude(id__in=tbca_fav_ids)[:MAX_RESULTS_PER_SOURCE]
-
-            tbca_qs = list(chain(tbca_favorites, tbca_others))
-
-            for item in tbca_qs:
-                uc, peso_uc = item.unidade_caseira, item.peso_unidade_caseira_g
-                measures_list = []
-
-                mc_nome, mc_peso, mc_list = get_measure_data(item.nome)
-                if mc_list:
-                    measures_list = mc_list
-
-                if is_invalid_measure(uc) or not peso_uc:
-                    if mc_nome:
-                        uc, peso_uc = mc_nome, mc_peso
-                else:
-                    measures_list.insert(0, {"label": uc, "weight": peso_uc})
-
-                is_fav = f"TBCA_{item.id}" in user_fav_keys
-
-                results.append(
-                    {
-                        "id": item.id,
-                        "nome": item.nome,
-                        "grupo": item.grupo,
-                        "source": "TBCA",
-                        "is_favorite": is_fav,
-                        "energia_kcal": item.energia_kcal,
-                        "proteina_g": item.proteina_g,
-                        "lipidios_g": item.lipidios_g,
-                        "carboidrato_g": item.carboidrato_g,
-                        "fibra_g": item.fibra_g,
-                        "unidade_caseira": uc,
-                        "peso_unidade_caseira_g": peso_uc,
-                        "medidas": measures_list,
-                    }
-                )
+            source_querysets["TBCA"] = tbca_qs
+            source_tasks["TBCA"] = partial(collect_candidates, "TBCA", filter_by_search(tbca_qs, "TBCA"))
 
         # Search USDA
         if not source_filter or source_filter == "USDA":
             usda_qs = AlimentoUSDA.objects.all()
-            usda_qs = apply_search_filter(usda_qs, search_query)
             if grupo_filter:
                 usda_qs = usda_qs.filter(categoria__icontains=grupo_filter)
+            source_querysets["USDA"] = usda_qs
+            source_tasks["USDA"] = partial(collect_candidates, "USDA", filter_by_search(usda_qs, "USDA"))
 
-            # Prioritize Favorites
-            usda_fav_ids = [
-                int(k.split("_")[1]) for k in user_fav_keys if k.startswith("USDA_")
-            ]
-            usda_favorites = usda_qs.filter(id__in=usda_fav_ids)
-            usda_others = usda_qs.exclude(id__in=usda_fav_ids)[:MAX_RESULTS_PER_SOURCE]
+        # Uma fonte lenta não segura a requisição inteira: o que passar do
+        # tempo limite fica de fora desta resposta.
+        collected, timed_out = run_per_source(
+            source_tasks, timeout=getattr(settings, "FOOD_SEARCH_SOURCE_TIMEOUT", None)
+        )
+        for source in source_tasks:
+            if source in collected:
+                add_rows(source, *collected[source])
 
-            usda_qs = list(chain(usda_favorites, usda_others))
+        # Search IBGE (Tabela de Medidas - Sem informação nutricional)
+        # REMOVIDO DOS RESULTADOS DE BUSCA PARA EVITAR USO NA CRIAÇÃO DE DIETAS
+        # pois não contém dados nutricionais completos
 
-            for item in usda_qs:
-                uc, peso_uc = None, item.porcao_padrao_g
-                measures_list = []
+        if cacheable and cached_windows is None and not timed_out:
+            search_result_cache.set(cache_key, catalog_version, windows)
+
+        # Busca aproximada (erros de digitação: "brocolis", "frnago", "tilapa")
+        # quando a busca exata não encontra quase nada. Limitada a poucos
+        # candidatos do índice de trigramas e a uma query por fonte.
+        FUZZY_MIN_RESULTS = 5
+        FUZZY_MAX_RESULTS = 50
+        # Penalidade por dissimilaridade: resultados aproximados ficam abaixo
+        # dos exatos de mesmo score
+        FUZZY_PENALTY = 1000.0
+
+        if search_query and len(candidates) < FUZZY_MIN_RESULTS:
+            # Só as fontes pesquisadas e os alimentos personalizados do próprio
+            # nutricionista disputam as vagas do índice
+            fuzzy_sources = {
+                "PERSONAL" if source == "Sua Tabela" else source for source in source_querysets
+            }
+            custom_ids = set()
+            if "Sua Tabela" in source_querysets:
+                custom_ids = set(source_querysets["Sua Tabela"].values_list("id", flat=True))
+            try:
+                fuzzy = get_food_index().fuzzy_candidates(
+                    search_query,
+                    limit=FUZZY_MAX_RESULTS,
+                    sources=fuzzy_sources,
+                    custom_ids=custom_ids,
+                )
+            except Exception as e:
+                print(f"Fuzzy search unavailable: {e}")
+                fuzzy = []
 
-                mc_nome, mc_peso, mc_list = get_measure_data(item.nome)
-                if mc_list:
-                    measures_list = mc_list
-                if mc_nome:
-                    uc, peso_uc = mc_nome, mc_peso
+            seen = {(source, food_id) for source, food_id, _ in candidates}
+            fuzzy = [
+                ("Sua Tabela" if source == "PERSONAL" else source, food_id, sim, palavras)
+                for source, food_id, sim, palavras in fuzzy
+            ]
+            fuzzy_ids = {}
+            for source, food_id, _, _ in fuzzy:
+                if source in source_querysets and (source, food_id) not in seen:
+                    fuzzy_ids.setdefault(source, []).append(food_id)
+
+            fuzzy_names = {
+                source: dict(source_querysets[source].filter(id__in=ids).values_list("id", "nome"))
+                for source, ids in fuzzy_ids.items()
+            }
+            for source, food_id, sim, palavras in fuzzy:
+                nome = fuzzy_names.get(source, {}).get(food_id)
+                if nome is None or (source, food_id) in seen:
+                    continue
+                seen.add((source, food_id))
+                candidates.append((source, food_id, nome))
+                # Score como se a busca tivesse sido digitada com as palavras casadas
+                scores.append(calcular_score_radical(nome, palavras) - (1 - sim) * FUZZY_PENALTY)
 
-                # USDA doesn't have porcao_padrao_descricao, it only has porcao_padrao_g
-                # so we don't need to insert a custom measure here as 100g is implied or handled by IBGE lookup
+        print(f"DEBUG SEARCH: Total {len(candidates)}, TopScore: {max(scores) if scores else 0}")
 
-                is_fav = f"USDA_{item.id}" in user_fav_keys
+        # Se não houver resultados, retornar resposta vazia explicitamente
+        if not candidates:
+            print("DEBUG: Nenhum resultado encontrado para a busca")
+            return Response({"count": 0, "next": None, "previous": None, "results": []})
 
-                results.append(
-                    {
-                        "id": item.id,
-                        "nome": item.nome,
-                        "grupo": item.categoria,
-                        "source": "USDA",
-                        "is_favorite": is_fav,
-                        "energia_kcal": item.energia_kcal,
-                        "proteina_g": item.proteina_g,
-                        "lipidios_g": item.lipidios_g,
-                        "carboidrato_g": item.carboidrato_g,
-                        "fibra_g": item.fibra_g,
-                        "unidade_caseira": uc,
-                        "peso_unidade_caseira_g": peso_uc,
-                        "medidas": measures_list,
-                    }
-                )
+        def build_custom(item):
+            return {
+                "id": item.id,
+                "nome": item.nome,
+                "grupo": item.grupo or "Personalizado",
+                "source": "Sua Tabela",
+                "is_favorite": False, # Personal items are already 'special'
+                "energia_kcal": item.energia_kcal,
+                "proteina_g": item.proteina_g,
+                "lipidios_g": item.lipidios_g,
+                "carboidrato_g": item.carboidrato_g,
+                "fibra_g": item.fibra_g,
+                "unidade_caseira": item.unidade_caseira,
+                "peso_unidade_caseira_g": item.peso_unidade_caseira_g,
+                "medidas": [{"label": item.unidade_caseira, "weight": item.peso_unidade_caseira_g}] if item.unidade_caseira else [],
+            }
 
-        # Search IBGE (Tabela de Medidas - Sem informação nutricional)
-        # REMOVIDO DOS RESULTADOS DE BUSCA PARA EVITAR USO NA CRIAÇÃO DE DIETAS
-        # pois não contém dados nutricionais completos
-        # if not source_filter or source_filter == "IBGE":
-        #     # Buscar na tabela de medidas distinct por nome para evitar duplicatas excessivas
-        #     # Como a tabela de medidas tem múltiplas entradas por alimento (1 pra cada medida),
-        #     # precisamos agrupar.
-        #     ibge_qs = (
-        #         AlimentoMedidaIBGE.objects.filter(nome_alimento__icontains=search_query)
-        #         .values("nome_alimento")
-        #         .distinct()
-        #         .order_by("nome_alimento")
-        #     )
-        #
-        #     # Prioritize Favorites
-        #     ibge_favorites = ibge_qs.filter(nome_alimento__in=ibge_fav_names)
-        #     ibge_others = ibge_qs.exclude(nome_alimento__in=ibge_fav_names)[
-        if not source_filter or source_filter == "IBGE":
-            # IBGE SEARCH BLOCK DISABLED TO PREVENT ERRORS
-            # Because IBGE lacks nutrition data, we focused on TACO/TBCA/USDA
-            pass
-
-        # Aplicar scoring a todos os resultados (usar nome do alimento + tokens da query)
-        for res in results:
-            try:
-                res["search_score"] = calcular_score_radical(res.get("nome", ""), q_tokens)
-            except Exception:
-                res["search_score"] = 0
+        def build_brazilian(source, item, measures):
+            """TACO e TBCA: medida própria da tabela, com as do IBGE como alternativas."""
+            uc, peso_uc = item.unidade_caseira, item.peso_unidade_caseira_g
+            measures_list = []
 
-        # Ordenar por Score Decrescente
-        results.sort(key=lambda x: x["search_score"], reverse=True)
+            # Sempre buscar medidas alternativas no IBGE para dar opções ao usuário
+            mc_nome, mc_peso, mc_list = measures(item)
+            if mc_list:
+                measures_list = mc_list
 
-        print(f"DEBUG SEARCH: Total {len(results)}, TopScore: {results[0]['search_score'] if results else 0}")
+            # Se a medida original for ruim, sobrescreve com a melhor do IBGE
+            if is_invalid_measure(uc) or not peso_uc:
+                if mc_nome:
+                    uc, peso_uc = mc_nome, mc_peso
+            else:
+                # Se a original for boa, adiciona ela na lista de opções também
+                measures_list.insert(0, {"label": uc, "weight": peso_uc})
+
+            return {
+                "id": item.id,
+                "nome": item.nome,
+                "grupo": item.grupo,
+                "source": source,
+                "is_favorite": f"{source}_{item.id}" in user_fav_keys,
+                "energia_kcal": item.energia_kcal,
+                "proteina_g": item.proteina_g,
+                "lipidios_g": item.lipidios_g,
+                "carboidrato_g": item.carboidrato_g,
+                "fibra_g": item.fibra_g,
+                "unidade_caseira": uc,
+                "peso_unidade_caseira_g": peso_uc,
+                "medidas": measures_list,
+            }
 
+        def build_usda(item, measures):
+            uc, peso_uc = None, item.porcao_padrao_g
+            measures_list = []
+
+            mc_nome, mc_peso, mc_list = measures(item)
+            if mc_list:
+                measures_list = mc_list
+            if mc_nome:
+                uc, peso_uc = mc_nome, mc_peso
+
+            # USDA doesn't have porcao_padrao_descricao, it only has porcao_padrao_g
+            # so we don't need to insert a custom measure here as 100g is implied or handled by IBGE lookup
+
+            return {
+                "id": item.id,
+                "nome": item.nome,
+                "grupo": item.categoria,
+                "source": "USDA",
+                "is_favorite": f"USDA_{item.id}" in user_fav_keys,
+                "energia_kcal": item.energia_kcal,
+                "proteina_g": item.proteina_g,
+                "lipidios_g": item.lipidios_g,
+                "carboidrato_g": item.carboidrato_g,
+                "fibra_g": item.fibra_g,
+                "unidade_caseira": uc,
+                "peso_unidade_caseira_g": peso_uc,
+                "medidas": measures_list,
+            }
 
-        # Limitar resultados totais para evitar sobrecarga (Aumentado para 1000)
-        # Importante fazer isso DEPOIS do sort para não cortar favoritos que estariam no final da lista bruta
-        if len(results) > 1000:
-            results = results[:1000]
+        source_models = {
+            "Sua Tabela": CustomFood,
+            "TACO": AlimentoTACO,
+            "TBCA": AlimentoTBCA,
+            "USDA": AlimentoUSDA,
+        }
 
-        print(
-            f"DEBUG SEARCH: Total {len(results)}, Favs {sum(1 for x in results if x.get('is_favorite'))}"
-        )
+        def materialize(positions):
+            """Monta os dicts completos só para os candidatos da página, na ordem do ranking."""
+            ids_by_source = {}
+            for pos in positions:
+                source, food_id, _ = candidates[pos]
+                ids_by_source.setdefault(source, []).append(food_id)
+
+            built = {}
+            for source, ids in ids_by_source.items():
+                items = source_models[source].objects.in_bulk(ids)
+                if source == "Sua Tabela":
+                    for food_id, item in items.items():
+                        built[(source, food_id)] = build_custom(item)
+                    continue
 
-        print(f"DEBUG SEARCH FINAL: Total de resultados antes da paginação: {len(results)}")
+                measures = measures_lookup(source, items.values())
+                for food_id, item in items.items():
+                    if source == "USDA":
+                        built[(source, food_id)] = build_usda(item, measures)
+                    else:
+                        built[(source, food_id)] = build_brazilian(source, item, measures)
+
+            page = []
+            for pos in positions:
+                source, food_id, _ = candidates[pos]
+                res = built.get((source, food_id))
+                if res is not None:
+                    res["search_score"] = scores[pos]
+                    page.append(res)
+            return page
+
+        # Ordenar por Score Decrescente e limitar o total (1000): o Paginator só
+        # materializa a fatia da página, selecionada por heap (top-k).
+        results = TopKResults(scores, MAX_TOTAL_RESULTS, materialize)
 
-        # Se não houver resultados, retornar resposta vazia explicitamente
-        if not results:
-            print("DEBUG: Nenhum resultado encontrado para a busca")
-            return Response({"count": 0, "next": None, "previous": None, "results": []})
+        print(f"DEBUG SEARCH FINAL: Total de resultados antes da paginação: {len(results)}")
 
         # Paginate the results
         paginator = FoodPageNumberPagination()
@@ -676,6 +600,56 @@ class FoodSearchViewSet(viewsets.ViewSet):
 
         return response
 
+    @action(detail=False, methods=["GET"])
+    def autocomplete(self, request):
+        """
+        GET /api/v1/diets/foods/autocomplete/?q=arr&source=TACO
+        Sugestões leves (id, source, nome) para o campo de busca, servidas pelo
+        índice em memória. Os dados completos vêm da busca normal depois que o
+        usuário escolhe um item.
+        """
+        query = request.query_params.get("q", "").strip()
+        source_filter = request.query_params.get("source", "").upper()
+
+        if len(query) < 2:
+            return Response({"results": []})
+
+        if len(query) > 150:
+            return Response(
+                {"error": "A busca é muito longa. Máximo de 150 caracteres."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        sources = None
+        if source_filter in ("PERSONAL", "SUA TABELA"):
+            sources = {"PERSONAL"}
+        elif source_filter:
+            sources = {source_filter}
+
+        custom_ids = set()
+        if sources is None or "PERSONAL" in sources:
+            custom_ids = set(
+                CustomFood.objects.filter(
+                    nutritionist=request.user, is_active=True
+                ).values_list("id", flat=True)
+            )
+
+        suggestions = get_food_index().suggest(
+            query, limit=10, sources=sources, custom_ids=custom_ids
+        )
+        return Response(
+            {
+                "results": [
+                    {
+                        "id": food_id,
+                        "source": "Sua Tabela" if source == "PERSONAL" else source,
+                        "nome": nome,
+                    }
+                    for source, food_id, nome, _ in suggestions
+                ]
+            }
+        )
+
     @action(detail=False, methods=["GET"])
     def grupos(self, request):
         """
@@ -705,84 +679,106 @@ class FoodSearchViewSet(viewsets.ViewSet):
         if not request.user.is_authenticated:
             return Response({"results": []})
 
-        # Garantir cache carregado (especialmente para IBGE)
-        self.ensure_cache()
+        favorites = list(
+            FavoriteFood.objects.filter(user=request.user)
+            .order_by("-created_at")
+            .values_list("food_source", "food_id", "created_at")
+        )
 
-        favorites = FavoriteFood.objects.filter(user=request.user).order_by(
-            "-created_at"
+        # A resposta só muda se a lista de favoritos ou os dados dos alimentos
+        # (tabelas de referência, catálogo IBGE) mudarem.
+        etag = compute_etag(
+            favorites, get_catalog_version(REFERENCE), get_catalog_version(MEASURES)
         )
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        # Garantir cache carregado para os favoritos do IBGE
+        if any(source == "IBGE" for source, _, _ in favorites):
+            self.ensure_cache()
+
+        foods = self._get_foods_data((source, food_id) for source, food_id, _ in favorites)
         results = []
 
-        for fav in favorites:
-            food_data = self._get_food_data(fav.food_source, fav.food_id)
+        for source, food_id, _ in favorites:
+            food_data = foods.get((source, food_id))
             if food_data:
                 food_data["is_favorite"] = True
                 results.append(food_data)
 
-        return Response({"results": results})
+        return Response({"results": results}, headers={"ETag": etag})
+
+    @staticmethod
+    def _food_payload(food, source):
+        if source == "USDA":
+            food_id, grupo = food.fdc_id, food.categoria
+        else:
+            food_id, grupo = food.codigo, food.grupo
+        return {
+            "id": food_id,
+            "nome": food.nome,
+            "energia_kcal": food.energia_kcal,
+            "proteina_g": food.proteina_g,
+            "lipidios_g": food.lipidios_g,
+            "carboidrato_g": food.carboidrato_g,
+            "fibra_g": food.fibra_g,
+            "grupo": grupo,
+            "source": source,
+        }
+
+    def _get_foods_data(self, keys):
+        """
+        Busca em lote os dados de vários alimentos, como pares (fonte, id):
+        uma query por fonte (TACO/TBCA por código, USDA por fdc_id) e IBGE do
+        catálogo em memória. Retorna {(fonte, id): dados}; ids não encontrados
+        ficam de fora.
+        """
+        ids_by_source = {}
+        for source, food_id in keys:
+            ids_by_source.setdefault(source, set()).add(food_id)
+
+        found = {}
+        for source, model in (("TACO", AlimentoTACO), ("TBCA", AlimentoTBCA)):
+            ids = ids_by_source.get(source)
+            if ids:
+                for food in model.objects.filter(codigo__in=ids):
+                    found[(source, food.codigo)] = self._food_payload(food, source)
+
+        usda_ids = {}
+        for food_id in ids_by_source.get("USDA", ()):
+            try:
+                usda_ids.setdefault(int(food_id), []).append(food_id)
+            except (TypeError, ValueError):
+                continue
+        if usda_ids:
+            for food in AlimentoUSDA.objects.filter(fdc_id__in=usda_ids):
+                for food_id in usda_ids[food.fdc_id]:
+                    found[("USDA", food_id)] = self._food_payload(food, "USDA")
+
+        # Para IBGE, os dados completos vêm do cache
+        cache = getattr(FoodSearchViewSet, "IBGE_CACHE", {})
+        for food_id in ids_by_source.get("IBGE", ()):
+            if food_id in cache:
+                data = cache[food_id]
+                found[("IBGE", food_id)] = {
+                    "id": food_id,
+                    "nome": data["nome"],
+                    "energia_kcal": data["energia_kcal"],
+                    "proteina_g": data["proteina_g"],
+                    "lipidios_g": data["lipidios_g"],
+                    "carboidrato_g": data["carboidrato_g"],
+                    "fibra_g": data.get("fibra_g", 0),
+                    "grupo": data.get("grupo", "IBGE"),
+                    "source": "IBGE",
+                }
+        return found
 
     def _get_food_data(self, source, food_id):
         """Busca dados de um alimento específico em qualquer uma das fontes."""
         try:
-            if source == "TACO":
-                food = AlimentoTACO.objects.get(codigo=food_id)
-                return {
-                    "id": food.codigo,
-                    "nome": food.nome,
-                    "energia_kcal": food.energia_kcal,
-                    "proteina_g": food.proteina_g,
-                    "lipidios_g": food.lipidios_g,
-                    "carboidrato_g": food.carboidrato_g,
-                    "fibra_g": food.fibra_g,
-                    "grupo": food.grupo,
-                    "source": "TACO",
-                }
-            elif source == "TBCA":
-                food = AlimentoTBCA.objects.get(codigo=food_id)
-                return {
-                    "id": food.codigo,
-                    "nome": food.nome,
-                    "energia_kcal": food.energia_kcal,
-                    "proteina_g": food.proteina_g,
-                    "lipidios_g": food.lipidios_g,
-                    "carboidrato_g": food.carboidrato_g,
-                    "fibra_g": food.fibra_g,
-                    "grupo": food.grupo,
-                    "source": "TBCA",
-                }
-            elif source == "USDA":
-                food = AlimentoUSDA.objects.get(fdc_id=food_id)
-                return {
-                    "id": food.fdc_id,
-                    "nome": food.nome,
-                    "energia_kcal": food.energia_kcal,
-                    "proteina_g": food.proteina_g,
-                    "lipidios_g": food.lipidios_g,
-                    "carboidrato_g": food.carboidrato_g,
-                    "fibra_g": food.fibra_g,
-                    "grupo": food.categoria,
-                    "source": "USDA",
-                }
-            elif source == "IBGE":
-                # Para IBGE, os dados completos vêm do cache
-                # Acessa o cache da classe diretamente
-                cache = getattr(FoodSearchViewSet, "IBGE_CACHE", {})
-                if food_id in cache:
-                    data = cache[food_id]
-                    return {
-                        "id": food_id,
-                        "nome": data["nome"],
-                        "energia_kcal": data["energia_kcal"],
-                        "proteina_g": data["proteina_g"],
-                        "lipidios_g": data["lipidios_g"],
-                        "carboidrato_g": data["carboidrato_g"],
-                        "fibra_g": data.get("fibra_g", 0),
-                        "grupo": data.get("grupo", "IBGE"),
-                        "source": "IBGE",
-                    }
+            return self._get_foods_data([(source, food_id)]).get((source, food_id))
         except Exception:
-            pass
-        return None
+            return None
 
     @action(detail=False, methods=["POST"])
     def calculate_substitution(self, request):
@@ -904,6 +900,9 @@ class FoodSearchViewSet(viewsets.ViewSet):
         - source: Fonte do alimento (TACO, TBCA, USDA)
         - quantity_original_g: Quantidade original em gramas (padrão: 100)
         - limit: Número máximo de sugestões (padrão: 10)
+        - mode: "macro" (padrão, equaliza o macro preponderante do grupo) ou
+          "multi" (gramas que melhor aproximam proteína, carboidrato, gordura
+          e calorias juntos)
 
         Response:
         {
@@ -911,20 +910,21 @@ class FoodSearchViewSet(viewsets.ViewSet):
             "group": "carboidratos_complexos",
             "substitutions": [
                 {
+                    "id": 123,
                     "name": "batata, doce, cozida",
                     "quantity_g": 144.1,
                     "calories": 111.0,
                     "calorie_difference": 13.0,
-                    "source": "TACO"
+                    "macro_error": null,    // erro ponderado (kcal), modo "multi"
+                    "source": "TBCA"        // fonte do substituto ("Sua Tabela" p/ personalizados)
                 },
                 ...
             ]
         }
         """
         from .nutritional_substitution import (
-            sugerir_substitucoes,
-            identificar_grupo_nutricional,
-            NutricaoAlimento,
+            MODO_MACRO,
+            MODOS_SUBSTITUICAO,
             alimento_taco_para_nutricao,
             alimento_tbca_para_nutricao,
             alimento_usda_para_nutricao,
@@ -934,47 +934,33 @@ class FoodSearchViewSet(viewsets.ViewSet):
         source = request.query_params.get("source", "TACO")
         quantity_original = float(request.query_params.get("quantity_original_g", 100))
         limit = int(request.query_params.get("limit", 10))
+        mode = request.query_params.get("mode", MODO_MACRO)
 
         if not food_name:
             return Response(
                 {"error": "food_name é obrigatório"}, status=status.HTTP_400_BAD_REQUEST
             )
+        if mode not in MODOS_SUBSTITUICAO:
+            return Response(
+                {"error": f"mode deve ser um de: {', '.join(MODOS_SUBSTITUICAO)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fontes = {
+            "TACO": (AlimentoTACO, alimento_taco_para_nutricao),
+            "TBCA": (AlimentoTBCA, alimento_tbca_para_nutricao),
+            "USDA": (AlimentoUSDA, alimento_usda_para_nutricao),
+        }
 
         try:
             alimento_original = None
-            alimentos_substitutos = []
 
-            if source == "TACO":
+            if source in fontes:
+                modelo, para_nutricao = fontes[source]
                 try:
-                    food_obj = AlimentoTACO.objects.get(nome__icontains=food_name)
-                    alimento_original = alimento_taco_para_nutricao(food_obj)
-                    alimentos_substitutos = [
-                        alimento_taco_para_nutricao(f)
-                        for f in AlimentoTACO.objects.all()[:500]
-                    ]
-                except AlimentoTACO.DoesNotExist:
-                    pass
-
-            elif source == "TBCA":
-                try:
-                    food_obj = AlimentoTBCA.objects.get(nome__icontains=food_name)
-                    alimento_original = alimento_tbca_para_nutricao(food_obj)
-                    alimentos_substitutos = [
-                        alimento_tbca_para_nutricao(f)
-                        for f in AlimentoTBCA.objects.all()[:500]
-                    ]
-                except AlimentoTBCA.DoesNotExist:
-                    pass
-
-            elif source == "USDA":
-                try:
-                    food_obj = AlimentoUSDA.objects.get(nome__icontains=food_name)
-                    alimento_original = alimento_usda_para_nutricao(food_obj)
-                    alimentos_substitutos = [
-                        alimento_usda_para_nutricao(f)
-                        for f in AlimentoUSDA.objects.all()[:500]
-                    ]
-                except AlimentoUSDA.DoesNotExist:
+                    food_obj = modelo.objects.get(nome__icontains=food_name)
+                    alimento_original = para_nutricao(food_obj)
+                except modelo.DoesNotExist:
                     pass
 
             if not alimento_original:
@@ -983,7 +969,7 @@ class FoodSearchViewSet(viewsets.ViewSet):
                     status=status.HTTP_404_NOT_FOUND,
                 )
 
-            grupo = identificar_grupo_nutricional(alimento_original.nome)
+            grupo = alimento_original.grupo_nutricional
 
             if not grupo:
                 return Response(
@@ -993,19 +979,25 @@ class FoodSearchViewSet(viewsets.ViewSet):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            resultados = sugerir_substitucoes(
-                alimento_original, alimentos_substitutos, quantity_original, limit
+            # Candidatos do mesmo grupo em todas as tabelas (pool em memória)
+            resultados = get_substitution_pool().suggest(
+                alimento_original, quantity_original, limit,
+                nutritionist_id=request.user.id, modo=mode,
             )
 
             substitutions_response = []
             for r in resultados:
+                # O pool mistura as tabelas: fonte e id são os do substituto
+                sub = r.substituto
                 substitutions_response.append(
                     {
+                        "id": sub.id,
                         "name": r.alimento_substituto,
                         "quantity_g": r.quantidade_substituto_g,
                         "calories": r.calorias_substituto,
                         "calorie_difference": r.diferenca_calorica,
-                        "source": alimento_original.fonte,
+                        "macro_error": r.erro_macros,
+                        "source": "Sua Tabela" if sub.fonte == "PERSONAL" else sub.fonte,
                     }
                 )
 
@@ -1121,6 +1113,128 @@ class DietViewSet(viewsets.ModelViewSet):
             {"status": "PDF salvo com sucesso", "pdf_url": diet.pdf_file.url}
         )
 
+    @action(detail=True, methods=["POST"], url_path="substitutions/batch")
+    def substitutions_batch(self, request, pk=None):
+        """
+        POST /diets/{id}/substitutions/batch/
+        Substituições automáticas de vários itens da dieta em uma única chamada
+        (o painel de substituições abria uma requisição por alimento).
+
+        Body (opcional):
+        {
+            "item_ids": [12, 15, 40],   // padrão: todos os itens da dieta
+            "limit": 5,                 // substitutos por item (padrão 5, máx 20)
+            "mode": "macro"             // ou "multi" (ver suggest_substitutions)
+        }
+
+        Os itens compartilham a identificação de grupo e as matrizes de
+        candidatos do pool. O custo total é limitado por
+        SUBSTITUTION_BATCH_BUDGET (candidatos avaliados): itens além do limite
+        voltam em `skipped_item_ids` para uma nova chamada.
+        """
+        from .nutritional_substitution import MODO_MACRO, MODOS_SUBSTITUICAO, NutricaoAlimento
+
+        diet = self.get_object()
+
+        if not isinstance(request.data, dict):
+            return Response(
+                {"error": "O corpo da requisição deve ser um objeto JSON"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        mode = request.data.get("mode", MODO_MACRO)
+        if mode not in MODOS_SUBSTITUICAO:
+            return Response(
+                {"error": f"mode deve ser um de: {', '.join(MODOS_SUBSTITUICAO)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        item_ids = request.data.get("item_ids")
+        try:
+            limit = min(max(int(request.data.get("limit", 5)), 1), 20)
+            if item_ids is not None:
+                # Uma string também é iterável: "123" viraria os itens 1, 2 e 3
+                if not isinstance(item_ids, list):
+                    raise TypeError("item_ids")
+                item_ids = [int(item_id) for item_id in item_ids]
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "item_ids deve ser uma lista de ids e limit um número"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        items = FoodItem.objects.filter(meal__diet=diet).order_by(
+            "meal__day_of_week", "meal__order", "meal__time", "id"
+        )
+        if item_ids is not None:
+            items = items.filter(id__in=item_ids)
+        items = list(items)
+
+        def per_100g(value, quantity):
+            return float(value or 0) * 100.0 / quantity if quantity > 0 else 0.0
+
+        pedidos = []
+        for item in items:
+            quantity = float(item.quantity)
+            pedidos.append((
+                NutricaoAlimento(
+                    nome=item.food_name,
+                    energia_kcal=per_100g(item.calories, quantity),
+                    proteina_g=per_100g(item.protein, quantity),
+                    lipidios_g=per_100g(item.fats, quantity),
+                    carboidrato_g=per_100g(item.carbs, quantity),
+                    fibra_g=per_100g(item.fiber, quantity),
+                ),
+                quantity,
+            ))
+
+        budget = settings.SUBSTITUTION_BATCH_BUDGET
+        resultados = get_substitution_pool().suggest_batch(
+            pedidos, limit, nutritionist_id=request.user.id, orcamento=budget, modo=mode,
+        )
+
+        def substitute_payload(res):
+            sub = res.substituto
+            multiplier = res.quantidade_substituto_g / 100
+            return {
+                "food_id": sub.id,
+                "source": sub.fonte,
+                "name": res.alimento_substituto,
+                "quantity_g": res.quantidade_substituto_g,
+                "calorie_difference": res.diferenca_calorica,
+                "macro_equalized": res.macronutriente_igualizado,
+                "macro_error": res.erro_macros,
+                "macros": {
+                    "calories": res.calorias_substituto,
+                    "protein": round(sub.proteina_g * multiplier, 1),
+                    "carbs": round(sub.carboidrato_g * multiplier, 1),
+                    "fat": round(sub.lipidios_g * multiplier, 1),
+                    "fiber": round(sub.fibra_g * multiplier, 1),
+                },
+            }
+
+        results, skipped = [], []
+        for item, sugestoes in zip(items, resultados):
+            if sugestoes is None:
+                skipped.append(item.id)
+                continue
+            results.append({
+                "item_id": item.id,
+                "meal_id": item.meal_id,
+                "food_name": item.food_name,
+                "quantity": float(item.quantity),
+                "unit": item.unit,
+                "group": sugestoes[0].grupo if sugestoes else None,
+                "substitutions": [substitute_payload(res) for res in sugestoes],
+            })
+
+        return Response({
+            "diet_id": diet.id,
+            "items": results,
+            "skipped_item_ids": skipped,
+            "budget_exhausted": bool(skipped),
+        })
+
     def get_queryset(self):
         queryset = Diet.objects.filter(patient__nutritionist=self.request.user)
 
@@ -1279,6 +1393,8 @@ class FoodSubstitutionRuleViewSet(viewsets.ModelViewSet):
         food_source = request.query_params.get("food_source", "TACO")
         diet_type = request.query_params.get("diet_type", "normocalorica")
         original_quantity = float(request.query_params.get("quantity", 100))
+        # "macro" (padrão) ou "multi": ver FoodSearchViewSet.suggest_substitutions
+        mode = request.query_params.get("mode", "macro")
         
         # Macros Alvo enviadas pelo frontend (A VERDADE ABSOLUTA)
         t_ptn = request.query_params.get("orig_ptn")
@@ -1304,7 +1420,6 @@ class FoodSubstitutionRuleViewSet(viewsets.ModelViewSet):
             original_food = self._get_food_data(food_source, food_id)
         
         if not original_food and food_name:
-            from .models import AlimentoTACO
             search_name = food_name.split(',')[0].strip()
             original_food = AlimentoTACO.objects.filter(nome__icontains=search_name).first()
 
@@ -1313,18 +1428,22 @@ class FoodSubstitutionRuleViewSet(viewsets.ModelViewSet):
 
         # Usar Motor Centralizado de Substituição
         from .nutritional_substitution import (
-            sugerir_substitucoes, 
+            MODO_MACRO,
+            MODOS_SUBSTITUICAO,
             NutricaoAlimento, 
             identificar_grupo_nutricional,
-            alimento_taco_para_nutricao,
-            alimento_tbca_para_nutricao,
-            alimento_usda_para_nutricao
         )
-        from .models import AlimentoTACO, AlimentoTBCA, AlimentoUSDA
+        from .substitution_rules import sugerir_por_regras
+
+        if mode not in MODOS_SUBSTITUICAO:
+            return Response(
+                {"error": f"mode deve ser um de: {', '.join(MODOS_SUBSTITUICAO)}"},
+                status=400,
+            )
 
         try:
             # 1. Identificar Grupo e Bloqueios
-            group_name = identificar_grupo_nutricional(original_food.nome)
+            group_name = getattr(original_food, "grupo_nutricional", None) or identificar_grupo_nutricional(original_food.nome)
             
             # LOG DEBUG
             print(f">>> [SUGGEST NEW] Orig: {original_food.nome} | Group: {group_name}")
@@ -1346,61 +1465,82 @@ class FoodSubstitutionRuleViewSet(viewsets.ModelViewSet):
                         except (ValueError, TypeError):
                             return 0.0
 
-                    # Já é um objeto compatível ou Model
+                    # Já é um objeto compatível ou Model. Fonte e id só para
+                    # linhas do catálogo (habilitam o cache de substituições)
+                    catalog_sources = {
+                        AlimentoTACO: "TACO", AlimentoTBCA: "TBCA",
+                        AlimentoUSDA: "USDA", CustomFood: "PERSONAL",
+                    }
+                    catalog_source = catalog_sources.get(type(original_food))
                     current_nutri = NutricaoAlimento(
                         nome=original_food.nome,
                         energia_kcal=safe_float(original_food.energia_kcal),
                         proteina_g=safe_float(original_food.proteina_g),
                         lipidios_g=safe_float(original_food.lipidios_g),
                         carboidrato_g=safe_float(original_food.carboidrato_g),
-                        fibra_g=safe_float(getattr(original_food, 'fibra_g', 0))
+                        fibra_g=safe_float(getattr(original_food, 'fibra_g', 0)),
+                        fonte=catalog_source or "",
+                        id=original_food.pk if catalog_source else None,
                     )
                 else:
                     # Fallback genérico
                     current_nutri = NutricaoAlimento(name=food_name, energia_kcal=0, proteina_g=0, lipidios_g=0, carboidrato_g=0)
 
-                # Buscar Candidatos (Melhor performance)
-                # Idealmente buscaríamos de todas as fontes, mas vamos focar no TACO/TBCA para velocidade
-                candidates = []
-                
-                # TACO Slice
-                for f in AlimentoTACO.objects.all()[:1500]:
-                    try:
-                        candidates.append(alimento_taco_para_nutricao(f))
-                    except Exception as e:
-                        # Skip bad records silently
-                        pass
-                
-                # TBCA Slice (se necessário, pode descomentar)
-                # for f in AlimentoTBCA.objects.all()[:1000]:
-                #    candidates.append(alimento_tbca_para_nutricao(f))
-
-                # CHAMADA CORE: Motor de Substituição
-                suggestions = sugerir_substitucoes(
-                    current_nutri, 
-                    candidates, 
-                    quantidade_original_g=original_quantity, 
-                    limite_resultados=10
-                )
+                # Regras geradas para o tipo de dieta (calcular_regras_substituicao);
+                # sem regras para o alimento (ou no modo "multi"), o motor de
+                # substituição sobre o pool do grupo (TACO, TBCA, USDA e os
+                # alimentos personalizados do nutricionista)
+                pool = get_substitution_pool()
+                suggestions = []
+                if mode == MODO_MACRO:
+                    suggestions = sugerir_por_regras(
+                        current_nutri,
+                        original_quantity,
+                        diet_type,
+                        pool.matrix(identificar_grupo_nutricional(current_nutri.nome)),
+                        limite_resultados=10,
+                    )
+                if not suggestions:
+                    suggestions = pool.suggest(
+                        current_nutri,
+                        quantidade_original_g=original_quantity,
+                        limite_resultados=10,
+                        nutritionist_id=request.user.id,
+                        modo=mode,
+                    )
 
-                # Mapear para Formato de Resposta do Frontend
+                # Mapear para Formato de Resposta do Frontend: o substituto vem
+                # do pool com fonte, id e nutrientes, então a resposta já traz
+                # tudo o que a tela usa (sem uma requisição extra por sugestão)
                 for res in suggestions:
-                    # Tentar recuperar objeto original p/ ID se possível, ou usar nada
-                    # O frontend precisa de 'food' object serializado ou similar
-                    # Vamos simplificar devolvendo o UnifiedFoodSerializer estruturado manualmente
-                    
+                    sub = res.substituto
+                    source = "Sua Tabela" if sub.fonte == "PERSONAL" else sub.fonte
+                    multiplier = res.quantidade_substituto_g / 100
                     results.append({
-                        "id": f"sub_auto_{res.alimento_substituto}", # Fake ID único
+                        "id": f"auto_{sub.fonte}_{sub.id}",
                         "food": {
+                            "id": sub.id,
                             "nome": res.alimento_substituto,
                             "grupo": res.grupo,
-                            "energia_kcal": res.calorias_por_100g_substituto, # Aprox
-                            "proteina_g": 0, # Não temos detalhe aqui sem query
-                            "carboidrato_g": 0,
-                            "lipidios_g": 0,
-                            "source": "AUTO"
+                            "source": source,
+                            # Valores por 100g, como nos resultados da busca
+                            "energia_kcal": sub.energia_kcal,
+                            "proteina_g": sub.proteina_g,
+                            "carboidrato_g": sub.carboidrato_g,
+                            "lipidios_g": sub.lipidios_g,
+                            "fibra_g": sub.fibra_g,
                         },
                         "suggested_quantity": res.quantidade_substituto_g,
+                        # Valores da porção sugerida
+                        "macros": {
+                            "calories": res.calorias_substituto,
+                            "protein": round(sub.proteina_g * multiplier, 1),
+                            "carbs": round(sub.carboidrato_g * multiplier, 1),
+                            "fat": round(sub.lipidios_g * multiplier, 1),
+                            "fiber": round(sub.fibra_g * multiplier, 1),
+                        },
+                        "calorie_difference": res.diferenca_calorica,
+                        "macro_error": res.erro_macros,
                         "similarity_score": 0.95, # Fixo por enquanto, pois passou no filtro
                         "notes": f"Equivalência por {res.macronutriente_igualizado}"
                     })
@@ -1921,14 +2061,10 @@ class FoodSubstitutionsViewSet(viewsets.ViewSet):
                 group__predominant_nutrient=target_predominant
             )
 
-        # Filtrar alimentos crus (cru/crua)
-        substitutions = [
-            s
-            for s in substitutions
-            if not any(kw in s.substitute_food_name.lower() for kw in ["cru", "crua"])
-        ]
-
-        substitutions = substitutions[:7]
+        # Filtrar alimentos crus (cru/crua, marcados no save) e limitar no banco
+        substitutions = substitutions.filter(is_raw=False).order_by(
+            "group", "order", "substitute_food_name"
+        )[:7]
 
         results = []
         for sub in substitutions:
@@ -0,0 +1,24 @@
+"""
+Configuração do gunicorn (lida automaticamente do diretório de trabalho).
+
+O app é carregado no master antes do fork para que o catálogo de alimentos
+(índice de busca e catálogo IBGE) seja montado uma única vez e herdado pelos
+workers, em vez de cada worker montá-lo na primeira requisição.
+"""
+
+preload_app = True
+
+
+def when_ready(server):
+    from django.db import connections
+
+    try:
+        from diets.catalog import warm_catalogs
+
+        warm_catalogs()
+        server.log.info("Food catalog preloaded")
+    except Exception as e:
+        server.log.warning(f"Food catalog preload failed, workers will build it lazily: {e}")
+    finally:
+        # Conexões abertas no master não podem ser compartilhadas com os workers
+        connections.close_all()
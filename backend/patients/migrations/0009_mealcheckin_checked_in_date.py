@@ -0,0 +1,55 @@
+# Generated by Django 5.0.2 on 2026-10-18 08:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def preencher_datas_e_remover_duplicados(apps, schema_editor):
+    # Dia local de cada check-in; duplicados do mesmo dia (requisições
+    # concorrentes) ficam só com o primeiro
+    MealCheckIn = apps.get_model("patients", "MealCheckIn")
+    por_data = {}
+    vistos = set()
+    duplicados = []
+    rows = MealCheckIn.objects.order_by("checked_in_at", "id").values_list(
+        "id", "patient_id", "meal_id", "checked_in_at"
+    )
+    for checkin_id, patient_id, meal_id, checked_in_at in rows.iterator():
+        dia = django.utils.timezone.localdate(checked_in_at)
+        chave = (patient_id, meal_id, dia)
+        if chave in vistos:
+            duplicados.append(checkin_id)
+            continue
+        vistos.add(chave)
+        por_data.setdefault(dia, []).append(checkin_id)
+
+    for inicio in range(0, len(duplicados), 500):
+        MealCheckIn.objects.filter(id__in=duplicados[inicio:inicio + 500]).delete()
+    for dia, ids in por_data.items():
+        for inicio in range(0, len(ids), 500):
+            MealCheckIn.objects.filter(id__in=ids[inicio:inicio + 500]).update(checked_in_date=dia)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diets', '0011_alter_defaultpreset_diet_type_and_more'),
+        ('patients', '0008_mealphoto'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='mealcheckin',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='mealcheckin',
+            name='checked_in_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(preencher_datas_e_remover_duplicados, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='mealcheckin',
+            unique_together={('patient', 'meal', 'checked_in_date')},
+        ),
+    ]
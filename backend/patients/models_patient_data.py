@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.conf import settings
 from patients.models import PatientProfile
 
@@ -50,11 +51,13 @@ class MealCheckIn(models.Model):
         related_name='checkins'
     )
     checked_in_at = models.DateTimeField(auto_now_add=True)
+    # Dia local do check-in: no máximo um por refeição e dia
+    checked_in_date = models.DateField(default=timezone.localdate)
     
     class Meta:
         db_table = 'meal_checkins'
         ordering = ['-checked_in_at']
-        unique_together = ['patient', 'meal', 'checked_in_at']
+        unique_together = ['patient', 'meal', 'checked_in_date']
     
     def __str__(self):
         return f"{self.patient} - {self.meal} - {self.checked_in_at}"
@@ -0,0 +1,79 @@
+import datetime
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from diets.models import Diet, Meal
+from ..models import PatientProfile
+from ..models_patient_data import MealCheckIn
+
+User = get_user_model()
+
+class MealCheckInTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.nutritionist = User.objects.create_user(
+            email='nutri@test.com',
+            password='password123',
+            name='Nutri Test',
+            user_type='nutricionista'
+        )
+        self.patient_user = User.objects.create_user(
+            email='patient@test.com',
+            password='password123',
+            name='Patient Test',
+            user_type='paciente'
+        )
+        self.patient = PatientProfile.objects.create(
+            user=self.patient_user,
+            nutritionist=self.nutritionist
+        )
+        self.client.force_authenticate(user=self.patient_user)
+
+        diet = Diet.objects.create(patient=self.patient, name="Dieta", meals=[])
+        today = datetime.datetime.now().weekday()
+        self.meals = [
+            Meal.objects.create(diet=diet, name=name, time=datetime.time(hour), day_of_week=today)
+            for name, hour in [("Café", 0), ("Almoço", 1), ("Jantar", 2)]
+        ]
+
+    def test_check_in_all_is_idempotent(self):
+        MealCheckIn.objects.create(patient=self.patient, meal=self.meals[0])
+
+        response = self.client.post('/api/v1/patients/me/meals/check_in_all/')
+        self.assertEqual(response.json()["message"], "2 refeições registradas com sucesso.")
+        response = self.client.post('/api/v1/patients/me/meals/check_in_all/')
+        self.assertEqual(response.json()["message"], "0 refeições registradas com sucesso.")
+        self.assertEqual(MealCheckIn.objects.filter(patient=self.patient).count(), 3)
+
+        # Check-in repetido da mesma refeição não duplica o registro
+        response = self.client.post(f'/api/v1/patients/me/meals/{self.meals[0].id}/check_in/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MealCheckIn.objects.filter(meal=self.meals[0]).count(), 1)
+
+    def test_meal_list_uses_todays_check_ins(self):
+        MealCheckIn.objects.create(patient=self.patient, meal=self.meals[2])
+        MealCheckIn.objects.create(
+            patient=self.patient, meal=self.meals[1],
+            checked_in_date=datetime.date.today() - datetime.timedelta(days=1),
+        )
+
+        response = self.client.get('/api/v1/patients/me/meals/')
+        statuses = {meal["name"]: meal["status"] for meal in response.json()}
+        self.assertEqual(statuses["Jantar"], "completed")
+        self.assertEqual(MealCheckIn.objects.filter(patient=self.patient).count(), 2)
+
+    def test_check_in_all_counts_only_inserted_rows(self):
+        from unittest import mock
+
+        bulk_create = MealCheckIn.objects.bulk_create
+
+        def concorrente(objs, **kwargs):
+            # Outra requisição registra uma das refeições antes desta inserção
+            MealCheckIn.objects.create(patient=self.patient, meal=self.meals[1])
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(MealCheckIn.objects, "bulk_create", side_effect=concorrente):
+            response = self.client.post('/api/v1/patients/me/meals/check_in_all/')
+        self.assertEqual(response.json()["message"], "2 refeições registradas com sucesso.")
+        self.assertEqual(MealCheckIn.objects.filter(patient=self.patient).count(), 3)
@@ -2,7 +2,10 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from utils.http import compute_etag, etag_matches
 from datetime import date
 import unicodedata
 
@@ -23,17 +26,7 @@ from .serializers_patient_data import (
     ClinicalNoteSerializer,
     MealPhotoSerializer,
 )
-import unicodedata
-
-def normalize_text(text):
-    if not text:
-        return ""
-    text = (
-        unicodedata.normalize("NFKD", text)
-        .encode("ascii", "ignore")
-        .decode("utf8")
-    )
-    return text.lower().strip()
+from diets.day_snapshot import normalize_text
 
 def get_significant_words(text):
     words = normalize_text(text).split()
@@ -142,7 +135,6 @@ class PatientMealsViewSet(viewsets.ViewSet):
 
     def list(self, request):
         """GET /api/v1/patients/me/meals/"""
-        from diets.models import Diet, Meal
         from datetime import datetime
 
         try:
@@ -169,207 +161,45 @@ class PatientMealsViewSet(viewsets.ViewSet):
             current_day = today.weekday()  # 0=Monday, 6=Sunday
             current_time = today.time()
 
-            # Get active diet for patient
-            active_diet = Diet.objects.filter(patient=patient, is_active=True).first()
+            # Get active diet for patient (pelo related manager, a dieta já vem
+            # com o paciente, usado na versão do snapshot)
+            active_diet = patient.diets.filter(is_active=True).first()
 
             if not active_diet:
                 return Response([])
 
-            # Get meals for today from the diet
-            meals = (
-                Meal.objects.filter(diet=active_diet, day_of_week=current_day)
-                .prefetch_related("items")
-                .order_by("time")
+            # Plano do dia pré-calculado (refeições, itens, macros e
+            # substituições); aqui só entram o status por horário e os check-ins
+            from diets.day_snapshot import refeicoes_do_dia
+
+            result = refeicoes_do_dia(
+                active_diet, current_day, orcamento=settings.SUBSTITUTION_BATCH_BUDGET
             )
 
-            # FALLBACK: Se não houver refeições para hoje, tentar dia 0 (padrão)
-            # ou o primeiro dia disponível na dieta.
-            if not meals.exists():
-                available_days = Meal.objects.filter(diet=active_diet).values_list('day_of_week', flat=True).distinct()
-                if available_days.exists():
-                    fallback_day = 0 if 0 in available_days else sorted(list(available_days))[0]
-                    meals = (
-                        Meal.objects.filter(diet=active_diet, day_of_week=fallback_day)
-                        .prefetch_related("items")
-                        .order_by("time")
-                    )
+            # Check-ins de hoje de todas as refeições em uma consulta
+            checked_in_meal_ids = set(
+                MealCheckIn.objects.filter(
+                    patient=patient,
+                    meal_id__in=[meal["id"] for meal in result],
+                    checked_in_date=timezone.localdate(),
+                ).values_list("meal_id", flat=True)
+            )
 
-            result = []
-            for meal in meals:
+            for meal in result:
                 # Determine status based on time
-                if meal.time < current_time:
-                    status = "completed"
-                elif meal.time.hour == current_time.hour:
-                    status = "current"
+                meal_time = datetime.strptime(meal["time"], "%H:%M").time()
+                if meal_time < current_time:
+                    meal_status = "completed"
+                elif meal_time.hour == current_time.hour:
+                    meal_status = "current"
                 else:
-                    status = "pending"
+                    meal_status = "pending"
 
                 # Check if already checked-in today
-                checkin_exists = MealCheckIn.objects.filter(
-                    patient=patient, meal=meal, checked_in_at__date=today.date()
-                ).exists()
-
-                if checkin_exists:
-                    status = "completed"
-
-                # Get food items structured
-                items = []
-                total_calories = 0
-                total_protein = 0
-                total_carbs = 0
-                total_fats = 0
-
-                # Get diet-wide substitutions
-                diet_subs = active_diet.substitutions or []
-                print(
-                    f"DEBUG: Dieta '{active_diet.name}' ativa. Regras de substituição: {len(diet_subs)}"
-                )
-
-                for item in meal.items.all():
-                    item_calories = float(item.calories) if item.calories else 0
-                    item_protein = float(item.protein) if item.protein else 0
-                    item_carbs = float(item.carbs) if item.carbs else 0
-                    item_fats = float(item.fats) if item.fats else 0
-
-                    total_calories += item_calories
-                    total_protein += item_protein
-                    total_carbs += item_carbs
-                    total_fats += item_fats
-
-
-
-                # === SUBSTITUTION LOGIC ===
-                    # 1. Prioritize Strict/Manual Substitutions from the Diet Plan
-                    # This ensures that what the nutritionist explicitly defined is what the patient sees.
-                    
-                    sub_options = []
-                    found_manual_sub = False
-
-                    # Normalize current item name for matching
-                    item_name_norm = normalize_text(item.food_name)
-                    
-                    for sub_group in diet_subs:
-                        original_name = sub_group.get("original", "")
-                        original_norm = normalize_text(original_name)
-                        
-                        # Check for exact match or robust containment (both ways)
-                        # We also check if the item is part of the original name or vice-versa
-                        # This handles cases like "Arroz Branco" matching "Arroz"
-                        is_match = False
-                        if original_norm and (
-                            original_norm == item_name_norm 
-                            or original_norm in item_name_norm
-                            or item_name_norm in original_norm
-                        ):
-                            is_match = True
-                        
-                        if is_match:
-                            try:
-                                # Add manual options
-                                for opt in sub_group.get("options", []):
-                                    sub_options.append({
-                                        "name": opt.get("name", ""),
-                                        "quantity": float(opt.get("quantity", 0)),
-                                        "unit": opt.get("unit", item.unit),
-                                        "kcal": 0, # Frontend handles display or we could calc if DB link existed
-                                        "group": "Indicado pelo Nutri",
-                                        "source": "manual"
-                                    })
-                                found_manual_sub = True
-                                print(f"DEBUG: MATCH MANUAL ENCONTRADO para {item.food_name} com regra {original_name}!")
-                            except Exception as sub_err:
-                                print(f"Erro ao processar substituição manual: {sub_err}")
-                    
-                    # 2. Auto-Substitutions (Fallback)
-                    # This searches for similar foods in the same nutritional group
-                    if not found_manual_sub:
-                        try:
-                            from diets.nutritional_substitution import (
-                                sugerir_substitucoes, 
-                                identificar_grupo_nutricional, 
-                                NutricaoAlimento,
-                                alimento_taco_para_nutricao
-                            )
-                            from diets.models import AlimentoTACO
-                            
-                            # Use logic centralizada e estrita
-                            # 1. Identificar se vale a pena buscar (se for agua de coco, já volta vazio ou grupo de bloqueio)
-                            group_name = identificar_grupo_nutricional(item.food_name)
-                            
-                            # Se for grupo de bloqueio (agua_de_coco), nem busca candidatos
-                            if group_name == "agua_de_coco":
-                                # Logica de bloqueio explícito
-                                pass
-                            elif group_name:
-                                # Create NutricaoAlimento for current item
-                                current_nutri = NutricaoAlimento(
-                                    nome=item.food_name,
-                                    energia_kcal=item_calories * (100.0/float(item.quantity)) if float(item.quantity) > 0 else 0,
-                                    proteina_g=item_protein * (100.0/float(item.quantity)) if float(item.quantity) > 0 else 0,
-                                    lipidios_g=item_fats * (100.0/float(item.quantity)) if float(item.quantity) > 0 else 0,
-                                    carboidrato_g=item_carbs * (100.0/float(item.quantity)) if float(item.quantity) > 0 else 0,
-                                    fibra_g=float(item.fiber or 0) * (100.0/float(item.quantity)) if float(item.quantity) > 0 else 0
-                                )
-                                
-                                # Fetch candidates (optimized slice)
-                                candidates_taco = [alimento_taco_para_nutricao(f) for f in AlimentoTACO.objects.all()[:1000]]
-                                
-                                # Call the STRICT engine
-                                suggestions = sugerir_substitucoes(current_nutri, candidates_taco, float(item.quantity), limit_resultados=5)
-                                
-                                for res in suggestions:
-                                    sub_options.append({
-                                        "name": res.alimento_substituto,
-                                        "quantity": res.quantidade_substituto_g,
-                                        "unit": "g",
-                                        "kcal": res.calorias_substituto,
-                                        "group": res.grupo.replace("_", " ").title(),
-                                        "source": "auto"
-                                    })
-                        except Exception as auto_err:
-                            print(f"Erro no fallback de substituição: {auto_err}")
-                            
-                    # ID e Fonte Técnica para Substituições Precisas
-                    item_food_id = None
-                    item_source = "TACO"
-                    if item.taco_food:
-                        item_food_id = item.taco_food.id
-                        item_source = "TACO"
-                    elif item.tbca_food:
-                        item_food_id = item.tbca_food.id
-                        item_source = "TBCA"
-                    elif item.usda_food:
-                        item_food_id = item.usda_food.id
-                        item_source = "USDA"
-
-                    items.append(
-                        {
-                            "name": item.food_name,
-                            "quantity": float(item.quantity),
-                            "unit": item.unit,
-                            "kcal": item_calories,
-                            "protein": item_protein,
-                            "carbs": item_carbs,
-                            "fats": item_fats,
-                            "food_id": item_food_id,
-                            "food_source": item_source,
-                            "substitutions": sub_options,
-                        }
-                    )
+                if meal["id"] in checked_in_meal_ids:
+                    meal_status = "completed"
 
-                result.append(
-                    {
-                        "id": meal.id,
-                        "name": meal.name,
-                        "time": meal.time.strftime("%H:%M"),
-                        "calories": int(total_calories),
-                        "protein": int(total_protein),
-                        "carbs": int(total_carbs),
-                        "fats": int(total_fats),
-                        "items": items,
-                        "status": status,
-                    }
-                )
+                meal["status"] = meal_status
 
             return Response(result)
 
@@ -398,6 +228,46 @@ class PatientMealsViewSet(viewsets.ViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+    @action(detail=False, methods=["get"])
+    def week(self, request):
+        """GET /api/v1/patients/me/meals/week/"""
+        from diets.day_snapshot import refeicoes_da_semana, snapshot_version
+
+        if request.user.user_type != "paciente":
+            return Response(
+                {"error": "Acesso negado."}, status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            patient = request.user.patient_profile
+        except PatientProfile.DoesNotExist:
+            return Response(
+                {"error": "Patient profile not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        active_diet = patient.diets.filter(is_active=True).first()
+        if not active_diet:
+            return Response([])
+
+        # A semana só muda com a dieta (refeições e itens atualizam o
+        # updated_at), com as tabelas de referência ou com os alimentos
+        # personalizados do nutricionista do paciente: é o que compõe a
+        # versão do snapshot
+        etag = compute_etag(active_diet.pk, snapshot_version(active_diet))
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        days, complete = refeicoes_da_semana(
+            active_diet, orcamento=settings.SUBSTITUTION_BATCH_BUDGET
+        )
+        result = [
+            {"day_of_week": day_of_week, "meals": meals}
+            for day_of_week, meals in enumerate(days)
+        ]
+        # Sem ETag quando o orçamento deixou itens sem substituições: a próxima
+        # chamada monta a semana de novo em vez de reaproveitar a incompleta
+        return Response(result, headers={"ETag": etag} if complete else None)
+
     @action(detail=True, methods=["post"])
     def check_in(self, request, pk=None):
         """POST /api/v1/patients/me/meals/{id}/check-in/"""
@@ -407,13 +277,16 @@ class PatientMealsViewSet(viewsets.ViewSet):
             patient = request.user.patient_profile
             meal = get_object_or_404(Meal, pk=pk)
 
-            # Create check-in record
-            MealCheckIn.objects.create(patient=patient, meal=meal)
+            # Um check-in por refeição e dia: repetições não duplicam o registro
+            checkin, created = MealCheckIn.objects.get_or_create(
+                patient=patient, meal=meal, checked_in_date=timezone.localdate()
+            )
+            if not created:
+                return Response({"status": "checked_in"}, status=status.HTTP_200_OK)
 
             # Criar notificação para o nutricionista
             try:
                 from notifications.models import Notification
-                from django.utils import timezone
                 
                 Notification.objects.create(
                     user=patient.nutritionist,
@@ -479,18 +352,38 @@ class PatientMealsViewSet(viewsets.ViewSet):
                 {"error": "No active diet found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        meals = Meal.objects.filter(diet=active_diet, day_of_week=current_day)
+        meal_ids = list(
+            Meal.objects.filter(diet=active_diet, day_of_week=current_day).values_list(
+                "id", flat=True
+            )
+        )
 
-        count = 0
-        for meal in meals:
-            checkin, created = MealCheckIn.objects.get_or_create(
+        # Uma inserção para todas as refeições; as que já têm check-in hoje
+        # (inclusive de uma requisição concorrente) são ignoradas pelo banco
+        checkin_date = timezone.localdate()
+        already_checked_in = set(
+            MealCheckIn.objects.filter(
+                patient=patient, meal_id__in=meal_ids, checked_in_date=checkin_date
+            ).values_list("meal_id", flat=True)
+        )
+        new_checkins = [
+            MealCheckIn(patient=patient, meal_id=meal_id, checked_in_date=checkin_date)
+            for meal_id in meal_ids
+            if meal_id not in already_checked_in
+        ]
+        MealCheckIn.objects.bulk_create(new_checkins, ignore_conflicts=True)
+        # Recontagem após a inserção: linhas descartadas pelo ignore_conflicts
+        # (check-in concorrente, com outro checked_in_at) não contam aqui
+        inserted = {(checkin.meal_id, checkin.checked_in_at) for checkin in new_checkins}
+        count = sum(
+            1
+            for row in MealCheckIn.objects.filter(
                 patient=patient,
-                meal=meal,
-                checked_in_at__date=today.date(),
-                defaults={"checked_in_at": today},
-            )
-            if created:
-                count += 1
+                meal_id__in=[meal_id for meal_id, _ in inserted],
+                checked_in_date=checkin_date,
+            ).values_list("meal_id", "checked_in_at")
+            if row in inserted
+        )
 
         return Response(
             {"message": f"{count} refeições registradas com sucesso."},
@@ -209,6 +209,25 @@ else:
         }
     }
 
+# Cache de resultados da busca de alimentos (por worker, LRU)
+FOOD_SEARCH_CACHE_SIZE = config('FOOD_SEARCH_CACHE_SIZE', default=500, cast=int)
+# Total de linhas (id, nome, score) guardadas no cache, somando todas as entradas
+FOOD_SEARCH_CACHE_ROWS = config('FOOD_SEARCH_CACHE_ROWS', default=100000, cast=int)
+
+# Busca de alimentos: consultas por fonte (Sua Tabela, TACO, TBCA, USDA) em paralelo,
+# com tempo limite por fonte (segundos) para que uma fonte lenta não trave a busca
+FOOD_SEARCH_PARALLEL = config('FOOD_SEARCH_PARALLEL', default=True, cast=bool)
+FOOD_SEARCH_WORKERS = config('FOOD_SEARCH_WORKERS', default=4, cast=int)
+FOOD_SEARCH_SOURCE_TIMEOUT = config('FOOD_SEARCH_SOURCE_TIMEOUT', default=5.0, cast=float)
+
+# Substituições em lote de uma dieta: máximo de candidatos avaliados por requisição
+SUBSTITUTION_BATCH_BUDGET = config('SUBSTITUTION_BATCH_BUDGET', default=100000, cast=int)
+
+# Cache de substituições por alimento (razões por grama, independentes da quantidade):
+# entradas no LRU de cada worker e validade (segundos) no cache compartilhado
+SUBSTITUTION_CACHE_SIZE = config('SUBSTITUTION_CACHE_SIZE', default=2000, cast=int)
+SUBSTITUTION_CACHE_TIMEOUT = config('SUBSTITUTION_CACHE_TIMEOUT', default=86400, cast=int)
+
 AUTH_PASSWORD_VALIDATORS = [{'NAME':'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},{'NAME':'django.contrib.auth.password_validation.MinimumLengthValidator',},{'NAME':'django.contrib.auth.password_validation.CommonPasswordValidator',},{'NAME':'django.contrib.auth.password_validation.NumericPasswordValidator',}]
 
 LANGUAGE_CODE = 'pt-br'
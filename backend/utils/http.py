@@ -0,0 +1,24 @@
+import hashlib
+
+from django.utils.http import parse_etags, quote_etag
+
+
+def compute_etag(*parts):
+    """
+    ETag forte a partir de valores que identificam a versão de uma resposta
+    (ids, timestamps, versões de catálogo...).
+    """
+    digest = hashlib.md5(repr(parts).encode("utf-8")).hexdigest()
+    return quote_etag(digest)
+
+
+def etag_matches(request, etag):
+    """True se o cliente já tem esta versão (If-None-Match), ou seja, cabe um 304."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if "*" in etags:
+        return True
+    # Comparação fraca (RFC 9110): ignora o prefixo W/
+    return etag.removeprefix("W/") in {tag.removeprefix("W/") for tag in etags}